@@ -0,0 +1,317 @@
+import json
+import logging
+import time
+import weakref
+
+import pandas as pd
+import pyarrow as pa
+import redis
+
+log = logging.getLogger(__name__)
+
+
+# bars shared between service workers through redis, so N workers hold one warm copy
+# between them rather than fetching and computing N. Each (symbol, interval) is one
+# hash: a "meta" field plus one field per chunk of chunk_rows rows, each chunk a zstd
+# compressed arrow stream. Being one key, a read is a single HGETALL and always sees a
+# whole write. New bars only rewrite the chunks from the last stored row on. Once redis
+# fails it's left alone for backoff seconds, loads find nothing and saves are dropped
+# rather than every request waiting on it to fail again
+class RedisBarStore:
+    def __init__(
+        self, client, chunk_rows: int = 4096, ttl: int = None, backoff: float = 30
+    ):
+        # client has to be made with decode_responses=False, chunks are binary, and
+        # ideally with a socket_timeout so a hung redis can't hold a thread forever
+        self._client = client
+        self.chunk_rows = chunk_rows
+        # seconds before redis drops a series nobody has saved in a while
+        self.ttl = ttl
+        self.backoff = backoff
+        self.failed_at = None
+        self._options = pa.ipc.IpcWriteOptions(compression="zstd")
+
+    def key(self, symbol: str, interval: str) -> str:
+        return f"bars:{interval}:{symbol}"
+
+    def available(self) -> bool:
+        return self.failed_at is None or time.time() - self.failed_at > self.backoff
+
+    def load(self, symbol: str, interval: str, max_age: float = None) -> pd.DataFrame:
+        # None if there's nothing stored, it's older than max_age seconds, or it
+        # doesn't hang together (eg. a chunk from a different set of columns)
+        if not self.available():
+            return None
+        fields = self._call(self._client.hgetall, self.key(symbol, interval))
+        if not fields or b"meta" not in fields:
+            return None
+
+        meta = json.loads(fields[b"meta"])
+        if max_age is not None and time.time() - meta["saved_at"] > max_age:
+            return None
+
+        chunks = [fields.get(str(chunk).encode()) for chunk in range(meta["chunks"])]
+        if any(chunk is None for chunk in chunks):
+            return None
+
+        bars = pa.concat_tables(
+            [pa.ipc.open_stream(chunk).read_all() for chunk in chunks]
+        ).to_pandas()
+        if list(bars.columns) != meta["columns"] or len(bars) != meta["rows"]:
+            return None
+        bars.attrs["ta"] = meta.get("ta", [])
+        bars.attrs["saved_at"] = meta["saved_at"]
+        return bars
+
+    def save(
+        self,
+        symbol: str,
+        interval: str,
+        bars: pd.DataFrame,
+        ta: list = (),
+        as_of: float = None,
+    ) -> None:
+        # ta names the TA already in bars, loads hand it back in bars.attrs. as_of is
+        # when they were fetched from the source, without it (eg. they've only had TA
+        # added) they're taken to be no more current than what's stored. Bars older
+        # than what's stored are dropped, and so is a different take on the same last
+        # bar unless it was fetched later
+        if not self.available():
+            return
+        key = self.key(symbol, interval)
+        previous = self._call(self._client.hget, key, "meta")
+        previous = json.loads(previous) if previous else None
+
+        if as_of is None:
+            as_of = previous["saved_at"] if previous else 0
+
+        if previous and previous.get("last") and len(bars):
+            stored_last = pd.Timestamp(previous["last"])
+            if bars.index[-1] < stored_last:
+                return
+            if (
+                bars.index[-1] == stored_last
+                and _row(bars, previous["columns"]) != previous["last_row"]
+                and as_of <= previous["saved_at"]
+            ):
+                return
+
+        chunks = max(1, -(-len(bars) // self.chunk_rows))
+        first = 0
+        if (
+            previous
+            and previous["columns"] == list(bars.columns)
+            and previous["chunk_rows"] == self.chunk_rows
+            and previous["first"] == _first(bars)
+            and 0 < previous["rows"] <= len(bars)
+        ):
+            # same series with bars added. The last one we stored may have still been
+            # forming, so its chunk gets rewritten too
+            first = (previous["rows"] - 1) // self.chunk_rows
+
+        mapping = {
+            str(chunk): self._encode(
+                bars.iloc[chunk * self.chunk_rows : (chunk + 1) * self.chunk_rows]
+            )
+            for chunk in range(first, chunks)
+        }
+        mapping["meta"] = json.dumps(
+            {
+                "columns": list(bars.columns),
+                "rows": len(bars),
+                "chunks": chunks,
+                "chunk_rows": self.chunk_rows,
+                "first": _first(bars),
+                "last": str(bars.index[-1]) if len(bars) else None,
+                "last_row": _row(bars, bars.columns),
+                "ta": sorted(ta),
+                "saved_at": as_of,
+            }
+        )
+
+        pipe = self._client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        if previous and previous["chunks"] > chunks:
+            pipe.hdel(key, *[str(c) for c in range(chunks, previous["chunks"])])
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        self._call(pipe.execute)
+
+    def delete(self, symbol: str, interval: str) -> None:
+        self._call(self._client.delete, self.key(symbol, interval))
+
+    def _call(self, command, *args):
+        try:
+            result = command(*args)
+        except redis.RedisError:
+            self.failed_at = time.time()
+            raise
+        self.failed_at = None
+        return result
+
+    def _encode(self, bars: pd.DataFrame) -> bytes:
+        table = pa.Table.from_pandas(bars, preserve_index=True)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema, options=self._options) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+def _first(bars: pd.DataFrame) -> str:
+    return str(bars.index[0]) if len(bars) else None
+
+
+def _row(bars: pd.DataFrame, columns: list) -> str:
+    # the last bar in columns, None if there isn't one or bars doesn't have them all
+    if len(bars) == 0 or not set(columns).issubset(bars.columns):
+        return None
+    return repr(bars[list(columns)].iloc[-1].tolist())
+
+
+# enough of a symbol_cache Symbol for the service to serve bars that came out of a
+# store rather than the real source. The real Symbol is only loaded if a symbol_cache
+# TA is asked for that isn't already in the stored bars
+class StoredOhlc:
+    def __init__(
+        self,
+        bars: pd.DataFrame,
+        interval_seconds: int,
+        source,
+        ta: list = (),
+        as_of: float = 0,
+    ):
+        self.bars = bars
+        self.interval_seconds = interval_seconds
+        self._source = source
+        self._symbol = None
+        # names of the TA in bars
+        self.ta = set(ta)
+        # when the bars were fetched from the source
+        self.as_of = as_of
+
+    def apply_ta(self, name: str) -> None:
+        if name in self.ta:
+            return
+
+        if self._symbol is None:
+            self._symbol = self._source()
+            # keep any columns we had that the fresh load doesn't
+            real = self._symbol.ohlc.bars
+            for column in self.bars.columns.difference(real.columns):
+                real[column] = self.bars[column]
+
+        self._symbol.ohlc.apply_ta(name)
+        self.bars = self._symbol.ohlc.bars
+        self.ta.add(name)
+
+    def get_pause(self) -> float:
+        # seconds until the bar after the last one is due
+        if len(self.bars) == 0:
+            return 0
+        due = self.bars.index[-1] + pd.Timedelta(seconds=self.interval_seconds)
+        now = pd.Timestamp.now(tz=due.tz)
+        return max(0.0, (due - now).total_seconds())
+
+
+class StoredSymbol:
+    def __init__(
+        self,
+        symbol: str,
+        interval: str,
+        bars: pd.DataFrame,
+        interval_seconds: int,
+        factory,
+        ta: list = (),
+        as_of: float = 0,
+    ):
+        self.symbol = symbol
+        self.interval = interval
+        self.ohlc = StoredOhlc(
+            bars, interval_seconds, lambda: factory(symbol, interval), ta, as_of
+        )
+
+
+# SymbolLoader factory that tries each store in turn before the real source, eg.
+# redis then local disk. What the real source returns is saved to all of them, but
+# what's found in one isn't copied into the others: a disk hit is a lazily mapped file
+# and copying it to redis would read and encode every page of it. Bars more than an
+# interval old count as missing, going by when they were fetched from the source. A
+# store being unavailable just means going on to the next one
+class ReadThrough:
+    def __init__(self, stores: list, factory, interval_seconds: dict):
+        # anything with load(symbol, interval, max_age) and
+        # save(symbol, interval, bars, ta, as_of)
+        self.stores = stores
+        self._factory = factory
+        self._interval_seconds = interval_seconds
+        # when each Symbol we fetched from the source was fetched
+        self._fetched_at = weakref.WeakKeyDictionary()
+
+    def __call__(self, symbol: str, interval: str):
+        loaded = self.cached(symbol, interval)
+        if loaded is not None:
+            return loaded
+        return self._fetch(symbol, interval)
+
+    def fresh(self, symbol: str, interval: str, since: float):
+        # bars as of since or later, eg. refreshing after a bar closed. Another worker
+        # may have already fetched them, otherwise they come from the source
+        loaded = self.cached(symbol, interval, max_age=max(0, time.time() - since))
+        if loaded is not None:
+            return loaded
+        return self._fetch(symbol, interval)
+
+    def _fetch(self, symbol: str, interval: str):
+        as_of = time.time()
+        loaded = self._factory(symbol, interval)
+        self._fetched_at[loaded] = as_of
+        self.save(symbol, interval, loaded.ohlc.bars, as_of=as_of)
+        return loaded
+
+    def as_of(self, loaded) -> float:
+        # when loaded's bars were fetched from the source, None if it didn't come
+        # from here
+        if isinstance(loaded, StoredSymbol):
+            return loaded.ohlc.as_of
+        return self._fetched_at.get(loaded)
+
+    def cached(self, symbol: str, interval: str, max_age: float = None) -> StoredSymbol:
+        # from the stores only, None if none of them have it. Anything fetched more
+        # than max_age seconds ago doesn't count, an interval if it's not given
+        seconds = self._interval_seconds.get(interval, 0)
+        if max_age is None:
+            max_age = seconds
+        for store in self.stores:
+            try:
+                bars = store.load(symbol, interval, max_age=max_age)
+            except (redis.RedisError, pa.ArrowException, OSError) as e:
+                log.warning(
+                    f"Unable to read {symbol} {interval} from {type(store).__name__}: {e}"
+                )
+                continue
+
+            if bars is not None:
+                # kept off the bars themselves, parquet would write it out
+                ta = bars.attrs.pop("ta", [])
+                as_of = bars.attrs.pop("saved_at", 0)
+                return StoredSymbol(
+                    symbol, interval, bars, seconds, self._factory, ta, as_of
+                )
+
+        return None
+
+    def save(
+        self,
+        symbol: str,
+        interval: str,
+        bars: pd.DataFrame,
+        ta: list = (),
+        as_of: float = None,
+    ) -> None:
+        for store in self.stores:
+            try:
+                store.save(symbol, interval, bars, ta, as_of)
+            except (redis.RedisError, pa.ArrowException, OSError) as e:
+                log.warning(
+                    f"Unable to save {symbol} {interval} to {type(store).__name__}: {e}"
+                )
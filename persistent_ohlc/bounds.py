@@ -0,0 +1,29 @@
+import threading
+import time
+
+
+def bounds_of(bars) -> dict:
+    if len(bars) == 0:
+        return {"first": None, "last": None, "bars": 0}
+    return {"first": bars.index[0], "last": bars.index[-1], "bars": len(bars)}
+
+
+# first/last timestamp and bar count per (symbol, interval). Outlives the symbol being
+# evicted from the SymbolCache, so a bounds request doesn't have to reload bars just to
+# read three numbers off them. Callers say how old an entry is allowed to be, since the
+# last bar moves on every interval
+class BoundsCache:
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, interval: str, max_age: float) -> dict:
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+        if entry is None or time.monotonic() - entry[0] > max_age:
+            return None
+        return entry[1]
+
+    def put(self, symbol: str, interval: str, bounds: dict) -> None:
+        with self._lock:
+            self._entries[(symbol, interval)] = (time.monotonic(), bounds)
@@ -1,4 +1,56 @@
+import os
+import tempfile
 from string import Template
 
-data_path_template = Template("symbol_data/${interval}/${symbol}-USD.csv")
+# one directory of parquet partitions per series, see disk_store
+data_path_template = Template("symbol_data/${interval}/${symbol}")
 df_template = "symbol_data/template.csv"
+
+# upper bound on encoded OHLC responses held in memory
+response_cache_max_bytes = 256 * 1024 * 1024
+
+# memory budget for resident symbols, measured with DataFrame.memory_usage(deep=True)
+symbol_cache_max_bytes = 2 * 1024 * 1024 * 1024
+# "lru" or "lfu"
+symbol_cache_policy = "lru"
+# symbols that are never evicted, either "BTC-USD" for every interval or ("BTC-USD", "5m")
+pinned_symbols = []
+
+# share loaded bars and TA between service workers through redis
+shared_bars = False
+# seconds to wait on redis for bars, and to leave it alone after it fails
+shared_bars_timeout = 0.5
+shared_bars_backoff = 30
+# rows per redis chunk, appending bars only rewrites the last chunk or so
+shared_bars_chunk_rows = 4096
+# seconds before redis drops a series no worker has saved
+shared_bars_ttl = 7 * 86400
+
+# more than 1 runs a loader process that owns the bars plus this many request workers
+# that map them read only
+workers = 1
+# where request workers reach the loader process
+publisher_address = ("127.0.0.1", 8003)
+# published bars, tmpfs if there is one
+shared_frames_dir = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+    "persistent_ohlc",
+)
+
+# keep bars on local disk under data_path_template and warm up from it on startup
+disk_store = True
+# parquet partition per interval as a pandas period, a month if it's not listed
+disk_store_partitions = {"1d": "Y"}
+
+# refresh resident series in the background just after each interval boundary, so
+# requests don't wait on upstream for the bar that just closed
+refresh_bars = True
+# seconds after a boundary before refreshing, for upstream to have the closed bar
+refresh_settle_seconds = 5
+# series refreshed at once, and seconds between batches to go easy on upstream
+refresh_batch_size = 10
+refresh_batch_pause = 1.0
+# threads refreshing, apart from the ones serving requests
+refresh_threads = 4
+# request workers pick up what the loader process refreshed this many seconds later
+refresh_worker_lag = 10
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+from string import Template
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import sys
+
+if "unittest" in sys.modules.keys():
+    from . import encoding
+else:
+    import encoding
+
+MANIFEST = "manifest.json"
+# every stored bar in one file that's mapped rather than parsed
+MAPPED = "bars.bin"
+
+
+# bars kept on local disk so a restart doesn't have to refetch every symbol's history.
+# Each (symbol, interval) is a directory of parquet files, one per month (or per year
+# for daily bars) in UTC, plus a manifest of what each file covers. Only the last
+# partition is ever rewritten, earlier ones are closed. Alongside them is a mapped copy
+# of the whole series that loads are served from, so a cold symbol costs an mmap
+# rather than parsing parquet. Without it loads only read the partitions that overlap
+# the interval's history. saved_at in the manifest is when the bars were fetched from
+# the source, not when they were last written
+class DiskBarStore:
+    def __init__(
+        self,
+        path_template: Template,
+        partitions: dict = None,
+        history_days: dict = None,
+    ):
+        # path_template has ${interval} and ${symbol}
+        self.path_template = path_template
+        # interval -> pandas period, "M" if it's not listed
+        self.partitions = partitions or {}
+        # interval -> days loaded when no start is given, everything if not listed
+        self.history_days = history_days or {}
+
+    def path(self, symbol: str, interval: str) -> str:
+        return self.path_template.substitute(
+            symbol=quote(symbol, safe=""), interval=quote(interval, safe="")
+        )
+
+    def manifest(self, symbol: str, interval: str) -> dict:
+        try:
+            with open(os.path.join(self.path(symbol, interval), MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def series(self) -> list:
+        # every stored (symbol, interval), most recently saved first
+        root = self.path_template.substitute(interval="", symbol="")
+        found = []
+        for interval in os.listdir(root) if os.path.isdir(root) else []:
+            interval_path = os.path.join(root, interval)
+            if not os.path.isdir(interval_path):
+                continue
+            for symbol in os.listdir(interval_path):
+                manifest_path = os.path.join(interval_path, symbol, MANIFEST)
+                if os.path.exists(manifest_path):
+                    found.append(
+                        (
+                            os.path.getmtime(manifest_path),
+                            unquote(symbol),
+                            unquote(interval),
+                        )
+                    )
+        return [(symbol, interval) for _, symbol, interval in sorted(found)[::-1]]
+
+    def load(self, symbol: str, interval: str, max_age: float = None) -> pd.DataFrame:
+        # the interval's history, None if there's nothing stored or it was fetched
+        # more than max_age seconds ago
+        manifest = self.manifest(symbol, interval)
+        if manifest is None:
+            return None
+        if max_age is not None and time.time() - manifest["saved_at"] > max_age:
+            return None
+
+        start = None
+        if interval in self.history_days:
+            start = pd.Timestamp.now(tz="UTC") - pd.Timedelta(
+                days=self.history_days[interval]
+            )
+
+        path = self.path(symbol, interval)
+        bars = self._map(path)
+        if bars is None:
+            frames = [
+                self._read(path, partition["file"], manifest["tz"])
+                for partition in manifest["partitions"]
+                if start is None or pd.Timestamp(partition["last"]) >= start
+            ]
+            if not frames:
+                return None
+            bars = pd.concat(frames) if len(frames) > 1 else frames[0]
+
+        first = 0 if start is None else bars.index.searchsorted(start, side="left")
+        if first == len(bars):
+            return None
+        bars = bars.iloc[first:]
+        bars.attrs["ta"] = manifest.get("ta", [])
+        bars.attrs["saved_at"] = manifest["saved_at"]
+        return bars
+
+    def save(
+        self,
+        symbol: str,
+        interval: str,
+        bars: pd.DataFrame,
+        ta: list = (),
+        as_of: float = None,
+    ) -> None:
+        # appends whatever is newer than what's stored. The columns stored are the
+        # ones the series was first saved with, so TA added later isn't written out.
+        # ta names the TA in bars. as_of is when they were fetched from the source,
+        # without it they're taken to be no more current than what's stored
+        if len(bars) == 0 or bars.index.tz is None:
+            return
+
+        path = self.path(symbol, interval)
+        manifest = self.manifest(symbol, interval)
+        if manifest and not set(manifest["columns"]).issubset(bars.columns):
+            manifest = None
+        columns = manifest["columns"] if manifest else list(bars.columns)
+        ta = manifest.get("ta", []) if manifest else sorted(ta)
+        if as_of is None:
+            as_of = manifest["saved_at"] if manifest else 0
+        bars = bars[columns]
+
+        if manifest:
+            stored_last = pd.Timestamp(manifest["partitions"][-1]["last"])
+            if bars.index[-1] < stored_last:
+                # older than what we have
+                return
+            if bars.index[-1] == stored_last and manifest["last_row"] == _row(bars):
+                # nothing new, but what's stored is as current as these are
+                if as_of > manifest["saved_at"]:
+                    self._write_manifest(path, {**manifest, "saved_at": as_of})
+                return
+            if bars.index[-1] == stored_last and as_of <= manifest["saved_at"]:
+                # a different take on the last bar, from no later than ours
+                return
+
+        freq = self.partitions.get(interval, "M")
+        utc = bars.index.tz_convert("UTC")
+        periods = utc.tz_localize(None).to_period(freq)
+
+        partitions = []
+        rewrite_from = None
+        if manifest:
+            # keep closed partitions, redo the last one stored since its last bar may
+            # have still been forming, and anything after it
+            last_period = manifest["partitions"][-1]["file"]
+            partitions = manifest["partitions"][:-1]
+            rewrite_from = pd.Period(last_period.split(".")[0], freq)
+            if periods[0] > rewrite_from:
+                # a gap between what's stored and what we were given, keep the last
+                # partition as it is
+                partitions = manifest["partitions"]
+
+        os.makedirs(path, exist_ok=True)
+        mapped = self._map(path) if manifest else None
+        for period in periods.unique():
+            if rewrite_from is not None and period < rewrite_from:
+                continue
+            chunk = bars.loc[periods == period]
+            if rewrite_from is not None and period == rewrite_from:
+                # merge with what's stored, in case it starts before what we have
+                stored = self._read(path, f"{period}.parquet", manifest["tz"])
+                chunk = pd.concat([stored.loc[stored.index < chunk.index[0]], chunk])
+            partitions.append(self._write(path, str(period), chunk))
+
+        # the mapped copy is rewritten whole, it's cheap next to parsing
+        if mapped is not None and len(mapped):
+            bars = pd.concat([mapped.loc[mapped.index < bars.index[0]], bars])
+        encoding.write_mapped(bars, os.path.join(path, MAPPED))
+
+        self._write_manifest(
+            path,
+            {
+                "columns": columns,
+                "tz": str(bars.index.tz),
+                "partitions": partitions,
+                "last_row": _row(bars),
+                "ta": ta,
+                "saved_at": as_of,
+            },
+        )
+
+    def _write_manifest(self, path: str, manifest: dict) -> None:
+        temp = _temp(os.path.join(path, MANIFEST))
+        with open(temp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp, os.path.join(path, MANIFEST))
+
+    def _map(self, path: str) -> pd.DataFrame:
+        try:
+            return encoding.map_frame(os.path.join(path, MAPPED))
+        except (FileNotFoundError, ValueError):
+            # not there, or not readable, the partitions still have everything
+            return None
+
+    def _read(self, path: str, file: str, tz: str) -> pd.DataFrame:
+        return pq.read_table(os.path.join(path, file)).to_pandas().tz_convert(tz)
+
+    def _write(self, path: str, period: str, chunk: pd.DataFrame) -> dict:
+        # written to the side and renamed, a reader never sees half a file
+        file = f"{period}.parquet"
+        temp = _temp(os.path.join(path, file))
+        chunk.tz_convert("UTC").to_parquet(temp)
+        os.replace(temp, os.path.join(path, file))
+        return {
+            "file": file,
+            "first": str(chunk.index[0].tz_convert("UTC")),
+            "last": str(chunk.index[-1].tz_convert("UTC")),
+            "rows": len(chunk),
+        }
+
+
+def _temp(path: str) -> str:
+    # unique per writer, workers may be saving the same series at once
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _row(bars: pd.DataFrame) -> str:
+    return repr(bars.iloc[-1].tolist())
@@ -0,0 +1,100 @@
+import mmap
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import sys
+
+if "unittest" in sys.modules.keys():
+    from . import exceptions, numpy_format
+else:
+    import exceptions, numpy_format
+
+JSON = "json"
+ARROW = "arrow"
+PARQUET = "parquet"
+NUMPY = "numpy"
+
+media_types = {
+    JSON: "application/json",
+    ARROW: "application/vnd.apache.arrow.stream",
+    PARQUET: "application/vnd.apache.parquet",
+    NUMPY: "application/x-ohlc-numpy",
+}
+formats_by_media_type = {v: k for k, v in media_types.items()}
+
+
+def negotiate(requested_format: str = None, accept: str = None) -> str:
+    # an explicit ?format= wins over the Accept header
+    if requested_format:
+        if requested_format not in media_types:
+            raise exceptions.InvalidFormatError(
+                f"Format {requested_format} is not supported, use one of {list(media_types)}"
+            )
+        return requested_format
+
+    if not accept:
+        return JSON
+
+    for media_range in accept.split(","):
+        media_type = media_range.split(";")[0].strip()
+        if media_type in formats_by_media_type:
+            return formats_by_media_type[media_type]
+        if media_type in ("*/*", "application/*"):
+            return JSON
+
+    raise exceptions.InvalidFormatError(
+        f"None of {accept} are supported, use one of {list(media_types.values())}"
+    )
+
+
+def encode(df: pd.DataFrame, fmt: str) -> bytes:
+    if fmt == JSON:
+        return df.to_json(date_format="iso").encode()
+    if fmt == ARROW:
+        return _encode_arrow(df)
+    if fmt == PARQUET:
+        return _encode_parquet(df)
+    if fmt == NUMPY:
+        return numpy_format.encode(df)
+
+    raise exceptions.InvalidFormatError(f"Format {fmt} is not supported")
+
+
+def _encode_arrow(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _encode_parquet(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+# the numpy format doubles as a file format that can be mapped rather than parsed.
+# Fixed width columns, so opening one is an mmap and pages are only read in as the
+# bars are used. Every process mapping the same file shares the OS page cache
+
+
+def write_mapped(df: pd.DataFrame, path: str) -> None:
+    # written to the side and renamed, so anyone with the old file mapped keeps it
+    temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(numpy_format.encode(df))
+    os.replace(temp, path)
+
+
+def map_frame(path: str) -> pd.DataFrame:
+    # read only DataFrame over the file. The arrays hold the mapping open, so it's
+    # unmapped once the frame and anything sliced from it are gone
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return numpy_format.decode(buffer)
@@ -8,3 +8,11 @@ class InvalidIntervalError(Exception):
 
 class InvalidDate(Exception):
     ...
+
+
+class InvalidFormatError(Exception):
+    ...
+
+
+class InvalidColumnError(Exception):
+    ...
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+
+def slope_weights(window: int) -> np.ndarray:
+    # least squares slope over x = 0..window-1 is sum(w * y) with these weights, so a
+    # rolling slope is just a convolution
+    x = np.arange(window, dtype=np.float64) - (window - 1) / 2
+    return x / (x**2).sum()
+
+
+def rolling_slope(values, window: int = 3):
+    # slope of the `window` values ending at each row, same as np.polyfit(x, y, 1)[0]
+    # per window. NaN until the first full window and wherever a window has a NaN in
+    # it. Works on a Series or column-wise on a (time x symbol) DataFrame
+    weights = slope_weights(window)
+    slope = weights[-1] * values
+    for lag in range(1, window):
+        slope = slope + weights[-1 - lag] * values.shift(lag)
+
+    return slope
+
+
+def ema(values, window: int):
+    # same as ta's _ema, ie. no SMA seed and nothing until there's a full window
+    return values.ewm(span=window, min_periods=window, adjust=False).mean()
+
+
+def seeded_ema(values, window: int):
+    # same as pandas_ta's ema, which seeds with the SMA of the first window. With
+    # leading NaNs (eg. an EMA of an EMA) that seed is NaN and it starts from the
+    # first real value instead
+    seeded = values.astype(np.float64)
+    if len(seeded) < window:
+        return seeded * np.nan
+
+    seeded = seeded.copy()
+    seeded.iloc[: window - 1] = np.nan
+    seeded.iloc[window - 1] = values.iloc[:window].mean()
+    return seeded.ewm(span=window, adjust=False).mean()
+
+
+def roc(values, window: int):
+    previous = values.shift(window)
+    return (values - previous) / previous * 100
+
+
+def rsi(values, window: int = 14):
+    # pandas_ta's rsi, ie. Wilder smoothing via an adjusted ewm
+    change = values.diff()
+    gain = change.clip(lower=0)
+    loss = change.clip(upper=0).abs()
+
+    alpha = 1.0 / window
+    gain_avg = gain.ewm(alpha=alpha, min_periods=window).mean()
+    loss_avg = loss.ewm(alpha=alpha, min_periods=window).mean()
+    return gain_avg / (gain_avg + loss_avg) * 100
+
+
+def ppo_hist_slope(
+    close,
+    window_fast: int = 12,
+    window_slow: int = 26,
+    window_sign: int = 9,
+    slope_window: int = 3,
+) -> tuple:
+    # (ppo, signal, hist, slope). hist is Close - signal rather than PPO - signal, to
+    # match what SCTR has always used
+    return ppo_from_emas(
+        close,
+        ema(close, window_fast),
+        ema(close, window_slow),
+        window_sign,
+        slope_window,
+    )
+
+
+def ppo_from_emas(close, fast, slow, window_sign: int = 9, slope_window: int = 3):
+    # ppo_hist_slope, for when the fast and slow EMAs are already worked out
+    ppo = (fast - slow) / slow * 100
+    signal = seeded_ema(ppo, window_sign)
+    hist = close - signal
+    # slope of the previous slope_window values, not including this row. 0 where
+    # there isn't a full window of history
+    slope = rolling_slope(hist, slope_window).shift(1).fillna(0)
+    return ppo, signal, hist, slope
+
+
+# values several TA in one request can share, eg. the 12 and 26 EMAs behind PPO. Each
+# is worked out at most once, over a contiguous float64 copy of the column it's based
+# on. Only our own TA goes through here, symbol_cache's (eg. MacdTA) works its own out
+class Intermediates:
+    def __init__(self, bars: pd.DataFrame):
+        self.bars = bars
+        self._values = dict()
+
+    def _get(self, key: tuple, calculate):
+        if key not in self._values:
+            self._values[key] = calculate()
+        return self._values[key]
+
+    def column(self, name: str = "Close") -> pd.Series:
+        return self._get(
+            ("column", name),
+            lambda: pd.Series(
+                np.ascontiguousarray(self.bars[name].to_numpy(dtype=np.float64)),
+                index=self.bars.index,
+            ),
+        )
+
+    def ema(self, window: int, name: str = "Close") -> pd.Series:
+        return self._get(("ema", window, name), lambda: ema(self.column(name), window))
+
+
+# PPO histogram and its slope as used by SCTR. The outputs match what
+# tests/example_sctr.py used to build per symbol with ta, pandas_ta and a polyfit loop
+class PpoSlopeTA:
+    name = "PpoSlopeTA"
+    columns = ["PPO", "PPO_EMA_9", "PPO_HIST", "PPO_HIST_SLOPE"]
+
+    def __init__(
+        self,
+        window_fast: int = 12,
+        window_slow: int = 26,
+        window_sign: int = 9,
+        slope_window: int = 3,
+    ):
+        self.window_fast = window_fast
+        self.window_slow = window_slow
+        self.window_sign = window_sign
+        self.slope_window = slope_window
+
+    def calculate(self, shared: Intermediates) -> list:
+        # one array per column
+        return ppo_from_emas(
+            shared.column(),
+            shared.ema(self.window_fast),
+            shared.ema(self.window_slow),
+            self.window_sign,
+            self.slope_window,
+        )
+
+    def apply(self, bars: pd.DataFrame) -> pd.DataFrame:
+        _assign(bars, self.columns, self.calculate(Intermediates(bars)))
+        return bars
+
+
+def _assign(bars: pd.DataFrame, columns: list, values: list) -> None:
+    # adds the columns to bars in place, it's the frame the symbol cache holds
+    bars[columns] = np.column_stack([np.asarray(v, dtype=np.float64) for v in values])
+
+
+# TA served by this service on top of what symbol_cache provides, by ta= name
+ta_functions = {PpoSlopeTA.name: PpoSlopeTA}
+
+
+def apply_ta(bars: pd.DataFrame, name: str) -> bool:
+    # returns False if name isn't one of ours so the caller can fall back to
+    # symbol_cache. Already applied TA is left alone
+    return not apply_many(bars, [name])
+
+
+def apply_many(bars: pd.DataFrame, names: list) -> list:
+    # applies every one of ours in names in one go, sharing intermediates between
+    # them. TA whose columns are already there is skipped without touching the data.
+    # Returns the names that aren't ours, for symbol_cache
+    present = set(bars.columns)
+    shared = None
+    columns = []
+    values = []
+    others = []
+    for name in dict.fromkeys(names):
+        algo = ta_functions.get(name)
+        if algo is None:
+            others.append(name)
+            continue
+        if present.issuperset(algo.columns):
+            continue
+
+        shared = shared or Intermediates(bars)
+        columns.extend(algo.columns)
+        values.extend(algo().calculate(shared))
+
+    if columns:
+        _assign(bars, columns, values)
+    return others
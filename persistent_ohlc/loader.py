@@ -0,0 +1,35 @@
+import asyncio
+
+from fastapi.concurrency import run_in_threadpool
+
+
+# single flight loader for Symbol objects. Concurrent requests for the same cold
+# (symbol, interval) all await one shared load, and the load itself runs in the
+# threadpool so the event loop keeps serving warm symbols in the meantime
+class SymbolLoader:
+    def __init__(self, store, factory):
+        # store is the SymbolCache the service serves from
+        self._store = store
+        self._factory = factory
+        self._in_flight = dict()
+
+    async def get(self, symbol: str, interval: str):
+        loaded = self._store.get(symbol, interval)
+        if loaded is not None:
+            return loaded
+
+        key = (symbol, interval)
+        if key not in self._in_flight:
+            self._in_flight[key] = asyncio.ensure_future(self._load(symbol, interval))
+
+        # shield so a disconnecting client doesn't cancel the load for everyone else
+        return await asyncio.shield(self._in_flight[key])
+
+    async def _load(self, symbol: str, interval: str):
+        try:
+            loaded = await run_in_threadpool(self._factory, symbol, interval)
+            await run_in_threadpool(self._store.put, symbol, interval, loaded)
+            return loaded
+        finally:
+            # failures aren't cached, the next request gets to try again
+            del self._in_flight[(symbol, interval)]
@@ -1,7 +1,9 @@
-from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
 from typing import Annotated, List
 import uvicorn
 import json
+import math
 from parameter_store import S3
 from parameter_store import exceptions as p_exceptions
 import datetime
@@ -10,15 +12,27 @@ import pandas as pd
 import redis
 from symbol_cache import Symbol, MacdTA, SymbolError, TANotFound
 import time
+import asyncio
+import multiprocessing
+import os
+import secrets
+import threading
+import weakref
 
 # from . import crud, deps, models, schemas, security
 # from app
 import sys
 
 if "unittest" in sys.modules.keys():
-    from . import schemas, config, exceptions
+    from . import schemas, config, exceptions, encoding
+    from . import response_cache, windowing, loader, memory_cache, indicators
+    from . import sctr, universes, bounds, bar_store, shared_frames, disk_store
+    from . import refresher
 else:
-    import schemas, config, exceptions
+    import schemas, config, exceptions, encoding
+    import response_cache, windowing, loader, memory_cache, indicators
+    import sctr, universes, bounds, bar_store, shared_frames, disk_store
+    import refresher
 
 # redit config
 pool = redis.ConnectionPool(host="localhost", port=6379, db=0, decode_responses=True)
@@ -26,6 +40,15 @@ pool = redis.ConnectionPool(host="localhost", port=6379, db=0, decode_responses=
 pool = redis.ConnectionPool(
     host="host.docker.internal", port=6379, db=0, decode_responses=True
 )
+# bars are stored binary, so they get their own pool without decode_responses
+bar_pool = redis.ConnectionPool(
+    host="host.docker.internal",
+    port=6379,
+    db=0,
+    socket_connect_timeout=config.shared_bars_timeout,
+    socket_timeout=config.shared_bars_timeout,
+)
+bar_redis = redis.Redis(connection_pool=bar_pool)
 redis = redis.Redis(connection_pool=pool)
 
 intervals = [
@@ -34,6 +57,7 @@ intervals = [
     schemas.Interval(interval=3600, interval_name="1h", max_history_days=500),
     schemas.Interval(interval=86400, interval_name="1d", max_history_days=2000),
 ]
+interval_seconds = {i.interval_name: i.interval for i in intervals}
 """
 /symbol/
 /symbol/{interval}/{symbol}
@@ -49,49 +73,189 @@ requests.get(/symbol/5m/ACN?clock=banana1)
 app = FastAPI()
 s3 = S3("mfers-tabot")
 
-active_symbols = dict()
+active_symbols = memory_cache.SymbolCache(
+    max_bytes=config.symbol_cache_max_bytes,
+    policy=config.symbol_cache_policy,
+    pinned=config.pinned_symbols,
+)
+active_markets = dict()
+
+
+def symbol_factory(symbol: str, interval: str):
+    return Symbol(symbol, interval=interval)
+
+
+# where bars are kept outside this process, tried in order before going upstream
+bar_stores = []
+if config.shared_bars:
+    bar_stores.append(
+        bar_store.RedisBarStore(
+            bar_redis,
+            chunk_rows=config.shared_bars_chunk_rows,
+            ttl=config.shared_bars_ttl,
+            backoff=config.shared_bars_backoff,
+        )
+    )
+disk_bars = None
+if config.disk_store:
+    disk_bars = disk_store.DiskBarStore(
+        config.data_path_template,
+        partitions=config.disk_store_partitions,
+        history_days={i.interval_name: i.max_history_days for i in intervals},
+    )
+    bar_stores.append(disk_bars)
+stored_bars = None
+if bar_stores:
+    stored_bars = bar_store.ReadThrough(bar_stores, symbol_factory, interval_seconds)
+if os.environ.get(shared_frames.authkey_variable):
+    # request worker in multi process mode, bars come from the loader process
+    symbol_loader = loader.SymbolLoader(
+        active_symbols,
+        shared_frames.SharedFrames(
+            config.publisher_address,
+            os.environ[shared_frames.authkey_variable].encode(),
+        ),
+    )
+else:
+    symbol_loader = loader.SymbolLoader(active_symbols, stored_bars or symbol_factory)
+responses = response_cache.ResponseCache(max_bytes=config.response_cache_max_bytes)
+sctr_tables = sctr.SctrCache()
+symbol_bounds = bounds.BoundsCache()
+# names of the TA applied to each resident Symbol, so stores know what's in the bars
+applied_ta = weakref.WeakKeyDictionary()
+
+
+def _refresh_symbol(symbol: str, interval: str, loaded, since: float):
+    if isinstance(loaded, shared_frames.SharedSymbol):
+        # the loader process has refreshed it, map whatever it's published now
+        loaded.ohlc.remap()
+        return loaded
+
+    if stored_bars:
+        fresh = stored_bars.fresh(symbol, interval, since)
+    else:
+        fresh = symbol_factory(symbol, interval)
+    # put back the TA requests have been asking for, here rather than in the next one
+    ta = _applied_ta(loaded)
+    if ta:
+        _add_ta(fresh, symbol, interval, list(ta))
+    symbol_bounds.put(symbol, interval, bounds.bounds_of(fresh.ohlc.bars))
+    return fresh
+
+
+def _bar_refresher(cache, settle: float) -> refresher.BarRefresher:
+    return refresher.BarRefresher(
+        cache,
+        _refresh_symbol,
+        interval_seconds,
+        settle=settle,
+        batch_size=config.refresh_batch_size,
+        batch_pause=config.refresh_batch_pause,
+        threads=config.refresh_threads,
+    )
+
+
+if os.environ.get(shared_frames.authkey_variable):
+    bar_refresher = _bar_refresher(
+        active_symbols, config.refresh_settle_seconds + config.refresh_worker_lag
+    )
+else:
+    bar_refresher = _bar_refresher(active_symbols, config.refresh_settle_seconds)
+
+
+@app.on_event("startup")
+async def start_rehydrate():
+    # request workers get their bars from the loader process instead
+    if disk_bars and not os.environ.get(shared_frames.authkey_variable):
+        asyncio.create_task(_rehydrate())
+
+
+@app.on_event("startup")
+async def start_refresher():
+    if config.refresh_bars:
+        bar_refresher.start()
+
+
+async def _rehydrate():
+    # warm the cache from what's on disk, most recently saved first, without going
+    # upstream first. With the refresher running bars of any age are used, and
+    # anything fetched before the last bar closed is refreshed straight away.
+    # Otherwise only bars fetched less than an interval ago are
+    max_age = math.inf if config.refresh_bars else None
+    stale = dict()
+    for symbol, interval in await run_in_threadpool(disk_bars.series):
+        if active_symbols.current_bytes >= active_symbols.max_bytes:
+            break
+        if (symbol, interval) in active_symbols:
+            continue
+
+        loaded = await run_in_threadpool(stored_bars.cached, symbol, interval, max_age)
+        if loaded is None:
+            continue
+        await run_in_threadpool(active_symbols.put, symbol, interval, loaded)
+        if interval in interval_seconds and loaded.ohlc.as_of < _last_boundary(
+            interval
+        ):
+            stale.setdefault(interval, []).append(symbol)
+
+    for interval, symbols in stale.items():
+        await bar_refresher.refresh(interval, _last_boundary(interval), symbols)
+
+
+def _last_boundary(interval: str) -> float:
+    seconds = interval_seconds[interval]
+    return refresher.next_boundary(time.time(), seconds) - seconds
 
 
 @app.get("/symbols/{symbol}/ohlc/{interval}")
-def get_ohlc_data(
+async def get_ohlc_data(
     symbol: str,
     interval: str,
     start: str = None,
     end: str = None,
     count: int = None,
     ta: List[str] = Query(None),
+    columns: List[str] = Query(None),
+    since: str = None,
+    response_format: str = Query(None, alias="format"),
+    accept: Annotated[str, Header()] = None,
+    if_none_match: Annotated[str, Header()] = None,
 ):
     # ex_now = time.time()
-    if symbol not in active_symbols.keys():
-        active_symbols[symbol] = dict()
-
-    if interval not in active_symbols[symbol].keys():
-        try:
-            active_symbols[symbol][interval] = Symbol(symbol, interval=interval)
-        except SymbolError as e:
-            raise HTTPException(status_code=404, detail=f"Symbol {symbol} not found")
-
-    if ta:
-        for algo in ta:
-            try:
-                active_symbols[symbol][interval].ohlc.apply_ta(algo)
-            except TANotFound as e:
-                raise HTTPException(
-                    status_code=404, detail=f"TA function {algo} was not found"
-                )
+    try:
+        fmt = encoding.negotiate(response_format, accept)
+    except exceptions.InvalidFormatError as e:
+        raise HTTPException(status_code=406, detail=str(e))
 
-    ret_df = active_symbols[symbol][interval].ohlc.bars
-    if start:
-        ret_df = ret_df.loc[ret_df.index >= start]
+    try:
+        loaded = await symbol_loader.get(symbol, interval)
+    except SymbolError as e:
+        raise HTTPException(status_code=404, detail=f"Symbol {symbol} not found")
 
-    if end:
-        ret_df = ret_df.loc[ret_df.index <= end]
+    # TA, slicing and encoding are all pandas work - keep it off the event loop
+    payload, etag = await run_in_threadpool(
+        _ohlc_payload,
+        loaded,
+        symbol,
+        interval,
+        start,
+        end,
+        count,
+        ta,
+        fmt,
+        since,
+        if_none_match,
+        columns,
+    )
 
-    if count:
-        ret_df = ret_df[-count:]
+    if payload is None:
+        # the client already has everything we have
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept"})
 
     response = Response(
-        ret_df.to_json(date_format="iso"), media_type="application/json"
+        payload,
+        media_type=encoding.media_types[fmt],
+        headers={"ETag": etag, "Vary": "Accept"},
     )
     # print(f"\tJSON LOAD IN {time.time() - ex_now}")
     return response
@@ -101,29 +265,327 @@ def get_ohlc_data(
     # return js_return
 
 
+def _ohlc_payload(
+    loaded,
+    symbol,
+    interval,
+    start,
+    end,
+    count,
+    ta,
+    fmt,
+    since=None,
+    if_none_match=None,
+    columns=None,
+):
+    _apply_ta(loaded, symbol, interval, ta)
+
+    ret_df = loaded.ohlc.bars
+    version = response_cache.version_of(ret_df)
+    start, end = _parse_window(ret_df, start, end)
+    if since:
+        # incremental polling, since is inclusive so a still forming bar gets resent
+        since = _parse_window(ret_df, since, None)[0]
+        start = since if start is None else max(start, since)
+
+    cache_key = (
+        symbol,
+        interval,
+        tuple(sorted(set(ta))) if ta else (),
+        start,
+        end,
+        count,
+        fmt,
+        tuple(columns) if columns else (),
+    )
+    # the same series state answers a different query, or in a different format,
+    # with something else
+    etag = response_cache.etag_of((version, cache_key))
+    if if_none_match and etag in [e.strip() for e in if_none_match.split(",")]:
+        return None, etag
+
+    responses.validate(symbol, interval, version)
+    payload = responses.get(cache_key)
+
+    if payload is None:
+        positions = _parse_columns(ret_df, columns)
+        ret_df = windowing.window(
+            ret_df, start=start, end=end, count=count, columns=positions
+        )
+        payload = encoding.encode(ret_df, fmt)
+        responses.put(cache_key, payload, version)
+
+    return payload, etag
+
+
+def _apply_ta(loaded, symbol, interval, ta) -> None:
+    if not ta:
+        return
+
+    column_count = len(loaded.ohlc.bars.columns)
+    missing = _add_ta(loaded, symbol, interval, ta)
+
+    # TA columns grow the bars, or in a worker replace them
+    if len(loaded.ohlc.bars.columns) != column_count:
+        active_symbols.resize(symbol, interval)
+
+    for algo in missing:
+        raise HTTPException(status_code=404, detail=f"TA function {algo} was not found")
+
+
+def _add_ta(loaded, symbol, interval, ta) -> list:
+    # applies ta and saves whatever it added, returns the names nobody knew
+    if isinstance(loaded, shared_frames.SharedSymbol):
+        # the bars belong to the loader process, it applies the TA and republishes
+        return loaded.ohlc.apply_many(ta)
+
+    column_count = len(loaded.ohlc.bars.columns)
+    missing = []
+    # our own TA in one pass sharing intermediates, anything else is up to
+    # symbol_cache
+    for algo in indicators.apply_many(loaded.ohlc.bars, ta):
+        try:
+            loaded.ohlc.apply_ta(algo)
+        except TANotFound as e:
+            missing.append(algo)
+    _applied_ta(loaded).update(set(ta).difference(missing))
+
+    if stored_bars and len(loaded.ohlc.bars.columns) != column_count:
+        stored_bars.save(
+            symbol,
+            interval,
+            loaded.ohlc.bars,
+            ta=_applied_ta(loaded),
+            as_of=stored_bars.as_of(loaded),
+        )
+    return missing
+
+
+def _applied_ta(loaded) -> set:
+    if loaded not in applied_ta:
+        # bars out of a store may have come with TA already
+        stored = isinstance(loaded, bar_store.StoredSymbol)
+        applied_ta[loaded] = set(loaded.ohlc.ta) if stored else set()
+    return applied_ta[loaded]
+
+
+def _parse_columns(df, columns):
+    try:
+        return windowing.parse_columns(df.columns, columns)
+    except exceptions.InvalidColumnError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _parse_window(df, start, end):
+    try:
+        return windowing.parse_window(df.index, start, end)
+    except (exceptions.InvalidDate, exceptions.EndBeforeStartError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/symbols/ohlc/{interval}")
+async def get_ohlc_batch(
+    interval: str,
+    symbols: List[str] = Query(...),
+    start: str = None,
+    end: str = None,
+    count: int = None,
+    ta: List[str] = Query(None),
+    columns: List[str] = Query(None),
+    response_format: str = Query(None, alias="format"),
+    accept: Annotated[str, Header()] = None,
+):
+    try:
+        fmt = encoding.negotiate(response_format, accept)
+    except exceptions.InvalidFormatError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+    batch, not_found = await _load_many(symbols, interval)
+    payload = await run_in_threadpool(
+        _batch_payload, batch, interval, start, end, count, ta, fmt, columns
+    )
+
+    headers = {"X-Symbols-Not-Found": ",".join(not_found)} if not_found else None
+    return Response(payload, media_type=encoding.media_types[fmt], headers=headers)
+
+
+async def _load_many(symbols, interval):
+    # cold symbols all load in parallel, each one still single flight
+    symbols = list(dict.fromkeys(symbols))
+    results = await asyncio.gather(
+        *[symbol_loader.get(symbol, interval) for symbol in symbols],
+        return_exceptions=True,
+    )
+
+    batch = dict()
+    not_found = []
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, SymbolError):
+            not_found.append(symbol)
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            batch[symbol] = result
+
+    if not batch:
+        raise HTTPException(
+            status_code=404, detail=f"Symbols {', '.join(not_found)} not found"
+        )
+
+    return batch, not_found
+
+
+def _batch_payload(batch, interval, start, end, count, ta, fmt, columns=None) -> bytes:
+    # long format - one row per (symbol, timestamp) - so every format can carry it
+    frames = []
+    for symbol, loaded in batch.items():
+        _apply_ta(loaded, symbol, interval, ta)
+        bars = loaded.ohlc.bars
+        symbol_start, symbol_end = _parse_window(bars, start, end)
+        frames.append(
+            windowing.window(
+                bars,
+                start=symbol_start,
+                end=symbol_end,
+                count=count,
+                columns=_parse_columns(bars, columns),
+            )
+        )
+
+    if len({str(frame.index.tz) for frame in frames}) > 1:
+        # mixed exchanges, line everything up in UTC rather than end up with objects
+        frames = [frame.tz_convert("UTC") for frame in frames]
+
+    ret_df = pd.concat(frames, keys=list(batch), names=["symbol", "timestamp"])
+    ret_df = ret_df.reset_index()
+    ret_df["symbol"] = pd.Categorical(ret_df["symbol"], categories=list(batch))
+
+    return encoding.encode(ret_df, fmt)
+
+
+@app.get("/symbols/bounds/{interval}", response_model=dict)
+async def get_bounds(
+    interval: str, response: Response, symbols: List[str] = Query(...)
+):
+    # symbol -> first, last and bars, for working out a backtest's date range in one
+    # request. Resident symbols are read directly, evicted ones from what we saw when
+    # they were loaded as long as that's less than an interval old, and anything else
+    # gets loaded
+    max_age = next((i.interval for i in intervals if i.interval_name == interval), 0)
+    symbols = list(dict.fromkeys(symbols))
+
+    found = dict()
+    cold = []
+    for symbol in symbols:
+        loaded = active_symbols.get(symbol, interval)
+        if loaded is not None:
+            found[symbol] = bounds.bounds_of(loaded.ohlc.bars)
+            symbol_bounds.put(symbol, interval, found[symbol])
+            continue
+
+        cached = symbol_bounds.get(symbol, interval, max_age)
+        if cached is not None:
+            found[symbol] = cached
+        else:
+            cold.append(symbol)
+
+    not_found = []
+    if cold:
+        try:
+            batch, not_found = await _load_many(cold, interval)
+        except HTTPException:
+            if not found:
+                raise
+            batch, not_found = dict(), cold
+
+        for symbol, loaded in batch.items():
+            found[symbol] = bounds.bounds_of(loaded.ohlc.bars)
+            symbol_bounds.put(symbol, interval, found[symbol])
+
+    if not_found:
+        response.headers["X-Symbols-Not-Found"] = ",".join(not_found)
+    return {symbol: found[symbol] for symbol in symbols if symbol in found}
+
+
+@app.get("/universes/{universe}/sctr/{interval}")
+async def get_sctr(
+    universe: str,
+    interval: str,
+    days: int = 250,
+    response_format: str = Query(None, alias="format"),
+    accept: Annotated[str, Header()] = None,
+):
+    try:
+        fmt = encoding.negotiate(response_format, accept)
+    except exceptions.InvalidFormatError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+    if universe not in universes.universes:
+        raise HTTPException(status_code=404, detail=f"Universe {universe} not found")
+
+    batch, not_found = await _load_many(universes.universes[universe], interval)
+    payload = await run_in_threadpool(
+        _sctr_payload, universe, batch, interval, days, fmt
+    )
+
+    headers = {"X-Symbols-Not-Found": ",".join(not_found)} if not_found else None
+    return Response(payload, media_type=encoding.media_types[fmt], headers=headers)
+
+
+def _sctr_payload(universe, batch, interval, days, fmt) -> bytes:
+    # scores, ranks etc. for the last `days` days of the universe, updated only when
+    # one of its symbols gets new bars
+    version = tuple(
+        (symbol, response_cache.version_of(loaded.ohlc.bars))
+        for symbol, loaded in batch.items()
+    )
+    series = f"universe:{universe}"
+    responses.validate(series, interval, version)
+    cache_key = (series, interval, days, fmt)
+    payload = responses.get(cache_key)
+    if payload is not None:
+        return payload
+
+    table = sctr_tables.table(
+        universe,
+        interval,
+        version,
+        {s: loaded.ohlc.bars for s, loaded in batch.items()},
+    )
+
+    if len(table):
+        start = table["timestamp"].iloc[-1] - pd.Timedelta(days=days)
+        table = table.loc[table["timestamp"] >= start]
+
+    payload = encoding.encode(table.reset_index(drop=True), fmt)
+    responses.put(cache_key, payload, version)
+    return payload
+
+
 @app.get("/symbols/{symbol}/info/{interval}/next_tick", response_model=dict)
-def get_tick(symbol: str, interval: str, when: datetime.datetime = None):
-    if symbol not in active_symbols.keys():
-        active_symbols[symbol] = dict()
+async def get_tick(symbol: str, interval: str, when: datetime.datetime = None):
+    try:
+        loaded = await symbol_loader.get(symbol, interval)
+    except SymbolError as e:
+        raise HTTPException(status_code=404, detail=f"Symbol {symbol} not found")
 
-    if interval not in active_symbols[symbol].keys():
-        active_symbols[symbol][interval] = Symbol(symbol, interval=interval)
+    return await run_in_threadpool(_next_tick, loaded, interval, when)
 
-    df = active_symbols[symbol][interval].ohlc.bars
+
+def _next_tick(loaded, interval: str, when: datetime.datetime) -> dict:
+    df = loaded.ohlc.bars
     return_dict = {"next_timestamp": None, "ready_in_seconds": None}
 
     if when:
-        trimmed = df.loc[df.index <= when]
-        last_timestamp = trimmed.index[-1]
-        # loc = df.index.get_loc(last_timestamp)
-        if last_timestamp < df.index[-1]:
-            loc = df.index.get_loc(last_timestamp)
+        when = windowing.parse_timestamp(when, df.index.tz)
+        loc = windowing.last_position(df.index, when)
+        if loc < len(df.index) - 1:
             return_dict["next_timestamp"] = df.index[loc + 1]
             return_dict["ready_in_seconds"] = 0
             return return_dict
 
     # need to calculate when the next
-    return_dict["ready_in_seconds"] = active_symbols[symbol][interval].ohlc.get_pause()
+    return_dict["ready_in_seconds"] = loaded.ohlc.get_pause()
     last_timestamp = df.index[-1]
     interval_seconds = [i.interval for i in intervals if i.interval_name == interval][0]
     next_timestamp = last_timestamp + relativedelta(seconds=interval_seconds)
@@ -132,13 +594,57 @@ def get_tick(symbol: str, interval: str, when: datetime.datetime = None):
     return return_dict
 
 
+@app.get("/stats/responses", response_model=dict)
+def get_response_stats():
+    return responses.stats()
+
+
+@app.get("/stats/symbols", response_model=dict)
+def get_symbol_stats():
+    return active_symbols.stats()
+
+
+@app.get("/stats/refresher", response_model=dict)
+def get_refresher_stats():
+    return bar_refresher.stats()
+
+
 @app.get("/{market}/hours", response_model=dict)
 def get_market_hours(market: str, clock_id=None):
-    if market in active_symbols.keys():
+    if market in active_markets.keys():
         return {"market": market, "is_open": "open"}
-    active_symbols[market] = "def"
+    active_markets[market] = "def"
     return {"market": market, "is_open": "def"}
 
 
+def serve_publisher(authkey: str) -> None:
+    shared_frames.serve(
+        config.publisher_address,
+        authkey.encode(),
+        stored_bars or symbol_factory,
+        config.shared_frames_dir,
+        (TANotFound,),
+        _start_publisher_refresher if config.refresh_bars else None,
+    )
+
+
+def _start_publisher_refresher(publisher) -> None:
+    # the loader process has no event loop of its own, the refresher gets one
+    publisher_refresher = _bar_refresher(publisher, config.refresh_settle_seconds)
+    threading.Thread(
+        target=asyncio.run, args=(publisher_refresher.run(),), daemon=True
+    ).start()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8002)
+    if config.workers > 1:
+        # one loader process owns the bars, the request workers map them read only
+        authkey = secrets.token_hex(16)
+        os.environ[shared_frames.authkey_variable] = authkey
+        publisher = multiprocessing.Process(
+            target=serve_publisher, args=(authkey,), daemon=True
+        )
+        publisher.start()
+        uvicorn.run("main:app", host="0.0.0.0", port=8002, workers=config.workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,175 @@
+from collections import OrderedDict
+import mmap
+import threading
+
+import numpy as np
+import pandas as pd
+
+LRU = "lru"
+LFU = "lfu"
+
+
+def resident_bytes(loaded) -> int:
+    # what the bars hold in this process. Columns mapped from a file (see
+    # encoding.map_frame) are in the page cache every process shares, and only paged
+    # in as they're used, so they don't count
+    bars = loaded.ohlc.bars
+    usage = bars.memory_usage(deep=True)
+    return int(usage.iloc[0]) + sum(
+        int(size)
+        for column, size in enumerate(usage.iloc[1:])
+        if not _mapped(_values(bars.iloc[:, column]))
+    )
+
+
+def _values(column: pd.Series) -> np.ndarray:
+    # the numpy array behind column, without copying it
+    array = column.array
+    if isinstance(array, pd.Categorical):
+        return array.codes
+    if hasattr(array, "asi8"):
+        return array.asi8
+    return np.asarray(array)
+
+
+def _mapped(array) -> bool:
+    # whether array is a view onto an mmap, however many views removed
+    while array is not None:
+        if isinstance(array, mmap.mmap):
+            return True
+        array = (
+            array.obj if isinstance(array, memoryview) else getattr(array, "base", None)
+        )
+    return False
+
+
+class CacheEntry:
+    value: object
+    bytes: int
+    hits: int
+
+    def __init__(self, value, bytes: int):
+        self.value = value
+        self.bytes = bytes
+        self.hits = 0
+
+
+# bounded replacement for the old symbol -> interval -> Symbol dict. Entries are
+# measured with resident_bytes and evicted LRU or LFU once the budget is exceeded.
+# Pinned symbols are never evicted
+class SymbolCache:
+    max_bytes: int
+    current_bytes: int
+    policy: str
+    evictions: int
+
+    def __init__(self, max_bytes: int, policy: str = LRU, pinned: list = None):
+        if policy not in (LRU, LFU):
+            raise ValueError(f"Eviction policy {policy} is not one of {LRU}, {LFU}")
+
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.policy = policy
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # either bare symbols (pinned for every interval) or (symbol, interval) pairs
+        self._pinned = set(pinned) if pinned else set()
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, interval: str):
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+            if entry is None:
+                return None
+
+            entry.hits += 1
+            self._entries.move_to_end((symbol, interval))
+            return entry.value
+
+    def peek(self, symbol: str, interval: str):
+        # get without counting it as a use
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+            return None if entry is None else entry.value
+
+    def put(self, symbol: str, interval: str, value) -> None:
+        size = resident_bytes(value)
+        with self._lock:
+            key = (symbol, interval)
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key).bytes
+
+            self._entries[key] = CacheEntry(value, size)
+            self.current_bytes += size
+            self._evict(keep=key)
+
+    def resize(self, symbol: str, interval: str) -> None:
+        # call after anything that grows the bars in place, eg. applying TA
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+        if entry is None:
+            return
+
+        size = resident_bytes(entry.value)
+        with self._lock:
+            if self._entries.get((symbol, interval)) is not entry:
+                return
+
+            self.current_bytes += size - entry.bytes
+            entry.bytes = size
+            self._evict(keep=(symbol, interval))
+
+    def pin(self, symbol: str, interval: str = None) -> None:
+        with self._lock:
+            self._pinned.add((symbol, interval) if interval else symbol)
+
+    def unpin(self, symbol: str, interval: str = None) -> None:
+        with self._lock:
+            self._pinned.discard((symbol, interval) if interval else symbol)
+            self._evict()
+
+    def is_pinned(self, symbol: str, interval: str) -> bool:
+        return symbol in self._pinned or (symbol, interval) in self._pinned
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def _evict(self, keep: tuple = None) -> None:
+        # caller holds the lock
+        while self.current_bytes > self.max_bytes:
+            candidates = [
+                k for k in self._entries if k != keep and not self.is_pinned(*k)
+            ]
+            if not candidates:
+                return
+
+            if self.policy == LFU:
+                victim = min(candidates, key=lambda k: self._entries[k].hits)
+            else:
+                # OrderedDict is kept in recency order, oldest first
+                victim = candidates[0]
+
+            self.current_bytes -= self._entries.pop(victim).bytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            symbols = dict()
+            for (symbol, interval), entry in self._entries.items():
+                symbols.setdefault(symbol, dict())[interval] = {
+                    "bytes": entry.bytes,
+                    "hits": entry.hits,
+                    "pinned": self.is_pinned(symbol, interval),
+                }
+
+            return {
+                "policy": self.policy,
+                "max_bytes": self.max_bytes,
+                "bytes": self.current_bytes,
+                "evictions": self.evictions,
+                "symbols": symbols,
+            }
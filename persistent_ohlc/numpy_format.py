@@ -0,0 +1,106 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+# the raw numpy wire format, shared by the service and persistent_ohlc_client so
+# there's one encoder and one decoder to keep in step. Nothing here imports the rest
+# of the service, the client imports it as persistent_ohlc.numpy_format
+#
+# layout: 8 byte little endian header length, json header, padding to an 8 byte
+# boundary, then each column buffer starting on an 8 byte boundary. Fixed width
+# columns go as they are, tz aware timestamps as UTC int64 plus the tz name, and
+# string columns as integer codes plus a category list. That means a string column
+# comes back as a Categorical rather than object dtype. Object columns holding
+# anything but strings (and missing values) can't go in this format
+NUMPY_ALIGNMENT = 8
+
+
+def encode(df: pd.DataFrame) -> bytes:
+    columns = [_column(df.index.name, df.index)]
+    for column in df.columns:
+        columns.append(_column(column, df[column]))
+
+    offset = 0
+    for descriptor, array in columns:
+        descriptor["offset"] = offset
+        offset += array.nbytes
+        offset += -offset % NUMPY_ALIGNMENT
+
+    header = json.dumps(
+        {
+            "rows": len(df),
+            "index": columns[0][0],
+            "columns": [descriptor for descriptor, _ in columns[1:]],
+        }
+    ).encode()
+    header += b" " * (-(len(header) + 8) % NUMPY_ALIGNMENT)
+
+    out = io.BytesIO()
+    out.write(len(header).to_bytes(8, "little"))
+    out.write(header)
+    for _, array in columns:
+        out.write(array.tobytes())
+        out.write(b"\0" * (-array.nbytes % NUMPY_ALIGNMENT))
+
+    return out.getvalue()
+
+
+def _column(name, values):
+    # returns the header entry for this column and the array to write out
+    descriptor = {"name": name}
+    dtype = values.dtype
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        descriptor["tz"] = str(dtype.tz)
+        values = pd.DatetimeIndex(values).tz_convert("UTC").tz_localize(None)
+    elif isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype):
+        values = pd.Categorical(values)
+        kind = pd.api.types.infer_dtype(values.categories, skipna=True)
+        if kind not in ("string", "empty"):
+            # str() of them would come back as something else
+            raise TypeError(
+                f"Column {name} holds {kind} values, only strings can be sent as "
+                f"categories"
+            )
+        descriptor["categories"] = list(values.categories)
+        values = values.codes
+
+    array = np.ascontiguousarray(np.asarray(values))
+    if array.dtype == object:
+        raise TypeError(f"Column {name} is {values.dtype}, which isn't fixed width")
+
+    descriptor["dtype"] = array.dtype.str
+    return descriptor, array
+
+
+def decode(content) -> pd.DataFrame:
+    # inverse of encode. The column arrays are views straight onto content, which can
+    # be anything with the buffer protocol, eg. a response body or an mmap
+    header_length = int.from_bytes(content[:8], "little")
+    header = json.loads(bytes(content[8 : 8 + header_length]))
+    data = memoryview(content)[8 + header_length :]
+    rows = header["rows"]
+
+    index = pd.Index(_values(header["index"], data, rows))
+    index.name = header["index"]["name"]
+    columns = {
+        descriptor["name"]: _values(descriptor, data, rows)
+        for descriptor in header["columns"]
+    }
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def _values(descriptor: dict, data, rows: int):
+    values = np.frombuffer(
+        data,
+        dtype=np.dtype(descriptor["dtype"]),
+        count=rows,
+        offset=descriptor["offset"],
+    )
+    if "tz" in descriptor:
+        return pd.DatetimeIndex(values).tz_localize("UTC").tz_convert(descriptor["tz"])
+    if "categories" in descriptor:
+        return pd.Categorical.from_codes(values, descriptor["categories"])
+    return values
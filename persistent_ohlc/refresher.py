@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def next_boundary(now: float, interval_seconds: int) -> float:
+    # epoch seconds of the first interval boundary after now. Boundaries are multiples
+    # of the interval since the epoch, ie. on the minute, the 5 minutes, the hour or
+    # midnight UTC
+    return (now // interval_seconds + 1) * interval_seconds
+
+
+# keeps resident series current so no request waits on upstream. Each interval gets a
+# loop that wakes settle seconds after every boundary, once upstream should have the
+# bar that just closed, and refreshes everything resident at that interval in batches
+# of batch_size with batch_pause seconds between them. Loads run on threads of the
+# refresher's own, a daily boundary (when every interval is due) can't take the
+# threadpool request handlers use
+class BarRefresher:
+    def __init__(
+        self,
+        cache,
+        refresh,
+        intervals: dict,
+        settle: float = 5,
+        batch_size: int = 10,
+        batch_pause: float = 1,
+        threads: int = 4,
+    ):
+        # cache has keys(), peek(symbol, interval) and put(symbol, interval, loaded).
+        # refresh(symbol, interval, loaded, since) returns what should replace loaded,
+        # or None to leave it. intervals is interval name -> seconds
+        self._cache = cache
+        self._refresh = refresh
+        self.intervals = intervals
+        self.settle = settle
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.refreshed = 0
+        self.failures = 0
+        self.last_run = dict()
+        self._task = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="bar-refresher"
+        )
+
+    def start(self) -> None:
+        # needs a running event loop
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self) -> None:
+        await asyncio.gather(
+            *[
+                self._run(interval, seconds)
+                for interval, seconds in self.intervals.items()
+            ]
+        )
+
+    async def _run(self, interval: str, seconds: int) -> None:
+        while True:
+            boundary = next_boundary(time.time(), seconds)
+            await asyncio.sleep(max(0, boundary + self.settle - time.time()))
+            try:
+                await self.refresh(interval, boundary)
+            except Exception as e:
+                # keep the loop going, the next boundary gets another go
+                log.exception(f"Refreshing {interval} failed: {e}")
+
+    async def refresh(self, interval: str, since: float, symbols: list = None) -> int:
+        # refreshes everything resident at interval, or just symbols, returns how
+        # many were
+        keys = [
+            key
+            for key in self._cache.keys()
+            if key[1] == interval and (symbols is None or key[0] in symbols)
+        ]
+        refreshed = 0
+        for start in range(0, len(keys), self.batch_size):
+            if start:
+                await asyncio.sleep(self.batch_pause)
+            results = await asyncio.gather(
+                *[
+                    self._refresh_one(symbol, interval, since)
+                    for symbol, interval in keys[start : start + self.batch_size]
+                ]
+            )
+            refreshed += sum(results)
+
+        self.last_run[interval] = time.time()
+        return refreshed
+
+    async def _refresh_one(self, symbol: str, interval: str, since: float) -> bool:
+        loaded = self._cache.peek(symbol, interval)
+        if loaded is None:
+            # evicted since
+            return False
+
+        try:
+            fresh = await self._run_in_executor(
+                self._refresh, symbol, interval, loaded, since
+            )
+        except Exception as e:
+            log.warning(f"Unable to refresh {symbol} {interval}: {e}")
+            self.failures += 1
+            return False
+
+        if fresh is not None and (symbol, interval) in self._cache:
+            await self._run_in_executor(self._cache.put, symbol, interval, fresh)
+        self.refreshed += 1
+        return True
+
+    async def _run_in_executor(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "refreshed": self.refreshed,
+            "failures": self.failures,
+            "last_run": dict(self.last_run),
+        }
@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import hashlib
+import threading
+
+import pandas as pd
+
+
+def version_of(bars: pd.DataFrame) -> tuple:
+    # cheap fingerprint that changes whenever bars are appended, the last (still
+    # forming) bar is updated, or TA columns are added
+    if len(bars) == 0:
+        return (0, None, len(bars.columns), None)
+
+    last_row = repr(bars.iloc[-1].tolist())
+    return (len(bars), bars.index[-1], len(bars.columns), last_row)
+
+
+def etag_of(version: tuple) -> str:
+    # weak, because it identifies the state of the series and the query rather than
+    # the exact bytes
+    digest = hashlib.sha1(repr(version).encode()).hexdigest()[:16]
+    return f'W/"{digest}"'
+
+
+# LRU cache of already encoded response bodies, bounded by total payload bytes. Keys
+# are tuples that start with (symbol, interval) so that every payload for a series can
+# be dropped when that series' bars change
+class ResponseCache:
+    max_bytes: int
+    current_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._versions = dict()
+        self._lock = threading.Lock()
+
+    def validate(self, symbol: str, interval: str, version: tuple) -> None:
+        with self._lock:
+            series = (symbol, interval)
+            if self._versions.get(series) == version:
+                return
+
+            if series in self._versions:
+                self.invalidations += 1
+                for key in [k for k in self._entries if k[:2] == series]:
+                    self.current_bytes -= len(self._entries.pop(key))
+
+            self._versions[series] = version
+
+    def get(self, key: tuple) -> bytes:
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key: tuple, payload: bytes, version: tuple = None) -> None:
+        # version is what the payload was made from. If the series has moved on since
+        # then the payload is stale and isn't kept
+        if len(payload) > self.max_bytes:
+            return
+
+        with self._lock:
+            if version is not None and self._versions.get(key[:2]) != version:
+                return
+
+            if key in self._entries:
+                self.current_bytes -= len(self._entries.pop(key))
+
+            self._entries[key] = payload
+            self.current_bytes += len(payload)
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
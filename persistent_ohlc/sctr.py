@@ -0,0 +1,523 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+import sys
+
+if "unittest" in sys.modules.keys():
+    from . import indicators
+else:
+    import indicators
+
+# long format columns, one row per (timestamp, symbol)
+fields = [
+    "sctr",
+    "close",
+    "rank",
+    "velocity",
+    "one_day_increase",
+    "two_day_increase",
+    "consecutive_increase",
+]
+
+
+def close_matrix(frames: dict) -> pd.DataFrame:
+    # (time x symbol) closes on the union of every symbol's timestamps. NaN where a
+    # symbol has no bar
+    if len({str(frame.index.tz) for frame in frames.values()}) > 1:
+        frames = {s: frame.tz_convert("UTC") for s, frame in frames.items()}
+
+    close = pd.concat({s: frame["Close"] for s, frame in frames.items()}, axis=1)
+    return close.sort_index().astype(np.float64)
+
+
+def slope_weight(slope):
+    # 0 below -1, 5 above 1, linear in between
+    return ((slope + 1) * 50 * 0.05).clip(lower=0, upper=5).fillna(0)
+
+
+def _compact(values: np.ndarray) -> tuple:
+    # move every column's closes up to the top, in order, so row n is the symbol's nth
+    # bar and gaps fall to the bottom as NaN. Returns the compacted matrix and the row
+    # each of its values came from
+    order = np.argsort(np.isnan(values), axis=0, kind="stable")
+    return np.take_along_axis(values, order, axis=0), order
+
+
+def _restore(compact: np.ndarray, order: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    restored = np.empty_like(compact)
+    np.put_along_axis(restored, order, compact, axis=0)
+    return np.where(valid, restored, np.nan)
+
+
+def _tail(compact: np.ndarray, bars: np.ndarray, count: int) -> np.ndarray:
+    # last count rows of each compacted column, ie. its last count bars, oldest first.
+    # NaN where a symbol has fewer bars than that
+    rows = bars[None, :] - count + np.arange(count)[:, None]
+    tail = compact[np.maximum(rows, 0), np.arange(compact.shape[1])]
+    return np.where(rows >= 0, tail, np.nan)
+
+
+def _own_history(close: pd.DataFrame, calculate) -> pd.DataFrame:
+    # run calculate over each symbol's own bars, so that a symbol listed part way
+    # through or missing bars gets the same indicators it would on its own. NaN where
+    # a symbol has no bar
+    values = close.to_numpy()
+    compact, order = _compact(values)
+    result = calculate(pd.DataFrame(compact, columns=close.columns))
+    return pd.DataFrame(
+        _restore(result.to_numpy(dtype=np.float64), order, ~np.isnan(values)),
+        index=close.index,
+        columns=close.columns,
+    )
+
+
+def _score(close: pd.DataFrame) -> pd.DataFrame:
+    ema_200 = indicators.seeded_ema(close, 200)
+    ema_50 = indicators.seeded_ema(close, 50)
+    slope = indicators.ppo_hist_slope(close)[3]
+
+    return (
+        # long term
+        (close / ema_200 * 100) * 0.3
+        + indicators.roc(close, 125) * 0.3
+        # mid term
+        + (close / ema_50 * 100) * 0.15
+        + indicators.roc(close, 20) * 0.15
+        # short term
+        + indicators.rsi(close, 14) * 0.05
+        + slope_weight(slope)
+    )
+
+
+def scores(close: pd.DataFrame) -> pd.DataFrame:
+    # SCTR indicator score for every (time, symbol) in one pass over the matrix.
+    # NaN wherever the symbol has no bar
+    return _own_history(close, _score)
+
+
+def panel(close: pd.DataFrame) -> dict:
+    # field -> (time x symbol) frame
+    score = scores(close)
+    rank = score.rank(axis=1, ascending=False)
+    # velocity has always been worked out on the ranks of the ranks, ie. it's the
+    # change in rank number and positive means the symbol dropped
+    rank_of_rank = rank.rank(axis=1, ascending=False)
+    one_day_increase = close - close.shift() > 0
+    two_day_increase = close.shift() - close.shift(2) > 0
+
+    return {
+        "sctr": score,
+        "close": close,
+        "rank": rank,
+        "velocity": rank_of_rank.shift() - rank_of_rank,
+        "one_day_increase": one_day_increase,
+        "two_day_increase": two_day_increase,
+        "consecutive_increase": one_day_increase & two_day_increase,
+    }
+
+
+def to_long(wide: dict) -> pd.DataFrame:
+    # stack every field into one row per (timestamp, symbol), dropping rows that have
+    # no score yet
+    first = wide["sctr"]
+    return _stack(
+        first.index, list(first.columns), {f: wide[f].to_numpy() for f in fields}
+    )
+
+
+def _stack(index: pd.DatetimeIndex, symbols: list, values: dict) -> pd.DataFrame:
+    long_df = pd.DataFrame(
+        {
+            "timestamp": np.repeat(index, len(symbols)),
+            "symbol": pd.Categorical.from_codes(
+                np.tile(np.arange(len(symbols)), len(index)), symbols
+            ),
+        }
+    )
+    for field in fields:
+        long_df[field] = values[field].ravel()
+
+    return long_df.loc[long_df["sctr"].notna()].reset_index(drop=True)
+
+
+def build(frames: dict) -> pd.DataFrame:
+    return to_long(panel(close_matrix(frames)))
+
+
+def _ewm_step(weighted, old_wt, value, alpha, adjust):
+    # one step of pandas' ewm, written the same way so the results line up with the
+    # batch calculation. Starts from the first non NaN value
+    factor = 1 - alpha
+    new_wt = 1.0 if adjust else alpha
+    observed = ~np.isnan(value)
+    started = ~np.isnan(weighted)
+
+    stepped_wt = old_wt * factor
+    with np.errstate(invalid="ignore"):
+        stepped = (stepped_wt * weighted + new_wt * value) / (stepped_wt + new_wt)
+    stepped = np.where(weighted == value, weighted, stepped)
+    stepped_wt = stepped_wt + new_wt if adjust else np.ones_like(old_wt)
+
+    weighted = np.where(
+        started & observed, stepped, np.where(observed, value, weighted)
+    )
+    # a gap after the first value still decays the weights
+    old_wt = np.where(
+        started & observed, stepped_wt, np.where(started, old_wt * factor, old_wt)
+    )
+    return weighted, old_wt
+
+
+# running SCTR state for a universe, one slot per symbol in each array. Every
+# indicator in the score has a recursive form, so update() costs the same no matter
+# how much history there is. from_history() picks the state up from the batch
+# calculation and the two agree to floating point noise
+class SctrEngine:
+    long_window = 200
+    mid_window = 50
+    long_roc = 125
+    mid_roc = 20
+    rsi_window = 14
+    ppo_fast = 12
+    ppo_slow = 26
+    ppo_sign = 9
+    slope_window = 3
+
+    def __init__(self, symbols: list):
+        count = len(symbols)
+        self.symbols = list(symbols)
+        self.timestamp = None
+
+        self.state = {
+            # bars seen since the symbol's first close, and the last close seen
+            "bars": np.zeros(count, dtype=np.int64),
+            "close": np.full(count, np.nan),
+            "raw_close": np.full(count, np.nan),
+            "raw_previous": np.full(count, np.nan),
+            "long_ema": np.full(count, np.nan),
+            "long_sum": np.zeros(count),
+            "mid_ema": np.full(count, np.nan),
+            "mid_sum": np.zeros(count),
+            "fast_ema": np.full(count, np.nan),
+            "slow_ema": np.full(count, np.nan),
+            "signal": np.full(count, np.nan),
+            "gain": np.full(count, np.nan),
+            "gain_wt": np.ones(count),
+            "loss": np.full(count, np.nan),
+            "loss_wt": np.ones(count),
+            "rank_of_rank": np.full(count, np.nan),
+            # previous slope_window PPO histogram values, oldest first
+            "hist": np.full((self.slope_window, count), np.nan),
+            # last long_roc + 1 closes as a ring buffer per symbol, head being the
+            # slot with the newest
+            "closes": np.full((self.long_roc + 1, count), np.nan),
+            "head": np.zeros(count, dtype=np.int64),
+        }
+        self._previous = None
+
+    @classmethod
+    def from_history(cls, close: pd.DataFrame):
+        # close is a close_matrix(). Leaves the engine as if update() had been called
+        # for every row, with the last row still open to being redone
+        engine = cls(close.columns)
+        if len(close) == 0:
+            return engine
+
+        settled = close.iloc[:-1]
+        if len(settled):
+            engine._capture(settled)
+        engine.update(close.index[-1], close.iloc[-1].to_numpy(dtype=np.float64))
+        return engine
+
+    def _capture(self, close: pd.DataFrame) -> None:
+        state = self.state
+        values = close.to_numpy()
+        compact, _ = _compact(values)
+        bars = (~np.isnan(values)).sum(axis=0)
+        frame = pd.DataFrame(compact, columns=close.columns)
+        own = lambda calculate, count=1: _tail(
+            calculate(frame).to_numpy(dtype=np.float64), bars, count
+        )
+        last = lambda calculate: own(calculate)[0]
+
+        state["bars"] = bars
+        state["close"] = _tail(compact, bars, 1)[0]
+        state["raw_close"] = values[-1]
+        if len(close) > 1:
+            state["raw_previous"] = values[-2]
+
+        for name, window in (("long", self.long_window), ("mid", self.mid_window)):
+            state[f"{name}_ema"] = last(lambda f: indicators.seeded_ema(f, window))
+            state[f"{name}_sum"] = np.where(bars < window, np.nansum(values, axis=0), 0)
+
+        # without min_periods, the state carries on from the very first close
+        state["fast_ema"] = last(
+            lambda f: f.ewm(span=self.ppo_fast, adjust=False).mean()
+        )
+        state["slow_ema"] = last(
+            lambda f: f.ewm(span=self.ppo_slow, adjust=False).mean()
+        )
+        ppo = lambda f: indicators.ppo_hist_slope(
+            f, self.ppo_fast, self.ppo_slow, self.ppo_sign, self.slope_window
+        )
+        state["signal"] = last(lambda f: ppo(f)[1])
+        state["hist"] = own(lambda f: ppo(f)[2], self.slope_window)
+
+        alpha = 1.0 / self.rsi_window
+        state["gain"] = last(lambda f: f.diff().clip(lower=0).ewm(alpha=alpha).mean())
+        state["loss"] = last(
+            lambda f: f.diff().clip(upper=0).abs().ewm(alpha=alpha).mean()
+        )
+        # weight of everything seen so far, ie. sum of (1 - alpha)^k over the changes
+        changes = np.maximum(bars - 1, 0)
+        wt = np.where(changes > 0, (1 - (1 - alpha) ** changes) / alpha, 1.0)
+        state["gain_wt"] = wt
+        state["loss_wt"] = wt.copy()
+
+        # each symbol's nth bar goes in slot n of its ring buffer
+        size = len(state["closes"])
+        slots = (bars[None, :] - size + np.arange(size)[:, None]) % size
+        state["closes"][slots, np.arange(len(bars))] = _tail(compact, bars, size)
+        state["head"] = (bars - 1) % size
+
+        rank = scores(close).rank(axis=1, ascending=False)
+        state["rank_of_rank"] = rank.rank(axis=1, ascending=False).to_numpy()[-1]
+        self.timestamp = close.index[-1]
+
+    def update(self, timestamp, raw: np.ndarray) -> dict:
+        # raw is this bar's close for every symbol, NaN where a symbol has no bar.
+        # Passing the current timestamp again redoes it, eg. for a still forming bar.
+        # Returns field -> array for this timestamp
+        if self.timestamp is not None and timestamp < self.timestamp:
+            raise ValueError(f"{timestamp} is before {self.timestamp}")
+
+        if timestamp == self.timestamp and self._previous is not None:
+            # state arrays are replaced rather than written to, apart from the one
+            # ring buffer slot per symbol
+            self.state, (slots, overwritten) = self._previous
+            self.state["closes"][slots, np.arange(len(slots))] = overwritten
+        self.timestamp = timestamp
+
+        state = dict(self.state)
+        n = state["bars"]
+        # a symbol with no bar this time is left as it was, the indicators only
+        # step over its own bars
+        observed = ~np.isnan(raw)
+        close = np.where(observed, raw, state["close"])
+        symbols = np.arange(len(raw))
+
+        head = np.where(
+            observed, (state["head"] + 1) % len(state["closes"]), state["head"]
+        )
+        self._previous = (self.state, (head, state["closes"][head, symbols].copy()))
+        state["closes"][head, symbols] = close
+        state["head"] = head
+
+        def seeded(name, window):
+            alpha = 2 / (window + 1)
+            state[f"{name}_sum"] = np.where(
+                observed & (n < window),
+                state[f"{name}_sum"] + close,
+                state[f"{name}_sum"],
+            )
+            stepped, _ = _ewm_step(state[f"{name}_ema"], 1.0, close, alpha, False)
+            state[f"{name}_ema"] = np.where(
+                n == window - 1,
+                state[f"{name}_sum"] / window,
+                np.where(n > window - 1, stepped, np.nan),
+            )
+            return state[f"{name}_ema"]
+
+        long_ema = seeded("long", self.long_window)
+        mid_ema = seeded("mid", self.mid_window)
+
+        def roc(window):
+            previous = state["closes"][(head - window) % len(state["closes"]), symbols]
+            return (close - previous) / previous * 100
+
+        # ppo emas don't have a seed, they start from the first close
+        fast, _ = _ewm_step(
+            state["fast_ema"], 1.0, close, 2 / (self.ppo_fast + 1), False
+        )
+        slow, _ = _ewm_step(
+            state["slow_ema"], 1.0, close, 2 / (self.ppo_slow + 1), False
+        )
+        state["fast_ema"], state["slow_ema"] = fast, slow
+        fast = np.where(n >= self.ppo_fast - 1, fast, np.nan)
+        slow = np.where(n >= self.ppo_slow - 1, slow, np.nan)
+        ppo = (fast - slow) / slow * 100
+        # the signal's SMA seed lands before there's any PPO, so it starts from the
+        # first PPO value instead
+        state["signal"], _ = _ewm_step(
+            state["signal"], 1.0, ppo, 2 / (self.ppo_sign + 1), False
+        )
+        hist = close - state["signal"]
+        previous_hist = state["hist"]
+        slope = indicators.slope_weights(self.slope_window) @ previous_hist
+        slope = np.where(np.isnan(slope), 0, slope)
+        state["hist"] = np.vstack([previous_hist[1:], hist])
+
+        change = np.where(n > 0, close - state["close"], np.nan)
+        alpha = 1.0 / self.rsi_window
+        state["gain"], state["gain_wt"] = _ewm_step(
+            state["gain"], state["gain_wt"], np.clip(change, 0, None), alpha, True
+        )
+        state["loss"], state["loss_wt"] = _ewm_step(
+            state["loss"],
+            state["loss_wt"],
+            np.abs(np.clip(change, None, 0)),
+            alpha,
+            True,
+        )
+        rsi = np.where(
+            n >= self.rsi_window,
+            state["gain"] / (state["gain"] + state["loss"]) * 100,
+            np.nan,
+        )
+
+        score = (
+            (close / long_ema * 100) * 0.3
+            + roc(self.long_roc) * 0.3
+            + (close / mid_ema * 100) * 0.15
+            + roc(self.mid_roc) * 0.15
+            + rsi * 0.05
+            + slope_weight(pd.Series(slope)).to_numpy()
+        )
+        score = np.where(np.isnan(raw), np.nan, score)
+
+        rank = pd.Series(score).rank(ascending=False)
+        rank_of_rank = rank.rank(ascending=False).to_numpy()
+        raw_previous = state["raw_close"]
+        one_day_increase = raw - raw_previous > 0
+        two_day_increase = raw_previous - state["raw_previous"] > 0
+
+        for name in (
+            "long_ema",
+            "long_sum",
+            "mid_ema",
+            "mid_sum",
+            "fast_ema",
+            "slow_ema",
+            "signal",
+            "hist",
+            "gain",
+            "gain_wt",
+            "loss",
+            "loss_wt",
+        ):
+            state[name] = np.where(observed, state[name], self.state[name])
+        state["bars"] = n + observed
+        state["close"] = close
+        state["raw_previous"] = raw_previous
+        state["raw_close"] = raw
+        velocity = state["rank_of_rank"] - rank_of_rank
+        state["rank_of_rank"] = rank_of_rank
+        self.state = state
+
+        return {
+            "sctr": score,
+            "close": raw,
+            "rank": rank.to_numpy(),
+            "velocity": velocity,
+            "one_day_increase": one_day_increase,
+            "two_day_increase": two_day_increase,
+            "consecutive_increase": one_day_increase & two_day_increase,
+        }
+
+
+# long SCTR table for a universe that grows by engine updates as bars arrive, rather
+# than being rebuilt from scratch. Only the newest bar can change in place, anything
+# else (a symbol added or removed, bars inserted or dropped earlier on, a long gap to
+# catch up on) rebuilds it
+class SctrTable:
+    # catching up on more bars than this is quicker as one batch
+    max_catch_up = 32
+
+    def __init__(self, frames: dict):
+        self.rebuild(frames)
+
+    def rebuild(self, frames: dict) -> None:
+        close = close_matrix(frames)
+        self.engine = SctrEngine.from_history(close)
+        self._counts = self._counted(frames)
+        long_df = to_long(panel(close))
+        if len(close):
+            latest = long_df["timestamp"] == close.index[-1]
+            self._chunks = [long_df.loc[~latest], long_df.loc[latest]]
+        else:
+            self._chunks = [long_df, long_df]
+
+    def _counted(self, frames: dict) -> list:
+        # bars each symbol has up to and including the engine's timestamp
+        if self.engine.timestamp is None:
+            return [0] * len(frames)
+        return [
+            frames[s].index.searchsorted(self.engine.timestamp, side="right")
+            for s in self.engine.symbols
+        ]
+
+    def extend(self, frames: dict) -> None:
+        engine = self.engine
+        if engine.timestamp is None or list(frames) != engine.symbols:
+            return self.rebuild(frames)
+        try:
+            counts = self._counted(frames)
+        except TypeError:
+            # timezone changed under us
+            return self.rebuild(frames)
+        if counts != self._counts:
+            return self.rebuild(frames)
+
+        # the engine's current bar may have changed too, so it's always redone
+        starts = [
+            frames[s].index.searchsorted(engine.timestamp) for s in engine.symbols
+        ]
+        times = [frames[s].index[start:] for s, start in zip(engine.symbols, starts)]
+        if len({str(t.tz) for t in times}) > 1:
+            times = [t.tz_convert("UTC") for t in times]
+        index = times[0].append(times[1:]).unique().sort_values()
+        if len(index) > self.max_catch_up:
+            return self.rebuild(frames)
+
+        raw = np.full((len(index), len(times)), np.nan)
+        for column, (symbol, start) in enumerate(zip(engine.symbols, starts)):
+            rows = index.get_indexer(times[column])
+            raw[rows, column] = frames[symbol]["Close"].to_numpy()[start:]
+
+        for row in range(len(index)):
+            if index[row] != engine.timestamp:
+                self._chunks.append(None)
+            outputs = engine.update(index[row], raw[row])
+            self._chunks[-1] = _stack(index[row : row + 1], engine.symbols, outputs)
+        self._counts = self._counted(frames)
+
+    def table(self) -> pd.DataFrame:
+        if len(self._chunks) > 2:
+            settled = pd.concat(self._chunks[:-1], ignore_index=True)
+            self._chunks = [settled, self._chunks[-1]]
+        return pd.concat(self._chunks, ignore_index=True)
+
+
+# SCTR tables per (universe, interval), extended when any of the universe's bars
+# change
+class SctrCache:
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def table(self, universe: str, interval: str, version: tuple, frames: dict):
+        with self._lock:
+            entry = self._entries.setdefault(
+                (universe, interval), [None, None, threading.Lock()]
+            )
+
+        # one universe's build doesn't hold up the others
+        with entry[2]:
+            if entry[1] is None:
+                entry[1] = SctrTable(frames)
+            elif entry[0] != version:
+                entry[1].extend(frames)
+            entry[0] = version
+            return entry[1].table()
@@ -0,0 +1,246 @@
+import itertools
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from urllib.parse import quote
+
+import pandas as pd
+
+import sys
+
+if "unittest" in sys.modules.keys():
+    from . import encoding, indicators, response_cache
+else:
+    import encoding, indicators, response_cache
+
+# request workers find the loader process's authkey here
+authkey_variable = "PERSISTENT_OHLC_PUBLISHER_KEY"
+
+# multi process serving. One loader process owns every Symbol and publishes its bars
+# as a mapped numpy format file (see encoding.write_mapped), ideally somewhere tmpfs
+# backed like /dev/shm. Request workers map the file read only, so slicing and encoding
+# never copy the bars and N workers share one copy of them. Republishing writes a new
+# file and unlinks the old one, workers still mapping it keep it until they let go
+
+
+def publish(bars: pd.DataFrame, path: str) -> dict:
+    # write bars to path, returns the spec attach needs to map it
+    encoding.write_mapped(bars, path)
+    return {"path": path}
+
+
+def attach(spec: dict) -> pd.DataFrame:
+    return encoding.map_frame(spec["path"])
+
+
+class PublishedEntry:
+    def __init__(self):
+        self.loaded = None
+        self.spec = None
+        self.version = None
+        # TA asked for so far, put back when the bars are refreshed
+        self.ta = set()
+        self.lock = threading.Lock()
+
+
+# lives in the loader process and does all loading and TA. Workers call it through a
+# PublisherManager
+class BarPublisher:
+    def __init__(self, factory, directory: str, not_found: tuple = ()):
+        self._factory = factory
+        self._directory = directory
+        # what symbol_cache raises for TA it doesn't have
+        self._not_found = not_found
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self._published = itertools.count()
+
+    def spec(self, symbol: str, interval: str, ta: list = None) -> dict:
+        # spec of the current bars, with ta applied. "ta" lists all the TA in them,
+        # and TA that neither we nor symbol_cache know is listed under "missing"
+        with self._lock:
+            entry = self._entries.setdefault((symbol, interval), PublishedEntry())
+
+        with entry.lock:
+            if entry.loaded is None:
+                entry.loaded = self._factory(symbol, interval)
+
+            missing = self._apply(entry.loaded, ta or [])
+            entry.ta.update(set(ta or []).difference(missing))
+
+            bars = entry.loaded.ohlc.bars
+            version = response_cache.version_of(bars)
+            if entry.spec is None or entry.version != version:
+                previous = entry.spec
+                path = os.path.join(
+                    self._directory,
+                    f"{quote(interval, safe='')}-{quote(symbol, safe='')}-"
+                    f"{next(self._published)}",
+                )
+                entry.spec = publish(bars, path)
+                entry.version = version
+                if previous:
+                    os.remove(previous["path"])
+
+            return {**entry.spec, "ta": sorted(entry.ta), "missing": missing}
+
+    # keys, peek, put and in are what a BarRefresher needs to keep these current
+
+    def keys(self) -> list:
+        with self._lock:
+            return [k for k, entry in self._entries.items() if entry.loaded is not None]
+
+    def peek(self, symbol: str, interval: str):
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+        return None if entry is None else entry.loaded
+
+    def put(self, symbol: str, interval: str, loaded) -> None:
+        # published on the next spec call, with the TA the bars it replaces had
+        with self._lock:
+            entry = self._entries.setdefault((symbol, interval), PublishedEntry())
+        self._apply(loaded, list(entry.ta))
+        with entry.lock:
+            entry.loaded = loaded
+
+    def _apply(self, loaded, ta: list) -> list:
+        # returns the names nobody knew
+        missing = []
+        for name in indicators.apply_many(loaded.ohlc.bars, ta):
+            try:
+                loaded.ohlc.apply_ta(name)
+            except self._not_found:
+                missing.append(name)
+        return missing
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def pause(self, symbol: str, interval: str) -> float:
+        with self._lock:
+            entry = self._entries.get((symbol, interval))
+        if entry is None or entry.loaded is None:
+            self.spec(symbol, interval)
+            entry = self._entries[(symbol, interval)]
+        return entry.loaded.ohlc.get_pause()
+
+
+class PublisherManager(BaseManager):
+    pass
+
+
+def serve(
+    address: tuple,
+    authkey: bytes,
+    factory,
+    directory: str,
+    not_found: tuple = (),
+    on_start=None,
+) -> None:
+    # runs the loader process until it's killed. Files go in a directory of their
+    # own that's removed on the way out. on_start is given the publisher first
+    os.makedirs(directory, exist_ok=True)
+    directory = tempfile.mkdtemp(dir=directory)
+    publisher = BarPublisher(factory, directory, not_found)
+    if on_start:
+        on_start(publisher)
+    PublisherManager.register("publisher", callable=lambda: publisher)
+    # terminate() is a SIGTERM, exit properly so the directory still gets removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        PublisherManager(address=address, authkey=authkey).get_server().serve_forever()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# enough of a symbol_cache Symbol for a request worker to serve published bars
+class SharedOhlc:
+    def __init__(self, publisher, symbol: str, interval: str, retries: int = 3):
+        self._publisher = publisher
+        self.symbol = symbol
+        self.interval = interval
+        self._retries = retries
+        self.spec = None
+        self.bars = None
+        # TA the mapped bars have, and TA the loader process doesn't know
+        self.ta = set()
+        self.missing = set()
+        self.remap()
+
+    def apply_many(self, names: list) -> list:
+        # has the loader process apply the TA and maps the result. Only goes to the
+        # loader process for TA the mapped bars don't have, every worker's TA requests
+        # would otherwise queue up on it. Returns the names nobody knew
+        if set(names).issubset(self.ta | self.missing):
+            return [name for name in names if name in self.missing]
+        return self._map(names)
+
+    def remap(self) -> None:
+        # maps whatever's published now, eg. once the loader process has refreshed it
+        self._map([])
+
+    def _map(self, names: list) -> list:
+        for attempt in range(self._retries):
+            spec = self._publisher.spec(self.symbol, self.interval, list(names))
+            if self.spec and spec["path"] == self.spec["path"]:
+                break
+            try:
+                self.bars = attach(spec)
+                self.spec = spec
+                break
+            except FileNotFoundError:
+                # republished in the meantime
+                if attempt == self._retries - 1:
+                    raise
+        self.ta = set(spec["ta"])
+        self.missing.update(spec["missing"])
+        return spec["missing"]
+
+    def apply_ta(self, name: str) -> None:
+        self.apply_many([name])
+
+    def get_pause(self) -> float:
+        return self._publisher.pause(self.symbol, self.interval)
+
+
+class SharedSymbol:
+    def __init__(self, publisher, symbol: str, interval: str):
+        self.symbol = symbol
+        self.interval = interval
+        self.ohlc = SharedOhlc(publisher, symbol, interval)
+
+
+# SymbolLoader factory for request workers. Connects to the loader process the first
+# time it's needed, which may still be starting up
+class SharedFrames:
+    def __init__(self, address: tuple, authkey: bytes, retries: int = 50):
+        self._address = address
+        self._authkey = authkey
+        self._retries = retries
+        self._publisher = None
+        self._lock = threading.Lock()
+
+    def publisher(self):
+        with self._lock:
+            if self._publisher is None:
+                self._publisher = self._connect()
+            return self._publisher
+
+    def _connect(self):
+        PublisherManager.register("publisher")
+        manager = PublisherManager(address=self._address, authkey=self._authkey)
+        for attempt in range(self._retries):
+            try:
+                manager.connect()
+                return manager.publisher()
+            except ConnectionRefusedError:
+                if attempt == self._retries - 1:
+                    raise
+                time.sleep(0.1)
+
+    def __call__(self, symbol: str, interval: str) -> SharedSymbol:
+        return SharedSymbol(self.publisher(), symbol, interval)
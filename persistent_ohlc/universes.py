@@ -0,0 +1,314 @@
+# named symbol universes the service can rank as a whole, eg. for SCTR
+asx = [
+    "A2M.AX",
+    "AAA.AX",
+    # "ABC.AX",
+    "ABP.AX",
+    "AFI.AX",
+    "AGL.AX",
+    "AIA.AX",
+    "ALD.AX",
+    "ALL.AX",
+    "ALQ.AX",
+    "ALU.AX",
+    "ALX.AX",
+    # "AMC.AX",
+    "AMP.AX",
+    # "ANN.AX",
+    "ANZ.AX",
+    "APA.AX",
+    "APE.AX",
+    "APX.AX",
+    "ARB.AX",
+    "ARG.AX",
+    "ASX.AX",
+    "AWC.AX",
+    "AZJ.AX",
+    "BAP.AX",
+    "BEN.AX",
+    "BGA.AX",
+    "BHP.AX",
+    "BKW.AX",
+    "BLD.AX",
+    "BOQ.AX",
+    "BPT.AX",
+    "BRG.AX",
+    "BSL.AX",
+    "BWP.AX",
+    "BXB.AX",
+    "CAR.AX",
+    "CBA.AX",
+    "CCP.AX",
+    "CDA.AX",
+    "CGF.AX",
+    "CHC.AX",
+    "CHN.AX",
+    "CIA.AX",
+    "CLW.AX",
+    "CMW.AX",
+    "CNU.AX",
+    "COH.AX",
+    "COL.AX",
+    "CPU.AX",
+    "CQR.AX",
+    "CSL.AX",
+    "CSR.AX",
+    "CTD.AX",
+    "CWY.AX",
+    "DEG.AX",
+    "DHG.AX",
+    "DMP.AX",
+    "DOW.AX",
+    "DRR.AX",
+    "DXS.AX",
+    "EBO.AX",
+    "ELD.AX",
+    "EML.AX",
+    "EVN.AX",
+    "EVT.AX",
+    "FBU.AX",
+    "FLT.AX",
+    "FMG.AX",
+    "FPH.AX",
+    "GMG.AX",
+    "GNE.AX",
+    "GOZ.AX",
+    "GPT.AX",
+    "HLS.AX",
+    "HVN.AX",
+    "IAG.AX",
+    "IEL.AX",
+    "IFL.AX",
+    "IFT.AX",
+    "IGO.AX",
+    "ILU.AX",
+    "IOO.AX",
+    "IOZ.AX",
+    "IPL.AX",
+    "IRE.AX",
+    "IVV.AX",
+    "JBH.AX",
+    "JHX.AX",
+    "LFG.AX",
+    "LFS.AX",
+    "LLC.AX",
+    "LNK.AX",
+    "LYC.AX",
+    "MEZ.AX",
+    "MFG.AX",
+    "MGF.AX",
+    "MGOC.AX",
+    "MGR.AX",
+    "MIN.AX",
+    "MP1.AX",
+    "MPL.AX",
+    "MQG.AX",
+    "MTS.AX",
+    "NAB.AX",
+    "NCM.AX",
+    "NEC.AX",
+    "NHF.AX",
+    "NIC.AX",
+    "NSR.AX",
+    "NST.AX",
+    "NUF.AX",
+    "NWL.AX",
+    "NXT.AX",
+    "ORA.AX",
+    "ORG.AX",
+    "ORI.AX",
+    "OZL.AX",
+    "PBH.AX",
+    "PLS.AX",
+    "PME.AX",
+    "PMGOLD.AX",
+    "PMV.AX",
+    "PNI.AX",
+    "PNV.AX",
+    "PPT.AX",
+    "PTM.AX",
+    "QAN.AX",
+    "QBE.AX",
+    "QUB.AX",
+    "REA.AX",
+    "REH.AX",
+    "RHC.AX",
+    "RIO.AX",
+    "RMD.AX",
+    "RRL.AX",
+    "RWC.AX",
+    "S32.AX",
+    "SCG.AX",
+    "SDF.AX",
+    "SEK.AX",
+    "SGM.AX",
+    "SGP.AX",
+    "SGR.AX",
+    "SHL.AX",
+    "SKC.AX",
+    "SNZ.AX",
+    "SOL.AX",
+    "SPK.AX",
+    "STO.AX",
+    "STW.AX",
+    "SUL.AX",
+    "SUN.AX",
+    "SVW.AX",
+    "TAH.AX",
+    "TCL.AX",
+    "TLS.AX",
+    "TNE.AX",
+    "TPG.AX",
+    "TWE.AX",
+    "TYR.AX",
+    "VAP.AX",
+    "VAS.AX",
+    "VCX.AX",
+    "VEA.AX",
+    "VEU.AX",
+    "VGS.AX",
+    "VTS.AX",
+    "VUK.AX",
+    "WAM.AX",
+    "WBC.AX",
+    "WEB.AX",
+    "WES.AX",
+    "WOR.AX",
+    "WOW.AX",
+    "WPR.AX",
+    "WTC.AX",
+    "XRO.AX",
+    "YAL.AX",
+    "ZIM.AX",
+]
+
+nyse = [
+    "ABNB",
+    "ADBE",
+    "ADI",
+    "ADP",
+    "ADSK",
+    "AEP",
+    "ALGN",
+    "AMAT",
+    "AMD",
+    "AMGN",
+    "ANSS",
+    "ASML",
+    "ATVI",
+    "AVGO",
+    "AZN",
+    "BIIB",
+    "BKNG",
+    "BKR",
+    "CDNS",
+    "CEG",
+    "CHTR",
+    "CMCSA",
+    "COST",
+    "CPRT",
+    "CRWD",
+    "CSCO",
+    "CSGP",
+    "CSX",
+    "CTAS",
+    "CTSH",
+    "DDOG",
+    "DLTR",
+    "DXCM",
+    "EA",
+    "EBAY",
+    "ENPH",
+    "EXC",
+    "FANG",
+    "FAST",
+    "FISV",
+    "FTNT",
+    "GFS",
+    "GILD",
+    "GOOG",
+    "GOOGL",
+    "HON",
+    "IDXX",
+    "ILMN",
+    "INTC",
+    "INTU",
+    "ISRG",
+    "JD",
+    "KDP",
+    "KHC",
+    "KLAC",
+    "LCID",
+    "LRCX",
+    "LULU",
+    "MAR",
+    "MCHP",
+    "MDLZ",
+    "MELI",
+    "META",
+    "MNST",
+    "MRNA",
+    "MRVL",
+    "MSFT",
+    "MU",
+    "NFLX",
+    "NVDA",
+    "NXPI",
+    "ODFL",
+    "ORLY",
+    "PANW",
+    "PAYX",
+    "PCAR",
+    "PDD",
+    "PEP",
+    "PYPL",
+    "QCOM",
+    "REGN",
+    "RIVN",
+    "ROST",
+    "SBUX",
+    "SGEN",
+    "SIRI",
+    "SNPS",
+    "TEAM",
+    "TMUS",
+    "TXN",
+    "VRSK",
+    "VRTX",
+    "WBA",
+    "WBD",
+    "WDAY",
+    "XEL",
+    "ZM",
+    "ZS",
+]
+
+crypto = [
+    "BTC-USD",
+    "AVAX-USD",
+    "ETH-USD",
+    "DOT-USD",
+    "MATIC-USD",
+    "AAVE-USD",
+    "CRV-USD",
+    "XRP-USD",
+    "MKR-USD",
+    "DOGE-USD",
+    "BNB-USD",
+    "ATOM-USD",
+    "SHIB-USD",
+    "ADA-USD",
+    "SOL-USD",
+    "LTC-USD",
+    "TRX-USD",
+    "DAI-USD",
+    "WBTC-USD",
+    "LINK-USD",
+    "LEO-USD",
+    "XMR-USD",
+    "ETC-USD",
+    "TON-USD",
+    "OKB-USD",
+]
+
+universes = {"asx": asx, "nyse": nyse, "crypto": crypto}
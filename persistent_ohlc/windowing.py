@@ -0,0 +1,80 @@
+import pandas as pd
+
+import sys
+
+if "unittest" in sys.modules.keys():
+    from . import exceptions
+else:
+    import exceptions
+
+
+def parse_timestamp(value, tz=None) -> pd.Timestamp:
+    # parse once into something directly comparable with a DatetimeIndex in tz
+    if value is None:
+        return None
+
+    try:
+        timestamp = pd.Timestamp(value)
+    except (ValueError, TypeError) as e:
+        raise exceptions.InvalidDate(f"Unable to parse {value} as a date") from e
+
+    if tz is None:
+        if timestamp.tz is not None:
+            timestamp = timestamp.tz_convert(None)
+    elif timestamp.tz is None:
+        timestamp = timestamp.tz_localize(tz)
+    else:
+        timestamp = timestamp.tz_convert(tz)
+
+    return timestamp
+
+
+def parse_window(index: pd.DatetimeIndex, start=None, end=None):
+    start = parse_timestamp(start, index.tz)
+    end = parse_timestamp(end, index.tz)
+    if start is not None and end is not None and end < start:
+        raise exceptions.EndBeforeStartError(f"End {end} is before start {start}")
+
+    return start, end
+
+
+def parse_columns(available: pd.Index, columns=None) -> list:
+    # positions of the requested columns in the order asked for, None for all of them
+    if not columns:
+        return None
+
+    columns = list(dict.fromkeys(columns))
+    positions = available.get_indexer(columns)
+    if (positions < 0).any():
+        missing = [c for c, p in zip(columns, positions) if p < 0]
+        raise exceptions.InvalidColumnError(f"Columns {missing} not found")
+
+    return positions.tolist()
+
+
+def window(
+    df: pd.DataFrame,
+    start: pd.Timestamp = None,
+    end: pd.Timestamp = None,
+    count: int = None,
+    columns: list = None,
+) -> pd.DataFrame:
+    # binary search the sorted index instead of building boolean masks, and apply count
+    # to the positions so the only thing materialised is a single iloc slice. columns
+    # are positions from parse_columns, so only those get copied
+    first = 0 if start is None else df.index.searchsorted(start, side="left")
+    last = len(df) if end is None else df.index.searchsorted(end, side="right")
+
+    if count:
+        # same semantics as slicing the frame with [-count:]
+        positions = range(first, last)[-count:]
+        first, last = positions.start, positions.stop
+
+    if columns is None:
+        return df.iloc[first:last]
+    return df.iloc[first:last, columns]
+
+
+def last_position(index: pd.DatetimeIndex, when: pd.Timestamp) -> int:
+    # position of the last bar at or before when, -1 if when is before the first bar
+    return index.searchsorted(when, side="right") - 1
@@ -1 +1,4 @@
 from .persistent_client import PersistentOhlcClient
+from .async_client import AsyncPersistentOhlcClient
+from .price_matrix import PriceMatrix
+from .tick_calendar import TickCalendar
@@ -0,0 +1,191 @@
+import logging
+from datetime import datetime
+import httpx
+from . import formats
+
+log = logging.getLogger(__name__)
+
+
+def _params(**kwargs) -> dict:
+    # httpx sends None as an empty value, the service wants it left out entirely
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+
+# asyncio flavour of PersistentOhlcClient for fan out workloads, eg.
+#   async with AsyncPersistentOhlcClient() as c:
+#       frames = await asyncio.gather(*[c.get_ohlc(s, "1d") for s in symbols])
+class AsyncPersistentOhlcClient:
+    http_endpoint: str
+    clock = None
+
+    def __init__(
+        self,
+        http_endpoint: str = "http://127.0.0.1:8002",
+        clock=None,
+        default_interval="5m",
+        response_format: str = formats.ARROW,
+        pool_size: int = 100,
+        retries: int = 3,
+        timeout: float = 60,
+    ):
+        if response_format not in formats.media_types:
+            raise ValueError(
+                f"Format {response_format} is not supported, use one of {list(formats.media_types)}"
+            )
+
+        self.http_endpoint = http_endpoint
+        self.clock = clock
+        self.default_interval = default_interval
+        self.response_format = response_format
+        # httpx only retries failed connections, not error responses
+        self._client = httpx.AsyncClient(
+            base_url=http_endpoint,
+            headers={"Accept": formats.media_types[response_format]},
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=retries),
+            timeout=timeout,
+        )
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def get_ohlc(
+        self,
+        symbol: str,
+        interval: str = None,
+        start: datetime = None,
+        end: datetime = None,
+        count: int = None,
+        ta: list = None,
+        columns: list = None,
+    ):
+        if not interval:
+            interval = self.default_interval
+
+        if ta and type(ta) != list:
+            ta = [ta]
+
+        raw_response = await self._client.get(
+            f"/symbols/{symbol}/ohlc/{interval}",
+            params=_params(start=start, end=end, count=count, ta=ta, columns=columns),
+        )
+        raw_response.raise_for_status()
+
+        in_df = formats.decode(
+            raw_response.content, raw_response.headers.get("content-type")
+        )
+
+        if self.clock:
+            in_df = in_df.loc[in_df.index <= self.clock.now]
+
+        return in_df
+
+    async def get_ohlc_many(
+        self,
+        symbols: list,
+        interval: str = None,
+        start: datetime = None,
+        end: datetime = None,
+        count: int = None,
+        ta: list = None,
+        layout: str = "columns",
+        columns: list = None,
+    ):
+        if layout not in formats.batch_layouts:
+            raise ValueError(f"Layout {layout} is not one of {formats.batch_layouts}")
+
+        if not interval:
+            interval = self.default_interval
+
+        if ta and type(ta) != list:
+            ta = [ta]
+
+        raw_response = await self._client.get(
+            f"/symbols/ohlc/{interval}",
+            params=_params(
+                symbols=list(symbols),
+                start=start,
+                end=end,
+                count=count,
+                ta=ta,
+                columns=columns,
+            ),
+        )
+        raw_response.raise_for_status()
+
+        not_found = raw_response.headers.get("X-Symbols-Not-Found")
+        if not_found:
+            log.warning(f"Symbols not found: {not_found}")
+
+        long_df = formats.decode(
+            raw_response.content, raw_response.headers.get("content-type")
+        )
+        now = self.clock.now if self.clock else None
+        return formats.unpack_batch(long_df, layout, now)
+
+    async def get_sctr(
+        self,
+        universe: str,
+        interval: str = None,
+        days: int = 250,
+        layout: str = "columns",
+    ):
+        if layout not in formats.batch_layouts:
+            raise ValueError(f"Layout {layout} is not one of {formats.batch_layouts}")
+
+        if not interval:
+            interval = self.default_interval
+
+        raw_response = await self._client.get(
+            f"/universes/{universe}/sctr/{interval}", params=_params(days=days)
+        )
+        raw_response.raise_for_status()
+
+        not_found = raw_response.headers.get("X-Symbols-Not-Found")
+        if not_found:
+            log.warning(f"Symbols not found: {not_found}")
+
+        long_df = formats.decode(
+            raw_response.content, raw_response.headers.get("content-type")
+        )
+        now = self.clock.now if self.clock else None
+        unpacked = formats.unpack_batch(long_df, layout, now)
+        if layout == "columns":
+            unpacked = unpacked.sort_index(axis=1)
+        return unpacked
+
+    async def get_bounds(self, symbols: list, interval: str = None) -> dict:
+        if not interval:
+            interval = self.default_interval
+
+        raw_response = await self._client.get(
+            f"/symbols/bounds/{interval}", params=_params(symbols=list(symbols))
+        )
+        raw_response.raise_for_status()
+
+        not_found = raw_response.headers.get("X-Symbols-Not-Found")
+        if not_found:
+            log.warning(f"Symbols not found: {not_found}")
+
+        return formats.parse_bounds(raw_response.json())
+
+    async def get_tick(self, symbol: str, interval: str = None, when: str = None):
+        if not interval:
+            interval = self.default_interval
+
+        if when and self.clock:
+            if datetime.fromisoformat(when) > self.clock.now:
+                when = str(self.clock.now)
+
+        raw_response = await self._client.get(
+            f"/symbols/{symbol}/info/{interval}/next_tick", params=_params(when=when)
+        )
+        return raw_response.json()
@@ -0,0 +1,77 @@
+from io import StringIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from persistent_ohlc import numpy_format
+
+from .price_matrix import PriceMatrix
+
+JSON = "json"
+ARROW = "arrow"
+PARQUET = "parquet"
+NUMPY = "numpy"
+
+media_types = {
+    JSON: "application/json",
+    ARROW: "application/vnd.apache.arrow.stream",
+    PARQUET: "application/vnd.apache.parquet",
+    NUMPY: "application/x-ohlc-numpy",
+}
+formats_by_media_type = {v: k for k, v in media_types.items()}
+
+batch_layouts = ["columns", "map", "matrix"]
+
+
+def decode(content: bytes, content_type: str) -> pd.DataFrame:
+    # decode based on what the server actually sent, not what we asked for
+    media_type = content_type.split(";")[0].strip() if content_type else None
+    fmt = formats_by_media_type.get(media_type, JSON)
+
+    if fmt == ARROW:
+        table = pa.ipc.open_stream(pa.py_buffer(content)).read_all()
+        return table.to_pandas(split_blocks=True)
+    if fmt == PARQUET:
+        table = pq.read_table(pa.BufferReader(content))
+        return table.to_pandas(split_blocks=True)
+    if fmt == NUMPY:
+        return numpy_format.decode(content)
+
+    return pd.read_json(StringIO(content.decode()))
+
+
+def parse_bounds(raw: dict) -> dict:
+    # the bounds endpoint sends timestamps as ISO strings
+    return {
+        symbol: {
+            "first": pd.Timestamp(bounds["first"]) if bounds["first"] else None,
+            "last": pd.Timestamp(bounds["last"]) if bounds["last"] else None,
+            "bars": bounds["bars"],
+        }
+        for symbol, bounds in raw.items()
+    }
+
+
+def unpack_batch(long_df: pd.DataFrame, layout: str, now=None):
+    # batch responses are one row per (symbol, timestamp), turn that back into either
+    # a (symbol, field) MultiIndex column frame, a dict of symbol -> frame or a
+    # PriceMatrix
+    if layout == "matrix":
+        if now is not None:
+            long_df = long_df.loc[long_df["timestamp"] <= now]
+        return PriceMatrix.from_long(long_df)
+
+    long_df = long_df.set_index("timestamp")
+
+    frames = dict()
+    for symbol, in_df in long_df.groupby("symbol", observed=True, sort=False):
+        in_df = in_df.drop(columns="symbol")
+        if now is not None:
+            in_df = in_df.loc[in_df.index <= now]
+        frames[symbol] = in_df
+
+    if layout == "map":
+        return frames
+
+    return pd.concat(frames, axis=1, names=["symbol", "field"])
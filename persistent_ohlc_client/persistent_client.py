@@ -1,4 +1,7 @@
+import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import quote_plus
 import pandas as pd
 from datetime import datetime
@@ -6,15 +9,54 @@ from string import Template
 import pandas as pd
 import json
 from dateutil.relativedelta import relativedelta
+from . import formats
+from .tick_calendar import TickCalendar
+
+log = logging.getLogger(__name__)
+
+interval_seconds = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600, "1d": 86400}
+
+
+def _as_timestamp(value, tz):
+    if value is None:
+        return None
+
+    timestamp = pd.Timestamp(value)
+    if tz is None:
+        return timestamp.tz_convert(None) if timestamp.tz else timestamp
+    return timestamp.tz_localize(tz) if timestamp.tz is None else timestamp
+
+
+def window_frame(df, start=None, end=None, count=None, now=None):
+    # same windowing the service does, via binary search so the result is a view
+    start = _as_timestamp(start, df.index.tz)
+    end = _as_timestamp(end, df.index.tz)
+    now = _as_timestamp(now, df.index.tz)
+    if now is not None and (end is None or now < end):
+        end = now
+
+    first = 0 if start is None else df.index.searchsorted(start, side="left")
+    last = len(df) if end is None else df.index.searchsorted(end, side="right")
+    if count:
+        positions = range(first, last)[-count:]
+        first, last = positions.start, positions.stop
+
+    return df.iloc[first:last]
 
 
 class BacktestClock:
     _now: datetime
     interval: int
     start: datetime
+    calendar: TickCalendar = None
 
-    def __init__(self, now: datetime, interval: int = 300):
+    def __init__(
+        self, now: datetime, interval: int = 300, calendar: TickCalendar = None
+    ):
+        # with a calendar, tick() moves to the next timestamp that has bars instead of
+        # adding interval seconds
         self.interval = interval
+        self.calendar = calendar
         self.now = now
         self.start = now
 
@@ -22,8 +64,15 @@ class BacktestClock:
         self.now = self.start
 
     def tick(self):
-        delta = relativedelta(seconds=self.interval)
-        self.now = self.now + delta
+        if self.calendar is None:
+            delta = relativedelta(seconds=self.interval)
+            self.now = self.now + delta
+            return
+
+        if self._position + 1 >= len(self.calendar):
+            raise KeyError(f"Backtesting - already at the last tick {self.now}")
+        self._position += 1
+        self._now = self.calendar[self._position]
 
     @property
     def now(self):
@@ -32,12 +81,17 @@ class BacktestClock:
     @now.setter
     def now(self, new_now):
         self._now = new_now
+        if self.calendar is not None:
+            self._position = self.calendar.position(new_now)
 
 
 class PersistentOhlcClient:
     http_endpoint: str
     ohlc_path: str = "/symbols/${symbol}/ohlc/${interval}?${start}&${end}"
     symbol_tick: str = "/symbols/${symbol}/info/${interval}/next_tick?${when}"
+    ohlc_batch_path: str = "/symbols/ohlc/${interval}"
+    sctr_path: str = "/universes/${universe}/sctr/${interval}"
+    bounds_path: str = "/symbols/bounds/${interval}"
     clock = None
 
     def __init__(
@@ -45,12 +99,59 @@ class PersistentOhlcClient:
         http_endpoint: str = "http://127.0.0.1:8002",
         clock=None,
         default_interval="5m",
+        response_format: str = formats.ARROW,
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.2,
+        timeout: float = 60,
+        cache: bool = False,
     ):
+        if response_format not in formats.media_types:
+            raise ValueError(
+                f"Format {response_format} is not supported, use one of {list(formats.media_types)}"
+            )
+
         self.http_endpoint = http_endpoint
         self.template_ohlc_path = Template(self.ohlc_path)
         self.template_symbol_tick = Template(self.symbol_tick)
+        self.template_ohlc_batch_path = Template(self.ohlc_batch_path)
+        self.template_sctr_path = Template(self.sctr_path)
+        self.template_bounds_path = Template(self.bounds_path)
         self.clock = clock
         self.default_interval = default_interval
+        self.response_format = response_format
+        # local series kept up to date by poll_ohlc
+        self._frames = dict()
+        self._etags = dict()
+        # with cache and a clock, get_ohlc serves slices of the local series
+        self.cache = cache
+        self._refreshed_at = dict()
+
+        # one pooled keep-alive session for every request this client makes
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=["GET"],
+                raise_on_status=False,
+            ),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def get_ohlc(
         self,
@@ -60,6 +161,132 @@ class PersistentOhlcClient:
         end: datetime = None,
         count: int = None,
         ta: list = None,
+        columns: list = None,
+    ):
+        # columns limits the response to just those, eg. ["Close"], TA columns
+        # included. Default is everything
+        if self.cache and self.clock:
+            return self._get_cached_ohlc(
+                symbol, interval, start, end, count, ta, columns
+            )
+
+        raw_response = self._fetch_ohlc(
+            symbol, interval, start, end, count, ta, columns=columns
+        )
+        in_df = formats.decode(
+            raw_response.content, raw_response.headers.get("content-type")
+        )
+
+        if self.clock:
+            in_df = in_df.loc[in_df.index <= self.clock.now]
+
+        return in_df
+
+    def _get_cached_ohlc(self, symbol, interval, start, end, count, ta, columns=None):
+        # backtests ask for the same series every tick with the clock a little further
+        # along, so fetch each series once and slice it up to clock.now locally
+        if not interval:
+            interval = self.default_interval
+
+        if ta and type(ta) != list:
+            ta = [ta]
+
+        key = (
+            symbol,
+            interval,
+            tuple(sorted(set(ta))) if ta else (),
+            tuple(columns) if columns else (),
+        )
+        local_df = self._frames.get(key)
+        now = self.clock.now
+
+        if local_df is None:
+            self.poll_ohlc(symbol, interval, ta, columns)
+            self._refreshed_at[key] = now
+
+        elif len(local_df) == 0 or now > local_df.index[-1]:
+            # the clock has moved past what we hold, but only ask the server about it
+            # once per bar's worth of clock time
+            bar = pd.Timedelta(seconds=interval_seconds.get(interval, 0))
+            if now - self._refreshed_at[key] >= bar:
+                self.poll_ohlc(symbol, interval, ta, columns)
+                self._refreshed_at[key] = now
+
+        return window_frame(self._frames[key], start, end, count, now)
+
+    def poll_ohlc(
+        self, symbol: str, interval: str = None, ta: list = None, columns: list = None
+    ):
+        # keeps a local copy of the series and only transfers what changed since the
+        # last poll - nothing at all if the server says our ETag is still current
+        if not interval:
+            interval = self.default_interval
+
+        if ta and type(ta) != list:
+            ta = [ta]
+
+        key = (
+            symbol,
+            interval,
+            tuple(sorted(set(ta))) if ta else (),
+            tuple(columns) if columns else (),
+        )
+        local_df = self._frames.get(key)
+
+        if local_df is None or len(local_df) == 0:
+            raw_response = self._fetch_ohlc(symbol, interval, ta=ta, columns=columns)
+            local_df = formats.decode(
+                raw_response.content, raw_response.headers.get("content-type")
+            )
+
+        else:
+            # since is inclusive, so the last bar we hold gets refreshed too in case
+            # it was still forming when we fetched it
+            raw_response = self._fetch_ohlc(
+                symbol,
+                interval,
+                ta=ta,
+                columns=columns,
+                since=str(local_df.index[-1]),
+                etag=self._etags.get(key),
+            )
+
+            if raw_response.status_code != 304:
+                delta_df = formats.decode(
+                    raw_response.content, raw_response.headers.get("content-type")
+                )
+
+                if list(delta_df.columns) != list(local_df.columns):
+                    # someone added TA columns on the server, start again
+                    raw_response = self._fetch_ohlc(
+                        symbol, interval, ta=ta, columns=columns
+                    )
+                    local_df = formats.decode(
+                        raw_response.content, raw_response.headers.get("content-type")
+                    )
+                elif len(delta_df):
+                    keep = local_df.index.searchsorted(delta_df.index[0])
+                    local_df = pd.concat([local_df.iloc[:keep], delta_df])
+
+        self._frames[key] = local_df
+        self._etags[key] = raw_response.headers.get("ETag")
+
+        if self.clock:
+            return local_df.loc[local_df.index <= self.clock.now]
+
+        return local_df
+
+    def _fetch_ohlc(
+        self,
+        symbol: str,
+        interval: str = None,
+        start: datetime = None,
+        end: datetime = None,
+        count: int = None,
+        ta: list = None,
+        since: str = None,
+        etag: str = None,
+        columns: list = None,
     ):
         if not interval:
             interval = self.default_interval
@@ -80,21 +307,135 @@ class PersistentOhlcClient:
             for algo in ta:
                 algos += f"&ta={algo}"
 
+        projection = "".join(f"&columns={quote_plus(c)}" for c in columns or [])
         count = f"&count={count}" if count is not None else ""
+        since = f"&since={quote_plus(since)}" if since is not None else ""
+
+        headers = {"Accept": formats.media_types[self.response_format]}
+        if etag:
+            headers["If-None-Match"] = etag
 
-        url = f"{self.http_endpoint}{actual_path}{algos}{count}"
+        url = f"{self.http_endpoint}{actual_path}{algos}{projection}{count}{since}"
         try:
-            raw_response = requests.get(url)
+            raw_response = self._session.get(url, headers=headers, timeout=self.timeout)
             raw_response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             raise
 
-        in_df = pd.read_json(raw_response.text)
+        return raw_response
 
-        if self.clock:
-            in_df = in_df.loc[in_df.index <= self.clock.now]
+    def get_ohlc_many(
+        self,
+        symbols: list,
+        interval: str = None,
+        start: datetime = None,
+        end: datetime = None,
+        count: int = None,
+        ta: list = None,
+        layout: str = "columns",
+        columns: list = None,
+    ):
+        # layout "columns" returns one frame with (symbol, field) MultiIndex columns,
+        # layout "map" returns a dict of symbol -> frame and layout "matrix" returns a
+        # PriceMatrix. columns limits the fields to just those
+        if layout not in formats.batch_layouts:
+            raise ValueError(f"Layout {layout} is not one of {formats.batch_layouts}")
 
-        return in_df
+        if not interval:
+            interval = self.default_interval
+
+        if ta and type(ta) != list:
+            ta = [ta]
+
+        params = {
+            "symbols": list(symbols),
+            "start": start,
+            "end": end,
+            "count": count,
+            "ta": ta,
+            "columns": columns,
+        }
+        actual_path = self.template_ohlc_batch_path.substitute(interval=interval)
+        url = f"{self.http_endpoint}{actual_path}"
+
+        raw_response = self._session.get(
+            url,
+            params=params,
+            headers={"Accept": formats.media_types[self.response_format]},
+            timeout=self.timeout,
+        )
+        raw_response.raise_for_status()
+
+        not_found = raw_response.headers.get("X-Symbols-Not-Found")
+        if not_found:
+            log.warning(f"Symbols not found: {not_found}")
+
+        long_df = formats.decode(
+            raw_response.content, raw_response.headers.get("content-type")
+        )
+        now = self.clock.now if self.clock else None
+        return formats.unpack_batch(long_df, layout, now)
+
+    def get_sctr(
+        self,
+        universe: str,
+        interval: str = None,
+        days: int = 250,
+        layout: str = "columns",
+    ):
+        # SCTR panel for a named universe, by default with (symbol, field) MultiIndex
+        # columns where field is one of sctr, close, rank, velocity,
+        # one_day_increase, two_day_increase and consecutive_increase. Same layouts
+        # as get_ohlc_many
+        if layout not in formats.batch_layouts:
+            raise ValueError(f"Layout {layout} is not one of {formats.batch_layouts}")
+
+        if not interval:
+            interval = self.default_interval
+
+        actual_path = self.template_sctr_path.substitute(
+            universe=universe, interval=interval
+        )
+        raw_response = self._session.get(
+            f"{self.http_endpoint}{actual_path}",
+            params={"days": days},
+            headers={"Accept": formats.media_types[self.response_format]},
+            timeout=self.timeout,
+        )
+        raw_response.raise_for_status()
+
+        not_found = raw_response.headers.get("X-Symbols-Not-Found")
+        if not_found:
+            log.warning(f"Symbols not found: {not_found}")
+
+        long_df = formats.decode(
+            raw_response.content, raw_response.headers.get("content-type")
+        )
+        now = self.clock.now if self.clock else None
+        unpacked = formats.unpack_batch(long_df, layout, now)
+        if layout == "columns":
+            unpacked = unpacked.sort_index(axis=1)
+        return unpacked
+
+    def get_bounds(self, symbols: list, interval: str = None) -> dict:
+        # symbol -> {"first": Timestamp, "last": Timestamp, "bars": int} for every
+        # symbol in one request. Symbols the service doesn't know are left out
+        if not interval:
+            interval = self.default_interval
+
+        actual_path = self.template_bounds_path.substitute(interval=interval)
+        raw_response = self._session.get(
+            f"{self.http_endpoint}{actual_path}",
+            params={"symbols": list(symbols)},
+            timeout=self.timeout,
+        )
+        raw_response.raise_for_status()
+
+        not_found = raw_response.headers.get("X-Symbols-Not-Found")
+        if not_found:
+            log.warning(f"Symbols not found: {not_found}")
+
+        return formats.parse_bounds(raw_response.json())
 
     def get_tick(self, symbol: str, interval: str = None, when: datetime = None):
         if not interval:
@@ -114,7 +455,7 @@ class PersistentOhlcClient:
             symbol=symbol, interval=interval, when=when
         )
         url = f"{self.http_endpoint}{actual_path}"
-        raw_response = requests.get(url)
+        raw_response = self._session.get(url, timeout=self.timeout)
         json_response = json.loads(raw_response.text)
         return json_response
 
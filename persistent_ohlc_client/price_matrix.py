@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+fill_policies = [None, "ffill"]
+
+
+# (time x symbol x field) float64 prices for many symbols on one shared index. Built
+# once, then looked up by integer position so a backtest loop doesn't resolve pandas
+# labels on every tick. Booleans come through as 0.0/1.0. NaN means the symbol had no
+# bar at that time, unless fill="ffill" in which case it carries its last bar forward
+# (it's still NaN before the symbol's first bar)
+class PriceMatrix:
+    def __init__(
+        self,
+        index: pd.DatetimeIndex,
+        symbols: list,
+        fields: list,
+        values: np.ndarray,
+        fill: str = None,
+    ):
+        if fill not in fill_policies:
+            raise ValueError(f"Fill {fill} is not one of {fill_policies}")
+
+        self.index = index
+        self.symbols = {symbol: column for column, symbol in enumerate(symbols)}
+        self.fields = {field: position for position, field in enumerate(fields)}
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.fill = fill
+        if fill == "ffill":
+            self.values = _ffill(self.values)
+
+    @classmethod
+    def from_long(cls, long_df: pd.DataFrame, fields: list = None, fill: str = None):
+        # long_df is a batch response, ie. one row per (timestamp, symbol)
+        if fields is None:
+            fields = [c for c in long_df.columns if c not in ("timestamp", "symbol")]
+
+        times = pd.DatetimeIndex(long_df["timestamp"])
+        index = times.unique().sort_values()
+        codes, symbols = pd.factorize(long_df["symbol"])
+
+        values = np.full((len(index), len(symbols), len(fields)), np.nan)
+        values[index.get_indexer(times), codes] = long_df[fields].to_numpy(
+            dtype=np.float64
+        )
+        return cls(index, list(symbols), fields, values, fill)
+
+    @classmethod
+    def from_frames(cls, frames: dict, fields: list = None, fill: str = None):
+        # frames is symbol -> ohlc frame
+        if fields is None:
+            fields = list(next(iter(frames.values())).columns) if frames else []
+
+        times = _same_tz([frame.index for frame in frames.values()])
+        index = _union(times)
+
+        values = np.full((len(index), len(frames), len(fields)), np.nan)
+        for column, frame in enumerate(frames.values()):
+            values[index.get_indexer(times[column]), column] = frame[fields].to_numpy(
+                dtype=np.float64
+            )
+        return cls(index, list(frames), fields, values, fill)
+
+    def select(self, fields: list):
+        # same prices, only these fields
+        if list(fields) == list(self.fields):
+            return self
+
+        positions = [self.fields[f] for f in fields]
+        return PriceMatrix(
+            self.index,
+            list(self.symbols),
+            fields,
+            self.values[:, :, positions],
+            self.fill,
+        )
+
+    def join(self, other):
+        # union of both, with other's prices winning for symbols in both. Symbols
+        # keep their columns, so positions looked up earlier stay valid
+        missing = [f for f in self.fields if f not in other.fields]
+        if missing:
+            raise KeyError(f"Fields {missing} are not in the other matrix")
+
+        this_index, other_index = _same_tz([self.index, other.index])
+        index = _union([this_index, other_index])
+        symbols = dict(self.symbols)
+        for symbol in other.symbols:
+            symbols.setdefault(symbol, len(symbols))
+
+        values = np.full((len(index), len(symbols), len(self.fields)), np.nan)
+        rows = index.get_indexer(this_index)
+        values[rows[:, None], np.arange(len(self.symbols))] = self.values
+
+        rows = index.get_indexer(other_index)
+        columns = np.array([symbols[s] for s in other.symbols], dtype=np.intp)
+        fields = np.array([other.fields[f] for f in self.fields], dtype=np.intp)
+        values[rows[:, None], columns] = other.values[:, :, fields]
+        return PriceMatrix(index, list(symbols), list(self.fields), values, self.fill)
+
+    def row(self, when) -> int:
+        # row of the last bar at or before when, -1 if when is before the first one
+        return int(self.index.searchsorted(when, side="right")) - 1
+
+    def exact_row(self, when) -> int:
+        # row for exactly when, -1 if there's no bar then
+        row = int(self.index.searchsorted(when))
+        if row == len(self.index) or self.index[row] != when:
+            return -1
+        return row
+
+    def get(self, row: int, symbol: str, field: str) -> float:
+        return self.values[row, self.symbols[symbol], self.fields[field]]
+
+    def cross_section(self, row: int, field: str) -> np.ndarray:
+        # field for every symbol at row, in column order
+        return self.values[row, :, self.fields[field]]
+
+    def frame(self, field: str) -> pd.DataFrame:
+        # (time x symbol) frame of one field
+        return pd.DataFrame(
+            self.values[:, :, self.fields[field]],
+            index=self.index,
+            columns=list(self.symbols),
+        )
+
+    def __contains__(self, symbol) -> bool:
+        return symbol in self.symbols
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    # forward fill down the time axis, independently per symbol and field
+    source = np.where(
+        np.isnan(values), 0, np.arange(len(values))[:, None, None]
+    ).astype(np.intp)
+    np.maximum.accumulate(source, axis=0, out=source)
+    return np.take_along_axis(values, source, axis=0)
+
+
+def _same_tz(indexes: list) -> list:
+    # UTC if they're not all in the same timezone
+    if len({str(index.tz) for index in indexes}) > 1:
+        return [index.tz_convert("UTC") for index in indexes]
+    return indexes
+
+
+def _union(indexes: list) -> pd.DatetimeIndex:
+    if not indexes:
+        return pd.DatetimeIndex([])
+    return indexes[0].append(indexes[1:]).unique().sort_values()
@@ -0,0 +1,103 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pandas_market_calendars as mcal
+except ImportError:
+    mcal = None
+
+log = logging.getLogger(__name__)
+
+calendar_modes = ["union", "intersection"]
+
+
+# every timestamp a backtest should stop at, worked out up front from the bars the
+# universe actually has. Ticking is then a step along the array, so a clock never lands
+# on a weekend, holiday or anything else with no bars
+class TickCalendar:
+    def __init__(self, index: pd.DatetimeIndex):
+        self.index = index.unique().sort_values()
+        # numpy datetime64 in UTC
+        self.ticks = self.index.values
+
+    @classmethod
+    def from_indexes(cls, indexes: list, how: str = "union"):
+        # one DatetimeIndex per symbol. "union" stops wherever any symbol has a bar,
+        # "intersection" only where they all do
+        if how not in calendar_modes:
+            raise ValueError(f"Mode {how} is not one of {calendar_modes}")
+        if not indexes:
+            return cls(pd.DatetimeIndex([]))
+
+        if len({str(index.tz) for index in indexes}) > 1:
+            indexes = [index.tz_convert("UTC") for index in indexes]
+
+        if how == "union":
+            return cls(indexes[0].append(indexes[1:]))
+
+        index = indexes[0]
+        for other in indexes[1:]:
+            index = index.intersection(other)
+        return cls(index)
+
+    @classmethod
+    def from_matrix(cls, prices, how: str = "union"):
+        # from a PriceMatrix, where a symbol has a bar wherever its first field isn't
+        # NaN
+        if how not in calendar_modes:
+            raise ValueError(f"Mode {how} is not one of {calendar_modes}")
+
+        has_bar = ~np.isnan(prices.values[:, :, 0])
+        keep = has_bar.any(axis=1) if how == "union" else has_bar.all(axis=1)
+        return cls(prices.index[keep])
+
+    def cross_check(self, exchange: str, interval: int = 86400):
+        # drop ticks outside the exchange's sessions according to
+        # pandas_market_calendars, eg. stray bars on public holidays. Sessions with no
+        # tick at all get logged, since that usually means missing data
+        if mcal is None:
+            raise ImportError(
+                "pandas_market_calendars is needed to cross check a calendar"
+            )
+        if len(self.index) == 0:
+            return self
+
+        calendar = mcal.get_calendar(exchange)
+        index = self.index if self.index.tz else self.index.tz_localize("UTC")
+        local = index.tz_convert(calendar.tz)
+        schedule = calendar.schedule(
+            start_date=local[0].date(), end_date=local[-1].date()
+        )
+
+        sessions = schedule.index.get_indexer(local.normalize().tz_localize(None))
+        keep = sessions >= 0
+        if interval < 86400:
+            # intraday bars have to be inside the session too
+            opens = schedule["market_open"].dt.tz_convert(None).to_numpy()[sessions]
+            closes = schedule["market_close"].dt.tz_convert(None).to_numpy()[sessions]
+            utc = index.tz_convert("UTC").tz_localize(None).to_numpy()
+            keep &= (utc >= opens) & (utc < closes)
+
+        dropped = len(keep) - keep.sum()
+        if dropped:
+            log.warning(f"Dropped {dropped} ticks outside {exchange} sessions")
+        missing = len(schedule) - len(np.unique(sessions[keep]))
+        if missing:
+            log.warning(f"{missing} {exchange} sessions have no bars")
+
+        return TickCalendar(self.index[keep])
+
+    def position(self, when) -> int:
+        # last tick at or before when, -1 if when is before the first tick
+        when = pd.Timestamp(when)
+        if when.tz is None and self.index.tz is not None:
+            when = when.tz_localize(self.index.tz)
+        return int(self.index.searchsorted(when, side="right")) - 1
+
+    def __getitem__(self, position: int) -> pd.Timestamp:
+        return self.index[position]
+
+    def __len__(self) -> int:
+        return len(self.ticks)
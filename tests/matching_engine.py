@@ -0,0 +1,115 @@
+import time
+import numpy as np
+import pandas as pd
+from persistent_ohlc_client import PriceMatrix
+
+BUY = 1
+SELL = -1
+
+
+# columnar order matching for BackTestAPI. Open orders live in parallel numpy arrays
+# and prices in a PriceMatrix of the buy and sell metrics, so working out which orders
+# trigger on a tick is one vectorised pass instead of a python loop doing pandas
+# lookups per order. Balance and holding checks depend on the order fills are applied
+# in, so those stay with the caller
+class MatchingEngine:
+    def __init__(self, buy_metric: str, sell_metric: str, capacity: int = 64):
+        self.buy_metric = buy_metric
+        self.sell_metric = sell_metric
+
+        self.prices = None
+
+        self._order_ids = []
+        self._positions = dict()
+        self._symbol_idx = np.empty(capacity, dtype=np.int32)
+        self._side = np.empty(capacity, dtype=np.int8)
+        self._limit = np.empty(capacity, dtype=np.float64)
+        self._active = np.zeros(capacity, dtype=bool)
+
+        self.ticks = 0
+        self.match_seconds = 0.0
+
+    @property
+    def symbols(self) -> dict:
+        return self.prices.symbols if self.prices is not None else dict()
+
+    def load_prices(self, prices) -> None:
+        # prices is a PriceMatrix or a dict of symbol -> ohlc frame. Symbols already
+        # loaded keep their prices unless they're passed again
+        metrics = list(dict.fromkeys([self.buy_metric, self.sell_metric]))
+        if isinstance(prices, PriceMatrix):
+            prices = prices.select(metrics)
+        else:
+            prices = PriceMatrix.from_frames(prices, metrics)
+
+        self.prices = prices if self.prices is None else self.prices.join(prices)
+        self._buy = self.prices.fields[self.buy_metric]
+        self._sell = self.prices.fields[self.sell_metric]
+
+    def add_order(self, order_id: str, symbol: str, side: int, limit_price=None):
+        if symbol not in self.symbols:
+            raise KeyError(f"No prices loaded for {symbol}")
+
+        position = len(self._order_ids)
+        if position == len(self._active):
+            self._grow()
+
+        self._order_ids.append(order_id)
+        self._positions[order_id] = position
+        self._symbol_idx[position] = self.symbols[symbol]
+        self._side[position] = side
+        self._limit[position] = np.nan if limit_price is None else limit_price
+        self._active[position] = True
+
+    def remove_order(self, order_id: str) -> None:
+        position = self._positions.get(order_id)
+        if position is not None:
+            self._active[position] = False
+
+    def match(self, period: pd.Timestamp) -> list:
+        # returns [(order_id, price)] for every open order that triggers at period, in
+        # the order they were placed. price is the buy or sell metric at period
+        started = time.perf_counter()
+        self.ticks += 1
+
+        row = -1 if self.prices is None else self.prices.exact_row(period)
+        if row == -1:
+            self.match_seconds += time.perf_counter() - started
+            return []
+
+        open_orders = np.flatnonzero(self._active[: len(self._order_ids)])
+        symbols = self._symbol_idx[open_orders]
+        is_buy = self._side[open_orders] == BUY
+        limit = self._limit[open_orders]
+
+        prices = self.prices.values[row]
+        price = np.where(
+            is_buy, prices[symbols, self._buy], prices[symbols, self._sell]
+        )
+        # limit buys trigger when the buy metric drops below the limit, limit sells
+        # when the sell metric goes above it. NaN comparisons are always False
+        with np.errstate(invalid="ignore"):
+            limit_hit = np.where(is_buy, price < limit, price > limit)
+        triggered = ~np.isnan(price) & (np.isnan(limit) | limit_hit)
+
+        fills = [
+            (self._order_ids[position], float(fill_price))
+            for position, fill_price in zip(open_orders[triggered], price[triggered])
+        ]
+        self.match_seconds += time.perf_counter() - started
+        return fills
+
+    @property
+    def ticks_per_second(self) -> float:
+        if self.match_seconds == 0:
+            return 0.0
+        return self.ticks / self.match_seconds
+
+    def _grow(self) -> None:
+        capacity = len(self._active) * 2
+        self._symbol_idx = np.resize(self._symbol_idx, capacity)
+        self._side = np.resize(self._side, capacity)
+        self._limit = np.resize(self._limit, capacity)
+        active = np.zeros(capacity, dtype=bool)
+        active[: len(self._active)] = self._active
+        self._active = active
@@ -2,8 +2,8 @@ from pandas import Timestamp
 import logging
 import uuid
 from persistent_ohlc_client import PersistentOhlcClient
-
-client = PersistentOhlcClient()
+from matching_engine import MatchingEngine, BUY, SELL
+from order_book import OrderBook, PositionLedger
 
 
 class Account:
@@ -174,9 +174,8 @@ class BackTestAPI:
 
         self.default_currency = "USD"
 
-        self._assets_held = {}
-        self._orders = {}
-        self._inactive_orders = []
+        self._positions = PositionLedger()
+        self._order_book = OrderBook()
         self._symbols = {}
 
         if symbol_objects:
@@ -187,6 +186,12 @@ class BackTestAPI:
         self.buy_metric = buy_metric
 
         self._time_manager = time_manager
+        # prices for every symbol we trade are loaded once into the matching engine
+        self._client = PersistentOhlcClient()
+        self._engine = MatchingEngine(buy_metric=buy_metric, sell_metric=sell_metric)
+        # matching only needs to run again once time moves or a new order comes in
+        self._matched_period = None
+        self._orders_changed = False
 
     @property
     def period(self):
@@ -233,24 +238,17 @@ class BackTestAPI:
         return account
 
     def get_position(self, symbol):
-        for position in self.list_positions():
-            if position.symbol == symbol:
-                return position
-        return Position(symbol=symbol, quantity=0)
+        self._update_order_status()
+        quantity, paid = self._positions.held(symbol)
+        return Position(symbol=symbol, quantity=quantity)
 
     def list_positions(self):
         # {symbol: , quantity}
         self._update_order_status()
-        positions = []
-
-        for symbol in self._assets_held:
-            quantity = 0
-            for order in self._assets_held[symbol]:
-                quantity += order["units"]
-
-            positions.append(Position(symbol=symbol, quantity=quantity))
-
-        return positions
+        return [
+            Position(symbol=symbol, quantity=quantity)
+            for symbol, quantity in self._positions.positions().items()
+        ]
 
     def get_last_close(self, symbol: str):
         raise NotImplementedError
@@ -380,81 +378,84 @@ class BackTestAPI:
                 f"Parameter 'after' is not implemented in back_test_wrapper"
             )
 
-        return_orders = []
-        for ordered_symbol in self._orders:
-            return_orders.append(self._orders[ordered_symbol])
+        if symbol:
+            symbols = [symbol]
 
-        for order in self._inactive_orders:
-            return_orders.append(order)
-
-        if symbol or symbols:
-            if symbol:
-                symbols = [symbol]
-
-            new_return_orders = []
-            for order in return_orders:
-                if order.symbol in symbols:
-                    new_return_orders.append(order)
-
-            return_orders = new_return_orders
-
-        return return_orders
+        return self._order_book.list(symbols=symbols)
 
     def get_order(self, order_id: str):
         # refresh order status first
         self._update_order_status()
 
-        all_orders = self.list_orders()
-        for order in all_orders:
-            if order.order_id == order_id:
-                return order
+        order = self._order_book.get(order_id)
+        if order is None:
+            return False
 
-        return False
+        return order
+
+    def preload(self, symbols: list):
+        # load prices for a whole universe in one request instead of one per symbol,
+        # and only the metrics the matching engine reads
+        missing = [s for s in symbols if s not in self._engine.symbols]
+        if missing:
+            prices = self._client.get_ohlc_many(
+                missing,
+                self._time_manager._interval_name,
+                layout="matrix",
+                columns=list(dict.fromkeys([self.buy_metric, self.sell_metric])),
+            )
+            self.load_prices(prices)
+
+    def load_prices(self, prices):
+        # prices already in hand, as a PriceMatrix or dict of symbol -> ohlc frame
+        self._engine.load_prices(prices)
 
     def _save_order(self, response):
         # if self._orders.get(response["symbol"]):
         #    raise ValueError(
         #        f'{response["symbol"]}: Already have an order open for this symbol'
         #    )
-        self._orders[response["orderUuid"]] = OrderResult(response=response)
+        order = OrderResult(response=response)
+        self._order_book.add(order)
+        self._orders_changed = True
+
+        self.preload([order.symbol])
+        side = BUY if order.order_type in (MARKET_BUY, LIMIT_BUY) else SELL
+        limit_price = response.get("limit_price")
+        if limit_price is not None:
+            limit_price = float(limit_price)
+        self._engine.add_order(order.order_id, order.symbol, side, limit_price)
 
     def cancel_order(self, order_id):
-        order_to_delete = None
-        for _order_id in self._orders:
-            if self._orders[_order_id].order_id == order_id:
-                if (
-                    self._orders[_order_id].status
-                    in ORDER_STATUS_SUMMARY_TO_ID["cancelled"]
-                    or self._orders[_order_id].status
-                    in ORDER_STATUS_SUMMARY_TO_ID["filled"]
-                ):
-                    log.debug(
-                        f"{order_to_delete}: Unable to delete order_id {order_id} from "
-                        f"self._orders list since its already in {self._orders[_order_id].status_summary} state"
-                    )
-                    return False
-                order_to_delete = _order_id
+        order_to_delete = self._order_book.get_open(order_id)
 
         if order_to_delete:
+            if (
+                order_to_delete.status in ORDER_STATUS_SUMMARY_TO_ID["cancelled"]
+                or order_to_delete.status in ORDER_STATUS_SUMMARY_TO_ID["filled"]
+            ):
+                log.debug(
+                    f"{order_id}: Unable to delete order_id {order_id} from open "
+                    f"orders since its already in {order_to_delete.status_summary} state"
+                )
+                return False
+
             # need to update the order to cancelled
-            self._orders[order_to_delete].status = 6
-            self._orders[order_to_delete].closed = True
-            self._orders[order_to_delete].status_summary = ORDER_STATUS_ID_TO_SUMMARY[6]
-            self._orders[order_to_delete].status_text = ORDER_STATUS_TEXT[6]
-            self._orders[order_to_delete].success = False
-            self._orders[order_to_delete].update_time = self.period
-
-            # need to move the order to self._inactive_orders
-            self._inactive_orders.append(self._orders[order_to_delete])
-            del self._orders[order_to_delete]
-
-            log.debug(
-                f"{order_to_delete}: Moved from self._orders to self._inactive_orders"
-            )
+            order_to_delete.status = 6
+            order_to_delete.closed = True
+            order_to_delete.status_summary = ORDER_STATUS_ID_TO_SUMMARY[6]
+            order_to_delete.status_text = ORDER_STATUS_TEXT[6]
+            order_to_delete.success = False
+            order_to_delete.update_time = self.period
+
+            self._order_book.close(order_id)
+            self._engine.remove_order(order_id)
+
+            log.debug(f"{order_id}: Moved from open to inactive orders")
             return self.get_order(order_id=order_id)
         else:
             log.warning(
-                f"Tried to remove order_id {order_id} from self._orders but did not "
+                f"Tried to remove order_id {order_id} from open orders but did not "
                 f"find it - is it already closed?"
             )
             return False
@@ -467,53 +468,38 @@ class BackTestAPI:
         self._bars[symbol] = bars
 
     def _get_held_units(self, symbol):
-        unit_count = 0
-        paid = 0
-
-        if not self._assets_held.get(symbol):
-            return 0, 0
-
-        for order in self._assets_held[symbol]:
-            unit_count += order["units"]
-            paid += order["units"] * order["unit_price"]
-
-        return unit_count, paid
+        return self._positions.held(symbol)
 
     def _update_order_status(self):
         # loop through all the orders looking for whether they've been filled
         # assumes that this gets called with back_testing_date for every index in bars, since it only checks this index/back_testing_date
+        if self.period == self._matched_period and not self._orders_changed:
+            # nothing can have triggered since the last pass
+            return
+        self._matched_period = self.period
+        self._orders_changed = False
+
         filled_symbols = []
 
-        # hacky way of avoiding deleting orders and raising RuntimeError for dict changed size during iteration
-        orders_copy = self._orders.copy()
-        for _order_id in orders_copy:
-            this_order = orders_copy[_order_id]
+        # the engine works out which open orders trigger this period in one pass, and
+        # the fills get applied here in the order they were placed. Orders for symbols
+        # with no data this period are skipped, same as before
+        for _order_id, market_price in self._engine.match(self.period):
+            this_order = self._order_book.get(_order_id)
             this_symbol = this_order.symbol
-            # if the order is cancelled or filled ie. already actioned
+            # if the order is cancelled or filled ie. already actioned. cancel_order
+            # re-enters this method, so a nested call may have got to it already
             if (
                 this_order.status in ORDER_STATUS_SUMMARY_TO_ID["cancelled"]
                 or this_order.status in ORDER_STATUS_SUMMARY_TO_ID["filled"]
             ):
-                self._inactive_orders.append(this_order)
                 filled_symbols.append(_order_id)
                 log.debug(
-                    f"{_order_id}: Skipping this symbol in _inactive_orders since the "
+                    f"{_order_id}: Skipping this symbol in inactive orders since the "
                     f"status is {ORDER_STATUS_ID_TO_SUMMARY[this_order.status]}"
                 )
                 continue
 
-            # if this_symbol not in self._symbols:
-            #    raise KeyError(f"{this_symbol} is not registered in {self}")
-
-            try:
-                # check_index = self._bars[_order_id].loc[self._period]
-                ohlc = client.get_ohlc(this_symbol, self._time_manager._interval_name)
-                check_index = ohlc.loc[self.period]
-                # check_index = self._symbols[this_symbol].ohlc.bars.loc[self.period]
-            except KeyError as e:
-                log.debug(f"{_order_id}: No {this_symbol} data for {self.period}")
-                continue
-
             # if we got here, the order is not yet actioned
             if this_order.order_type == MARKET_BUY:
                 # immediate fill - its just a question of how many units they bought
@@ -521,7 +507,7 @@ class BackTestAPI:
                     f"{_order_id}: Starting fill for MARKET_BUY order for {this_symbol}"
                 )
 
-                unit_price = ohlc[self.buy_metric].loc[self.period]
+                unit_price = market_price
                 # self._symbols[this_symbol].align_price(
                 #    self._symbols[this_symbol]
                 #    .ohlc.bars[self.buy_metric]
@@ -553,15 +539,10 @@ class BackTestAPI:
                     this_order.filled_unit_quantity * this_order.filled_unit_price
                 )
 
-                # instantiate this symbol in the held array - it gets populated in a couple lines
-                if self._assets_held.get(this_symbol) == None:
-                    self._assets_held[this_symbol] = []
-
-                self._assets_held[this_symbol].append(
-                    {
-                        "units": this_order.filled_unit_quantity,
-                        "unit_price": this_order.filled_unit_price,
-                    }
+                self._positions.buy(
+                    this_symbol,
+                    units=this_order.filled_unit_quantity,
+                    unit_price=this_order.filled_unit_price,
                 )
 
                 # update balance
@@ -597,13 +578,7 @@ class BackTestAPI:
                     #    f"{symbol}: Hold {held} so can't sell {this_order.ordered_unit_quantity} units"
                     # )
 
-                ohlc = client.get_ohlc(
-                    this_symbol,
-                    self._time_manager._interval_name,
-                    start=str(self._time_manager.now),
-                    end=str(self._time_manager.now),
-                )
-                unit_price = ohlc[self.sell_metric].loc[self.period]
+                unit_price = market_price
                 # self._symbols[this_symbol].align_price(
                 #    self._symbols[this_symbol]
                 #    .ohlc.bars[self.sell_metric]
@@ -623,9 +598,7 @@ class BackTestAPI:
                     this_order.filled_unit_quantity * this_order.filled_unit_price
                 )
 
-                self._do_sell(
-                    quantity_to_sell=this_order.filled_unit_quantity, symbol=this_symbol
-                )
+                self._positions.sell(this_symbol, units=this_order.filled_unit_quantity)
 
                 # update balance
                 self._balance = round(
@@ -640,8 +613,7 @@ class BackTestAPI:
                 )
 
             elif this_order.order_type == LIMIT_BUY:
-                ohlc = client.get_ohlc(this_symbol, self._time_manager._interval_name)
-                last_low = ohlc[self.buy_metric].loc[self.period]
+                last_low = market_price
                 # (
                 #    self._symbols[this_symbol]
                 #    .ohlc.bars[self.buy_metric]
@@ -683,15 +655,10 @@ class BackTestAPI:
                         this_order.filled_unit_quantity * this_order.filled_unit_price
                     )
 
-                    # instantiate this symbol in the held array - it gets populated in a couple lines
-                    if self._assets_held.get(this_symbol) == None:
-                        self._assets_held[this_symbol] = []
-
-                    self._assets_held[this_symbol].append(
-                        {
-                            "units": this_order.filled_unit_quantity,
-                            "unit_price": this_order.filled_unit_price,
-                        }
+                    self._positions.buy(
+                        this_symbol,
+                        units=this_order.filled_unit_quantity,
+                        unit_price=this_order.filled_unit_price,
                     )
 
                     # update balance
@@ -712,9 +679,7 @@ class BackTestAPI:
                     )
 
             elif this_order.order_type == LIMIT_SELL:
-                ohlc = client.get_ohlc(this_symbol, self._time_manager._interval_name)
-
-                last_high = ohlc[self.sell_metric].loc[self.period]
+                last_high = market_price
                 # (
                 #    self._symbols[this_symbol]
                 #    .ohlc.bars[self.sell_metric]
@@ -749,9 +714,7 @@ class BackTestAPI:
                         this_order.status
                     ]
                     this_order.filled_unit_quantity = this_order.ordered_unit_quantity
-                    this_order.filled_unit_price = ohlc[self.sell_metric].loc[
-                        self.period
-                    ]
+                    this_order.filled_unit_price = last_high
                     # self._symbols[
                     #    this_symbol
                     # ].align_price(
@@ -764,9 +727,8 @@ class BackTestAPI:
                         this_order.filled_unit_quantity * this_order.filled_unit_price
                     )
 
-                    self._do_sell(
-                        quantity_to_sell=this_order.filled_unit_quantity,
-                        symbol=_order_id,
+                    self._positions.sell(
+                        this_symbol, units=this_order.filled_unit_quantity
                     )
 
                     # update balance
@@ -782,52 +744,8 @@ class BackTestAPI:
                     )
 
         for _order_id in filled_symbols:
-            self._inactive_orders.append(orders_copy[_order_id])
-            if _order_id in self._orders:
-                del self._orders[_order_id]
-
-    def _do_sell(self, quantity_to_sell, symbol):
-        # if we don't hold any, return False
-        if not self._assets_held.get(symbol):
-            return False
-
-        # check that we aren't trying to sell more than we actually hold
-        actual_held = 0
-        for order in self._assets_held[symbol]:
-            actual_held += order["units"]
-        if actual_held < quantity_to_sell:
-            raise ValueError(
-                f"{symbol}: Unable to remove {quantity_to_sell} units from holding of "
-                f'{order["units"]}, since that would be less than 0'
-            )
-
-        # now start popping units from held
-        # self._assets_held[symbol] is a list of objects that represent buy orders. when we sell, we need to pop/update these buy orders to remove them
-        for order in self._assets_held[symbol]:
-            if order["units"] - quantity_to_sell >= 0:
-                # more units in this order than we need to sell
-                order["units"] -= quantity_to_sell
-                quantity_to_sell = 0
-            else:
-                quantity_to_sell -= order["units"]
-                order["units"] = 0
-
-            # nothing left to sell, no point iterating over remaining orders
-            if quantity_to_sell == 0:
-                break
-
-        # trim zero quantities
-        for order in self._assets_held[symbol]:
-            new_assets = list()
-            if order["units"] > 0:
-                new_assets.append(order)
-
-            if len(new_assets) > 0:
-                self._assets_held[symbol] = new_assets
-            else:
-                del self._assets_held[symbol]
-
-        return True
+            self._order_book.close(_order_id)
+            self._engine.remove_order(_order_id)
 
     def get_precision(self, yf_symbol: str) -> int:
         if yf_symbol in self.supported_crypto_symbols:
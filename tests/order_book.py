@@ -0,0 +1,121 @@
+from collections import deque
+
+
+# every order BackTestAPI has seen, indexed by id, symbol and status summary so
+# lookups don't have to walk the whole order history. Orders are either open or
+# inactive (filled or cancelled), and list() returns open orders first then inactive
+# ones in the order they closed, same as the old _orders + _inactive_orders pair
+class OrderBook:
+    def __init__(self):
+        self._by_id = dict()
+        self._open = dict()
+        self._inactive = dict()
+        self._by_symbol = dict()
+        self._by_status = dict()
+
+    def add(self, order) -> None:
+        self._by_id[order.order_id] = order
+        self._open[order.order_id] = order
+        self._by_symbol.setdefault(order.symbol, dict())[order.order_id] = order
+
+    def get(self, order_id: str):
+        return self._by_id.get(order_id)
+
+    def get_open(self, order_id: str):
+        return self._open.get(order_id)
+
+    def open_orders(self) -> dict:
+        return self._open
+
+    def close(self, order_id: str) -> None:
+        # call once the order has been marked filled or cancelled. Closing twice is
+        # a no-op
+        order = self._open.pop(order_id, None)
+        if order is None:
+            return
+
+        self._inactive[order_id] = order
+        self._by_status.setdefault(order.status_summary, dict())[order_id] = order
+
+    def list(self, symbols: list = None) -> list:
+        if symbols is None:
+            return list(self._open.values()) + list(self._inactive.values())
+
+        wanted = set()
+        for symbol in symbols:
+            wanted.update(self._by_symbol.get(symbol, dict()))
+
+        return [o for o in self._open.values() if o.order_id in wanted] + [
+            o for o in self._inactive.values() if o.order_id in wanted
+        ]
+
+    def by_status(self, status_summary: str) -> list:
+        # open orders can move between open and pending, so they're filtered live
+        if status_summary in ("open", "pending"):
+            return [
+                o for o in self._open.values() if o.status_summary == status_summary
+            ]
+        return list(self._by_status.get(status_summary, dict()).values())
+
+    def __contains__(self, order_id) -> bool:
+        return order_id in self._by_id
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+# FIFO lots per symbol with running unit and cost totals, so checking a holding is a
+# dict lookup rather than a re-sum of every lot ever bought
+class PositionLedger:
+    def __init__(self):
+        self._lots = dict()
+        self._units = dict()
+        self._paid = dict()
+
+    def buy(self, symbol: str, units: float, unit_price: float) -> None:
+        self._lots.setdefault(symbol, deque()).append([units, unit_price])
+        self._units[symbol] = self._units.get(symbol, 0) + units
+        self._paid[symbol] = self._paid.get(symbol, 0) + units * unit_price
+
+    def sell(self, symbol: str, units: float) -> bool:
+        # if we don't hold any, return False
+        lots = self._lots.get(symbol)
+        if not lots:
+            return False
+
+        if self._units[symbol] < units:
+            raise ValueError(
+                f"{symbol}: Unable to remove {units} units from holding of "
+                f"{self._units[symbol]}, since that would be less than 0"
+            )
+
+        # oldest lots get sold first
+        remaining = units
+        while remaining > 0 and lots:
+            lot = lots[0]
+            sold = min(lot[0], remaining)
+            lot[0] -= sold
+            remaining -= sold
+            self._paid[symbol] -= sold * lot[1]
+            if lot[0] <= 0:
+                lots.popleft()
+
+        if lots:
+            self._units[symbol] -= units
+        else:
+            # reset rather than let float error accumulate on a closed position
+            del self._lots[symbol]
+            del self._units[symbol]
+            del self._paid[symbol]
+
+        return True
+
+    def held(self, symbol: str) -> tuple:
+        # (units, cost basis)
+        return self._units.get(symbol, 0), self._paid.get(symbol, 0)
+
+    def positions(self) -> dict:
+        return dict(self._units)
+
+    def __contains__(self, symbol) -> bool:
+        return symbol in self._lots
@@ -0,0 +1,126 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from persistent_ohlc_client import PersistentOhlcClient, PriceMatrix, TickCalendar
+
+# example_sctr_part_2 is import safe, its backtest only runs as a script
+from example_sctr_part_2 import BackTestTimeManager, run_backtest
+from monkey_back import BackTestAPI
+
+# runs example_sctr_part_2's backtest for every combination in a parameter grid, eg.
+#   sweep({"buy_model": ["highest", "velocity", "3up"], "top_fraction": [0.2, 0.4]})
+# SCTR and price data are fetched once and put in shared memory, and each worker
+# process maps them rather than getting its own copy. Results come back in grid order
+# whatever order the workers finish in
+
+
+def share(matrix: PriceMatrix) -> tuple:
+    # copy matrix values into a new shared memory block. Returns what a worker needs
+    # to map it, and the block itself so the caller can unlink it when done
+    block = shared_memory.SharedMemory(create=True, size=max(matrix.values.nbytes, 1))
+    values = np.ndarray(matrix.values.shape, dtype=np.float64, buffer=block.buf)
+    values[:] = matrix.values
+    spec = {
+        "name": block.name,
+        "shape": matrix.values.shape,
+        "index": matrix.index,
+        "symbols": list(matrix.symbols),
+        "fields": list(matrix.fields),
+    }
+    return spec, block
+
+
+def attach(spec: dict) -> tuple:
+    # (PriceMatrix over the shared block, the block). Keep the block referenced for
+    # as long as the matrix is in use
+    block = shared_memory.SharedMemory(name=spec["name"])
+    values = np.ndarray(spec["shape"], dtype=np.float64, buffer=block.buf)
+    values.flags.writeable = False
+    matrix = PriceMatrix(spec["index"], spec["symbols"], spec["fields"], values)
+    return matrix, block
+
+
+# per worker process, set up once by _init_worker
+_worker = dict()
+
+
+def _init_worker(sctr_spec: dict, prices_spec: dict, interval: str) -> None:
+    _worker["sctr"], _worker["sctr_block"] = attach(sctr_spec)
+    _worker["prices"], _worker["prices_block"] = attach(prices_spec)
+    _worker["calendar"] = TickCalendar.from_matrix(_worker["sctr"])
+    _worker["interval"] = interval
+
+
+def _run(params: dict) -> dict:
+    # everything made here is dropped once the backtest returns, the only thing a
+    # worker holds on to between runs is the shared data
+    sctr_data = _worker["sctr"]
+    tm = BackTestTimeManager(interval=_worker["interval"])
+    tm.add_symbols(sctr_data.symbols)
+    tm.set_bounds(sctr_data.index[0], sctr_data.index[-1])
+    tm.calendar = _worker["calendar"]
+
+    broker = BackTestAPI(
+        time_manager=tm, back_testing=True, buy_metric="Close", sell_metric="Close"
+    )
+    broker.load_prices(_worker["prices"])
+    return {**params, **run_backtest(sctr_data, broker, tm, verbose=False, **params)}
+
+
+def grid_of(parameters: dict) -> list:
+    # every combination, in a fixed order
+    names = list(parameters)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(parameters[n] for n in names))
+    ]
+
+
+def sweep(
+    parameters: dict,
+    universe: str = "asx",
+    interval: str = "1d",
+    days: int = 250,
+    workers: int = None,
+    client: PersistentOhlcClient = None,
+) -> pd.DataFrame:
+    # one row per combination of parameters, indexed by them, with run_backtest's
+    # results as columns
+    client = client or PersistentOhlcClient()
+    sctr_data = client.get_sctr(universe, interval, days=days, layout="matrix")
+    prices = client.get_ohlc_many(
+        list(sctr_data.symbols), interval, layout="matrix", columns=["Close"]
+    )
+
+    sctr_spec, sctr_block = share(sctr_data)
+    prices_spec, prices_block = share(prices)
+    grid = grid_of(parameters)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(sctr_spec, prices_spec, interval),
+        ) as pool:
+            rows = list(pool.map(_run, grid))
+    finally:
+        for block in (sctr_block, prices_block):
+            block.close()
+            block.unlink()
+
+    return pd.DataFrame(rows).set_index(list(parameters))
+
+
+if __name__ == "__main__":
+    results = sweep(
+        {
+            "buy_model": ["highest", "velocity", "3up"],
+            "top_fraction": [0.2, 0.3, 0.4, 0.5],
+        }
+    )
+    print(results.sort_values("pnl", ascending=False).to_string())
@@ -1,9 +1,21 @@
 import requests
 from datetime import date, datetime
+import os
+import tempfile
+import threading
+import time
 import unittest
+import numpy as np
 import pandas as pd
+from persistent_ohlc import bar_store, disk_store, indicators, sctr, shared_frames
+from persistent_ohlc import loader, memory_cache, refresher, response_cache
+from persistent_ohlc import exceptions, numpy_format, windowing
+import asyncio
 from persistent_ohlc_client import PersistentOhlcClient
+from persistent_ohlc_client.persistent_client import BacktestClock
+from persistent_ohlc_client import TickCalendar, formats
 import json
+from string import Template
 
 urlbase = "http://127.0.0.1:8002"
 macd_columns = set(
@@ -16,6 +28,7 @@ macd_columns = set(
         "macd_crossover",
     ]
 )
+ppo_slope_columns = set(["PPO", "PPO_EMA_9", "PPO_HIST", "PPO_HIST_SLOPE"])
 fake_symbol = "some fake symbol"
 fake_ta = "some fake TA"
 
@@ -61,6 +74,13 @@ class TestClient(unittest.TestCase):
         diff_len = len(macd_columns.difference(query.columns))
         self.assertEquals(diff_len, 0)
 
+    def test_ta_ppo_slope(self):
+        client = PersistentOhlcClient()
+        query = client.get_ohlc("BTC-USD", ta=["PpoSlopeTA", "MacdTA"])
+        self.assertEqual(len(ppo_slope_columns.difference(query.columns)), 0)
+        self.assertEqual(len(macd_columns.difference(query.columns)), 0)
+        self.assertEqual(query["PPO_HIST_SLOPE"].iloc[:3].tolist(), [0, 0, 0])
+
     def test_ta_fake(self):
         client = PersistentOhlcClient()
         error_triggered = False
@@ -73,3 +93,948 @@ class TestClient(unittest.TestCase):
                     error_triggered = True
 
         self.assertEqual(True, error_triggered)
+
+    def test_formats(self):
+        count = 10
+        json_query = PersistentOhlcClient(response_format="json").get_ohlc(
+            "BTC-USD", count=count
+        )
+        for response_format in ["arrow", "parquet", "numpy"]:
+            client = PersistentOhlcClient(response_format=response_format)
+            query = client.get_ohlc("BTC-USD", count=count)
+            self.assertEqual(len(query), count)
+            self.assertEqual(list(query.columns), list(json_query.columns))
+            self.assertEqual(query["Close"].tolist(), json_query["Close"].tolist())
+
+    def test_columns(self):
+        client = PersistentOhlcClient()
+        query = client.get_ohlc("BTC-USD", count=10, columns=["Volume", "Close"])
+        self.assertEqual(list(query.columns), ["Volume", "Close"])
+
+        query = client.get_ohlc(
+            "BTC-USD", count=10, ta=["PpoSlopeTA"], columns=["PPO_HIST"]
+        )
+        self.assertEqual(list(query.columns), ["PPO_HIST"])
+
+        query = client.get_ohlc_many(
+            ["BTC-USD", "ETH-USD"], layout="matrix", count=10, columns=["Close"]
+        )
+        self.assertEqual(list(query.fields), ["Close"])
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.get_ohlc("BTC-USD", columns=["Nope"])
+
+    def test_many(self):
+        count = 10
+        symbols = ["BTC-USD", "ETH-USD"]
+        client = PersistentOhlcClient()
+        query = client.get_ohlc_many(symbols, count=count)
+        self.assertEqual(list(query.columns.unique(level="symbol")), symbols)
+        self.assertEqual(len(query["BTC-USD"].dropna()), count)
+
+        query = client.get_ohlc_many(symbols + [fake_symbol], layout="map", count=count)
+        self.assertEqual(list(query.keys()), symbols)
+        for symbol in symbols:
+            self.assertEqual(len(query[symbol]), count)
+
+        frames = query
+        query = client.get_ohlc_many(symbols, layout="matrix", count=count)
+        self.assertEqual(list(query.symbols), symbols)
+        for symbol in symbols:
+            row = query.exact_row(frames[symbol].index[-1])
+            self.assertEqual(
+                query.get(row, symbol, "Close"), frames[symbol]["Close"].iloc[-1]
+            )
+
+    def test_bounds(self):
+        symbols = ["BTC-USD", "ETH-USD"]
+        client = PersistentOhlcClient()
+        bounds = client.get_bounds(symbols + [fake_symbol], interval="1d")
+        self.assertEqual(list(bounds), symbols)
+
+        query = client.get_ohlc("BTC-USD", "1d")
+        self.assertEqual(bounds["BTC-USD"]["first"], query.index[0])
+        self.assertEqual(bounds["BTC-USD"]["last"], query.index[-1])
+        self.assertEqual(bounds["BTC-USD"]["bars"], len(query))
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.get_bounds([fake_symbol])
+
+    def test_sctr(self):
+        client = PersistentOhlcClient()
+        query = client.get_sctr("crypto", interval="1d", days=30)
+        self.assertTrue(len(query) > 0)
+        self.assertIn(("BTC-USD", "rank"), query.columns)
+
+        ranks = query.loc[query.index[-1], (slice(None), "rank")].dropna()
+        self.assertEqual(ranks.min(), 1)
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.get_sctr("some fake universe", interval="1d")
+
+    def test_poll(self):
+        client = PersistentOhlcClient()
+        first = client.poll_ohlc("BTC-USD")
+        second = client.poll_ohlc("BTC-USD")
+        self.assertTrue(len(second) >= len(first))
+        self.assertEqual(list(second.columns), list(first.columns))
+        self.assertEqual(second.index[0], first.index[0])
+        self.assertTrue(second.index.is_unique)
+
+    def test_cached_clock(self):
+        full = PersistentOhlcClient().get_ohlc("BTC-USD")
+        clock = BacktestClock(full.index[-100].to_pydatetime())
+        client = PersistentOhlcClient(clock=clock, cache=True)
+
+        query = client.get_ohlc("BTC-USD")
+        self.assertEqual(query.index[-1], full.index[-100])
+        clock.tick()
+        query = client.get_ohlc("BTC-USD", count=10)
+        self.assertEqual(len(query), 10)
+        self.assertEqual(query.index[-1], full.index[-99])
+
+
+class TestSctrEngine(unittest.TestCase):
+    def frames(self, periods):
+        index = pd.date_range("2020-01-01", periods=periods, freq="B", tz="UTC")
+        rng = np.random.default_rng(1)
+        frames = {
+            f"S{i}": pd.DataFrame(
+                {"Close": 100 * np.exp(rng.normal(0, 0.02, periods).cumsum())},
+                index=index,
+            )
+            for i in range(10)
+        }
+        # listed late, and with a gap
+        frames["S1"] = frames["S1"].iloc[periods - 60 :]
+        frames["S2"] = frames["S2"].drop(index[-20:-17])
+        frames["S3"] = frames["S3"].drop(index[::7])
+        return frames
+
+    def test_scores_match_each_symbol_alone(self):
+        frames = self.frames(300)
+        together = sctr.scores(sctr.close_matrix(frames))
+        for symbol, frame in frames.items():
+            alone = sctr.scores(sctr.close_matrix({symbol: frame}))[symbol]
+            pd.testing.assert_series_equal(together[symbol].loc[frame.index], alone)
+            self.assertTrue(together[symbol].drop(frame.index).isna().all())
+        self.assertTrue(together["S3"].notna().any())
+
+    def test_extend_matches_build(self):
+        frames = self.frames(400)
+        upto = lambda end: {s: f.loc[f.index < end] for s, f in frames.items()}
+        dates = frames["S0"].index
+        table = sctr.SctrTable(upto(dates[-30]))
+
+        for end in dates[-29:]:
+            # a forming bar, then the final one
+            forming = upto(end)
+            forming["S0"] = forming["S0"].copy()
+            forming["S0"].iloc[-1] *= 1.01
+            table.extend(forming)
+            table.extend(upto(end))
+
+            expected = sctr.build(upto(end))
+            got = table.table()
+            pd.testing.assert_frame_equal(
+                got.drop(columns="sctr"), expected.drop(columns="sctr")
+            )
+            np.testing.assert_allclose(got["sctr"], expected["sctr"], rtol=1e-12)
+
+    def test_engine_replay(self):
+        close = sctr.close_matrix(self.frames(300))
+        engine = sctr.SctrEngine(close.columns)
+        for timestamp, row in zip(close.index, close.to_numpy()):
+            outputs = engine.update(timestamp, row)
+
+        expected = sctr.panel(close)
+        np.testing.assert_allclose(
+            outputs["sctr"], expected["sctr"].iloc[-1], rtol=1e-12
+        )
+        with self.assertRaises(ValueError):
+            engine.update(close.index[0], close.iloc[0].to_numpy())
+
+
+class TestNumpyFormat(unittest.TestCase):
+    def test_round_trip(self):
+        index = pd.date_range("2023-01-02", periods=5, freq="D", tz="Australia/Sydney")
+        bars = pd.DataFrame(
+            {
+                "Close": np.arange(5, dtype=float),
+                "Volume": np.arange(5),
+                "Up": np.arange(5) % 2 == 0,
+                "cycle": ["up", "down", None, "up", "up"],
+            },
+            index=index,
+        )
+        payload = numpy_format.encode(bars)
+        # the client decodes with the same code the service maps files with
+        decoded = formats.decode(payload, formats.media_types[formats.NUMPY])
+
+        # strings come back as a Categorical
+        expected = bars.assign(cycle=pd.Categorical(bars["cycle"]))
+        pd.testing.assert_frame_equal(decoded, expected, check_freq=False)
+
+        mixed = bars.assign(cycle=["up", 1, None, 2.5, "down"])
+        with self.assertRaises(TypeError):
+            numpy_format.encode(mixed)
+
+
+class TestWindowing(unittest.TestCase):
+    def bars(self, tz="Australia/Sydney"):
+        index = pd.date_range("2023-01-02", periods=10, freq="D", tz=tz)
+        return pd.DataFrame(
+            {"Close": np.arange(10, dtype=float), "Volume": 1.0}, index=index
+        )
+
+    def window(self, bars, start=None, end=None, count=None):
+        start, end = windowing.parse_window(bars.index, start, end)
+        return windowing.window(bars, start=start, end=end, count=count)["Close"]
+
+    def test_start_and_end(self):
+        bars = self.bars()
+        # both ends are inclusive
+        got = self.window(bars, "2023-01-04", "2023-01-06")
+        self.assertEqual(got.tolist(), [2, 3, 4])
+        # between bars
+        got = self.window(bars, "2023-01-04 12:00", "2023-01-06 12:00")
+        self.assertEqual(got.tolist(), [3, 4])
+
+        # outside the bars
+        self.assertEqual(len(self.window(bars, "2022-01-01", "2024-01-01")), 10)
+        self.assertEqual(len(self.window(bars, "2024-01-01")), 0)
+        self.assertEqual(len(self.window(bars, end="2022-01-01")), 0)
+
+        with self.assertRaises(exceptions.EndBeforeStartError):
+            windowing.parse_window(bars.index, "2023-01-06", "2023-01-04")
+
+    def test_count(self):
+        bars = self.bars()
+        self.assertEqual(self.window(bars, count=3).tolist(), [7, 8, 9])
+        self.assertEqual(
+            self.window(bars, end="2023-01-06", count=3).tolist(), [2, 3, 4]
+        )
+        # fewer bars than asked for
+        self.assertEqual(len(self.window(bars, end="2023-01-03", count=5)), 2)
+        self.assertEqual(len(self.window(bars, end="2022-01-01", count=5)), 0)
+        self.assertEqual(len(self.window(bars, count=0)), 10)
+
+    def test_timezones(self):
+        # naive times are in the bars' own timezone, aware ones are converted
+        bars = self.bars()
+        naive = self.window(bars, "2023-01-04", "2023-01-04")
+        aware = self.window(bars, "2023-01-03 13:00+00:00", "2023-01-03 13:00+00:00")
+        self.assertEqual(naive.tolist(), [2])
+        self.assertEqual(aware.tolist(), [2])
+
+        # and aware times against naive bars are taken as UTC
+        bars = self.bars(tz=None)
+        got = self.window(bars, "2023-01-04 10:00+10:00", "2023-01-04 10:00+10:00")
+        self.assertEqual(got.tolist(), [2])
+
+        with self.assertRaises(exceptions.InvalidDate):
+            windowing.parse_window(bars.index, "banana")
+
+    def test_columns_and_last_position(self):
+        bars = self.bars()
+        self.assertIsNone(windowing.parse_columns(bars.columns))
+        self.assertEqual(
+            windowing.parse_columns(bars.columns, ["Volume", "Close", "Volume"]),
+            [1, 0],
+        )
+        with self.assertRaises(exceptions.InvalidColumnError):
+            windowing.parse_columns(bars.columns, ["Close", "PPO"])
+        got = windowing.window(bars, count=2, columns=[1])
+        self.assertEqual(list(got.columns), ["Volume"])
+
+        index = bars.index
+        self.assertEqual(
+            windowing.last_position(index, index[0] - pd.Timedelta(seconds=1)), -1
+        )
+        self.assertEqual(windowing.last_position(index, index[0]), 0)
+        self.assertEqual(
+            windowing.last_position(index, index[3] + pd.Timedelta(hours=1)), 3
+        )
+        self.assertEqual(
+            windowing.last_position(index, index[-1] + pd.Timedelta(days=9)), 9
+        )
+
+
+class TestIndicators(unittest.TestCase):
+    def test_apply_many(self):
+        index = pd.date_range("2020-01-01", periods=300, freq="B", tz="UTC")
+        close = 100 * np.exp(np.random.default_rng(2).normal(0, 0.02, 300).cumsum())
+        bars = pd.DataFrame({"Close": close}, index=index)
+
+        remaining = indicators.apply_many(bars, ["PpoSlopeTA", fake_ta])
+        self.assertEqual(remaining, [fake_ta])
+
+        # same as applying it on its own
+        expected = indicators.PpoSlopeTA().apply(bars[["Close"]].copy())
+        pd.testing.assert_frame_equal(bars[expected.columns], expected)
+
+        # already there, so left alone
+        bars["PPO"] = 0.0
+        self.assertEqual(indicators.apply_many(bars, ["PpoSlopeTA"]), [])
+        self.assertEqual(bars["PPO"].abs().sum(), 0)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_stale_put(self):
+        responses = response_cache.ResponseCache(max_bytes=1024)
+        responses.validate("ABC", "1d", 1)
+        key = ("ABC", "1d", "json")
+
+        # a request still holding the old bars finishes after the bars changed
+        responses.validate("ABC", "1d", 2)
+        responses.put(key, b"old", 1)
+        self.assertIsNone(responses.get(key))
+
+        responses.put(key, b"new", 2)
+        self.assertEqual(responses.get(key), b"new")
+
+
+# just the hash commands RedisBarStore uses, keeping track of what gets written
+class FakeRedis:
+    def __init__(self):
+        self.hashes = dict()
+        self.written = []
+        self.down = False
+
+    def hgetall(self, key):
+        if self.down:
+            raise bar_store.redis.ConnectionError("down")
+        return dict(self.hashes.get(key, {}))
+
+    def hget(self, key, field):
+        if self.down:
+            raise bar_store.redis.ConnectionError("down")
+        return self.hashes.get(key, {}).get(field.encode())
+
+    def hset(self, key, mapping):
+        self.written.extend(mapping)
+        self.hashes.setdefault(key, {}).update(
+            {
+                f.encode(): v if isinstance(v, bytes) else v.encode()
+                for f, v in mapping.items()
+            }
+        )
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.hashes[key].pop(field.encode(), None)
+
+    def expire(self, key, ttl):
+        pass
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+class TestBarStore(unittest.TestCase):
+    def bars(self, periods):
+        index = pd.date_range("2023-01-01", periods=periods, freq="D", tz="UTC")
+        close = 100 + np.arange(periods, dtype=float)
+        return pd.DataFrame(
+            {"Close": close, "Volume": 1.0, "Up": close % 2 == 0}, index=index
+        )
+
+    def test_chunked_round_trip(self):
+        redis = FakeRedis()
+        store = bar_store.RedisBarStore(redis, chunk_rows=50)
+        bars = self.bars(120)
+        store.save("ABC", "1d", bars)
+        pd.testing.assert_frame_equal(store.load("ABC", "1d"), bars, check_freq=False)
+        self.assertIsNone(store.load("ABC", "1d", max_age=-1))
+
+        # a new bar only rewrites the chunk holding the last stored bar onwards
+        redis.written.clear()
+        bars = self.bars(121)
+        store.save("ABC", "1d", bars)
+        self.assertEqual(sorted(redis.written), ["2", "meta"])
+        pd.testing.assert_frame_equal(store.load("ABC", "1d"), bars, check_freq=False)
+
+        # new columns rewrite everything, a shorter series drops the extra chunks
+        bars["PPO"] = 1.0
+        store.save("ABC", "1d", bars.iloc[60:])
+        pd.testing.assert_frame_equal(
+            store.load("ABC", "1d"), bars.iloc[60:], check_freq=False
+        )
+        self.assertEqual(len(redis.hashes[store.key("ABC", "1d")]), 3)
+
+    def test_stale_save_dropped(self):
+        # a worker adding TA to bars older than what's stored doesn't replace them
+        store = bar_store.RedisBarStore(FakeRedis())
+        store.save("ABC", "1d", self.bars(11), as_of=1000)
+        older = self.bars(10)
+        older["PPO"] = 1.0
+        store.save("ABC", "1d", older, ta=["PPO"])
+        self.assertEqual(len(store.load("ABC", "1d")), 11)
+
+        # nor does a different take on the last bar fetched no later
+        forming = self.bars(11)
+        forming.iloc[-1, 0] = 1.0
+        store.save("ABC", "1d", forming, as_of=900)
+        self.assertEqual(store.load("ABC", "1d")["Close"].iloc[-1], 110)
+        store.save("ABC", "1d", forming, as_of=1100)
+        loaded = store.load("ABC", "1d")
+        self.assertEqual(loaded["Close"].iloc[-1], 1)
+        self.assertEqual(loaded.attrs["saved_at"], 1100)
+
+        # the same bars with TA added still go in
+        forming["PPO"] = 1.0
+        store.save("ABC", "1d", forming, ta=["PPO"])
+        loaded = store.load("ABC", "1d")
+        self.assertIn("PPO", loaded.columns)
+        self.assertEqual(loaded.attrs["saved_at"], 1100)
+
+    def test_backoff(self):
+        redis = FakeRedis()
+        store = bar_store.RedisBarStore(redis, backoff=60)
+        redis.down = True
+        with self.assertRaises(bar_store.redis.ConnectionError):
+            store.load("ABC", "1d")
+
+        # left alone until the backoff is up, even once it's back
+        redis.down = False
+        store.save("ABC", "1d", self.bars(10))
+        self.assertEqual(redis.written, [])
+        self.assertIsNone(store.load("ABC", "1d"))
+
+        store.failed_at -= 61
+        store.save("ABC", "1d", self.bars(10))
+        self.assertEqual(len(store.load("ABC", "1d")), 10)
+
+    def test_disk_hit_not_copied(self):
+        # the mapped file would be read whole to put it in redis
+        redis = FakeRedis()
+        with tempfile.TemporaryDirectory() as directory:
+            disk = disk_store.DiskBarStore(
+                Template(directory + "/${interval}/${symbol}")
+            )
+            disk.save("ABC", "1d", self.bars(10), as_of=time.time())
+            shared = bar_store.ReadThrough(
+                [bar_store.RedisBarStore(redis), disk], None, {"1d": 86400}
+            )
+            self.assertEqual(len(shared.cached("ABC", "1d").ohlc.bars), 10)
+            self.assertEqual(redis.written, [])
+
+    def test_read_through(self):
+        loads = []
+
+        class Loaded:
+            def __init__(self, bars):
+                self.ohlc = type("Ohlc", (), {"bars": bars})()
+
+        def factory(symbol, interval):
+            loads.append(symbol)
+            return Loaded(self.bars(10))
+
+        shared = bar_store.ReadThrough(
+            [bar_store.RedisBarStore(FakeRedis())], factory, {"1d": 86400}
+        )
+        first = shared("ABC", "1d")
+        second = shared("ABC", "1d")
+        self.assertEqual(loads, ["ABC"])
+        self.assertIsInstance(second, bar_store.StoredSymbol)
+        pd.testing.assert_frame_equal(
+            second.ohlc.bars, first.ohlc.bars, check_freq=False
+        )
+
+        # saving the same bars with TA added doesn't make them any more current, so
+        # a refresh after a boundary still goes to the source
+        saved_at = time.time()
+        bars = second.ohlc.bars.copy()
+        bars["PPO"] = 1.0
+        shared.save("ABC", "1d", bars)
+        self.assertIsInstance(shared.fresh("ABC", "1d", saved_at), Loaded)
+        self.assertEqual(loads, ["ABC", "ABC"])
+        self.assertIsInstance(
+            shared.fresh("ABC", "1d", saved_at), bar_store.StoredSymbol
+        )
+        self.assertEqual(loads, ["ABC", "ABC"])
+
+        # symbol_cache TA the stores say is already in the bars doesn't need the
+        # real Symbol
+        bars["macd_macd"] = 1.0
+        shared.save("ABC", "1d", bars, ta=["MacdTA"])
+        stored = shared.cached("ABC", "1d")
+        stored.ohlc.apply_ta("MacdTA")
+        self.assertEqual(loads, ["ABC", "ABC"])
+        self.assertNotIn("ta", stored.ohlc.bars.attrs)
+
+
+class TestDiskStore(unittest.TestCase):
+    def test_append_and_range(self):
+        index = pd.date_range(
+            "2023-10-01", periods=2880, freq="h", tz="Australia/Sydney"
+        )
+        bars = pd.DataFrame(
+            {"Close": np.arange(len(index), dtype=float), "Volume": 1.0}, index=index
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = disk_store.DiskBarStore(
+                Template(directory + "/${interval}/${symbol}")
+            )
+            store.save("BTC-USD", "1h", bars.iloc[:2000])
+            path = store.path("BTC-USD", "1h")
+            closed = os.path.getmtime(os.path.join(path, "2023-09.parquet"))
+
+            # the forming bar changed, more arrived and TA was added. Upstream only
+            # sent the recent ones
+            later = bars.copy()
+            later.iloc[1999, 0] = -1
+            later["PPO"] = 0.0
+            store.save("BTC-USD", "1h", later.iloc[1500:])
+            self.assertEqual(
+                os.path.getmtime(os.path.join(path, "2023-09.parquet")), closed
+            )
+
+            expected = pd.concat([bars.iloc[:1500], later.iloc[1500:][bars.columns]])
+            pd.testing.assert_frame_equal(
+                store.load("BTC-USD", "1h"), expected, check_freq=False
+            )
+            self.assertEqual(store.series(), [("BTC-USD", "1h")])
+            self.assertIsNone(store.load("BTC-USD", "1h", max_age=-1))
+
+            # served from the mapped copy, or the partitions without it
+            loaded = store.load("BTC-USD", "1h")
+            self.assertFalse(loaded["Close"].to_numpy().flags.writeable)
+            os.remove(os.path.join(path, disk_store.MAPPED))
+            pd.testing.assert_frame_equal(
+                store.load("BTC-USD", "1h"), expected, check_freq=False
+            )
+
+    def test_saved_at(self):
+        # saved_at is when the bars were fetched, not when they were written
+        bars = pd.DataFrame(
+            {"Close": np.arange(10, dtype=float)},
+            index=pd.date_range("2023-10-01", periods=10, freq="D", tz="UTC"),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            store = disk_store.DiskBarStore(
+                Template(directory + "/${interval}/${symbol}")
+            )
+            store.save("BTC-USD", "1d", bars, as_of=100.0)
+
+            # upstream had nothing new, what's stored is current
+            store.save("BTC-USD", "1d", bars, as_of=200.0)
+            self.assertEqual(store.manifest("BTC-USD", "1d")["saved_at"], 200.0)
+
+            # the same bars with TA added don't make it any more current
+            with_ta = bars.copy()
+            with_ta["PPO"] = 0.0
+            store.save("BTC-USD", "1d", with_ta, ta=["PpoSlopeTA"])
+            self.assertEqual(store.manifest("BTC-USD", "1d")["saved_at"], 200.0)
+            self.assertEqual(store.load("BTC-USD", "1d").attrs["saved_at"], 200.0)
+
+            # and a different take on the last bar from an older fetch is dropped
+            stale = bars.copy()
+            stale.iloc[-1, 0] = -1.0
+            store.save("BTC-USD", "1d", stale, as_of=150.0)
+            self.assertEqual(store.load("BTC-USD", "1d")["Close"].iloc[-1], 9.0)
+
+
+class TestSharedFrames(unittest.TestCase):
+    def test_publish_and_republish(self):
+        index = pd.date_range(
+            "2023-01-02", periods=100, freq="h", tz="Australia/Sydney"
+        )
+        close = 100 + np.arange(100, dtype=float)
+        bars = pd.DataFrame({"Close": close, "Up": close % 2 == 0}, index=index)
+
+        class Ohlc:
+            def __init__(self):
+                self.bars = bars.copy()
+
+            def apply_ta(self, name):
+                raise KeyError(name)
+
+        loaded = type("Loaded", (), {"ohlc": Ohlc()})()
+        with tempfile.TemporaryDirectory() as directory:
+            publisher = shared_frames.BarPublisher(
+                lambda symbol, interval: loaded, directory, (KeyError,)
+            )
+            first = publisher.spec("ABC", "1h")
+            mapped = shared_frames.attach(first)
+            pd.testing.assert_frame_equal(mapped, bars, check_freq=False)
+            self.assertFalse(mapped["Close"].to_numpy().flags.writeable)
+
+            # TA is applied in the publisher, which writes a new file
+            second = publisher.spec("ABC", "1h", ["PpoSlopeTA", fake_ta])
+            self.assertEqual(second["missing"], [fake_ta])
+            self.assertFalse(os.path.exists(first["path"]))
+            self.assertIn("PPO_HIST", shared_frames.attach(second).columns)
+            self.assertEqual(publisher.spec("ABC", "1h")["path"], second["path"])
+
+            # what's already mapped carries on working
+            self.assertEqual(mapped["Close"].iloc[-1], close[-1])
+
+            # refreshed bars get the TA that's been asked for put back
+            refreshed = type("Loaded", (), {"ohlc": Ohlc()})()
+            refreshed.ohlc.bars.iloc[-1, 0] = -1.0
+            publisher.put("ABC", "1h", refreshed)
+            third = publisher.spec("ABC", "1h")
+            self.assertNotEqual(third["path"], second["path"])
+            self.assertIn("PPO_HIST", shared_frames.attach(third).columns)
+
+            # a worker only goes to the publisher for TA its mapping doesn't have
+            calls = []
+
+            class Counting:
+                def spec(self, *args):
+                    calls.append(args)
+                    return publisher.spec(*args)
+
+            shared = shared_frames.SharedOhlc(Counting(), "ABC", "1h")
+            self.assertEqual(len(calls), 1)
+            self.assertIn("PpoSlopeTA", shared.ta)
+            self.assertEqual(shared.apply_many(["PpoSlopeTA"]), [])
+            self.assertEqual(shared.apply_many([fake_ta]), [fake_ta])
+            self.assertEqual(shared.apply_many([fake_ta, "PpoSlopeTA"]), [fake_ta])
+            self.assertEqual(len(calls), 2)
+            shared.remap()
+            self.assertEqual(len(calls), 3)
+
+
+class TestSymbolCache(unittest.TestCase):
+    def loaded(self):
+        bars = pd.DataFrame({"Close": np.arange(100, dtype=float)})
+        return type("Loaded", (), {"ohlc": type("Ohlc", (), {"bars": bars})()})()
+
+    def cache(self, policy, pinned=None):
+        # room for three
+        size = memory_cache.resident_bytes(self.loaded())
+        return memory_cache.SymbolCache(size * 3, policy=policy, pinned=pinned)
+
+    def test_lru(self):
+        cache = self.cache(memory_cache.LRU)
+        for symbol in ["A", "B", "C"]:
+            cache.put(symbol, "1d", self.loaded())
+        cache.get("A", "1d")
+        # peeking isn't a use
+        cache.peek("B", "1d")
+
+        cache.put("D", "1d", self.loaded())
+        self.assertEqual(cache.keys(), [("C", "1d"), ("A", "1d"), ("D", "1d")])
+        cache.put("E", "1d", self.loaded())
+        self.assertEqual(cache.keys(), [("A", "1d"), ("D", "1d"), ("E", "1d")])
+        self.assertEqual(cache.evictions, 2)
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+    def test_lfu(self):
+        cache = self.cache(memory_cache.LFU)
+        for symbol, hits in [("A", 3), ("B", 1), ("C", 2)]:
+            cache.put(symbol, "1d", self.loaded())
+            for _ in range(hits):
+                cache.get(symbol, "1d")
+
+        cache.put("D", "1d", self.loaded())
+        self.assertNotIn(("B", "1d"), cache)
+        # what was just put stays, even with the fewest hits
+        cache.put("E", "1d", self.loaded())
+        self.assertEqual(sorted(cache.keys()), [("A", "1d"), ("C", "1d"), ("E", "1d")])
+
+    def test_pinned(self):
+        cache = self.cache(memory_cache.LRU, pinned=["A"])
+        cache.put("A", "1d", self.loaded())
+        cache.put("A", "1h", self.loaded())
+        cache.pin("B", "1d")
+        cache.put("B", "1d", self.loaded())
+        cache.put("B", "1h", self.loaded())
+        for symbol in ["C", "D"]:
+            cache.put(symbol, "1d", self.loaded())
+
+        # only unpinned entries go, over budget if that's all there is
+        self.assertEqual(
+            cache.keys(), [("A", "1d"), ("A", "1h"), ("B", "1d"), ("D", "1d")]
+        )
+        self.assertGreater(cache.current_bytes, cache.max_bytes)
+
+        # back within budget once they can go, oldest first
+        cache.unpin("A")
+        self.assertEqual(cache.keys(), [("A", "1h"), ("B", "1d"), ("D", "1d")])
+        self.assertTrue(cache.stats()["symbols"]["B"]["1d"]["pinned"])
+
+    def test_mapped_not_counted(self):
+        # mapped columns are shared between processes, only what's private counts
+        bars = pd.DataFrame(
+            {"Close": np.arange(100, dtype=float), "Up": np.arange(100) % 2 == 0},
+            index=pd.date_range("2023-01-02", periods=100, freq="h", tz="UTC"),
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            mapped = shared_frames.attach(
+                shared_frames.publish(bars, os.path.join(directory, "bars"))
+            )
+            loaded = type("Loaded", (), {"ohlc": type("Ohlc", (), {})()})()
+            loaded.ohlc.bars = mapped.iloc[10:]
+            index_bytes = loaded.ohlc.bars.index.memory_usage(deep=True)
+            self.assertEqual(memory_cache.resident_bytes(loaded), index_bytes)
+
+            loaded.ohlc.bars["PPO"] = 1.0
+            self.assertEqual(memory_cache.resident_bytes(loaded), index_bytes + 90 * 8)
+
+            loaded.ohlc.bars = bars
+            self.assertEqual(
+                memory_cache.resident_bytes(loaded),
+                bars.memory_usage(deep=True).sum(),
+            )
+
+
+class TestSymbolLoader(unittest.TestCase):
+    def test_single_flight(self):
+        calls = []
+
+        def factory(symbol, interval):
+            calls.append(symbol)
+            time.sleep(0.1)
+            if len(calls) == 1:
+                raise ValueError("upstream is down")
+            bars = pd.DataFrame({"Close": np.arange(10, dtype=float)})
+            return type("Loaded", (), {"ohlc": type("Ohlc", (), {"bars": bars})()})()
+
+        cache = memory_cache.SymbolCache(max_bytes=1024 * 1024)
+        symbol_loader = loader.SymbolLoader(cache, factory)
+
+        async def load_all():
+            return await asyncio.gather(
+                *[symbol_loader.get("ABC", "1d") for _ in range(10)],
+                return_exceptions=True,
+            )
+
+        # everyone waiting on a failed load gets the error, and it isn't kept
+        results = asyncio.run(load_all())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertIsNone(cache.peek("ABC", "1d"))
+
+        results = asyncio.run(load_all())
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertIs(cache.peek("ABC", "1d"), results[0])
+
+        # warm from then on
+        asyncio.run(load_all())
+        self.assertEqual(len(calls), 2)
+
+
+class TestRefresher(unittest.TestCase):
+    def test_next_boundary(self):
+        now = pd.Timestamp("2023-05-01 10:07:30", tz="UTC").timestamp()
+        for seconds, expected in [
+            (60, "2023-05-01 10:08"),
+            (300, "2023-05-01 10:10"),
+            (3600, "2023-05-01 11:00"),
+            (86400, "2023-05-02 00:00"),
+        ]:
+            self.assertEqual(
+                refresher.next_boundary(now, seconds),
+                pd.Timestamp(expected, tz="UTC").timestamp(),
+            )
+        # on a boundary is the next one
+        self.assertEqual(refresher.next_boundary(120.0, 60), 180.0)
+
+    def test_refresh_in_batches(self):
+        def loaded(rows):
+            bars = pd.DataFrame({"Close": np.arange(rows, dtype=float)})
+            return type("Loaded", (), {"ohlc": type("Ohlc", (), {"bars": bars})()})()
+
+        cache = memory_cache.SymbolCache(max_bytes=1024 * 1024)
+        for symbol in ["A", "B", "C"]:
+            cache.put(symbol, "1m", loaded(10))
+        cache.put("D", "1d", loaded(10))
+
+        refreshed = []
+        threads = set()
+
+        def refresh(symbol, interval, current, since):
+            if symbol == "B":
+                raise ValueError("upstream is down")
+            refreshed.append(symbol)
+            threads.add(threading.current_thread().name)
+            return loaded(11)
+
+        bar_refresher = refresher.BarRefresher(
+            cache, refresh, {"1m": 60, "1d": 86400}, batch_size=2, batch_pause=0
+        )
+        self.assertEqual(asyncio.run(bar_refresher.refresh("1m", 0)), 2)
+        self.assertEqual(sorted(refreshed), ["A", "C"])
+        # on its own threads, not the ones serving requests
+        self.assertTrue(all(t.startswith("bar-refresher") for t in threads))
+        self.assertEqual(len(cache.peek("A", "1m").ohlc.bars), 11)
+        # failures keep what was there
+        self.assertEqual(len(cache.peek("B", "1m").ohlc.bars), 10)
+        self.assertEqual(len(cache.peek("D", "1d").ohlc.bars), 10)
+        self.assertEqual(bar_refresher.stats()["failures"], 1)
+
+
+class TestMatchingEngine(unittest.TestCase):
+    def test_matches_per_order_lookups(self):
+        from matching_engine import MatchingEngine, BUY, SELL
+
+        rng = np.random.default_rng(7)
+        index = pd.date_range("2023-01-02", periods=40, freq="D", tz="UTC")
+        frames = dict()
+        for symbol in ["AAA", "BBB", "CCC"]:
+            # each symbol missing some bars, like a listing or a trading halt
+            keep = np.sort(rng.choice(len(index), 30, replace=False))
+            bars = pd.DataFrame(
+                {"Low": rng.uniform(5, 10, 30), "High": rng.uniform(10, 15, 30)},
+                index=index[keep],
+            )
+            frames[symbol] = bars
+
+        orders = dict()
+        for number in range(30):
+            side = BUY if rng.random() < 0.5 else SELL
+            limit = None
+            if rng.random() < 0.7:
+                limit = float(rng.uniform(6, 9) if side == BUY else rng.uniform(11, 14))
+            orders[f"order-{number}"] = (str(rng.choice(list(frames))), side, limit)
+
+        # what BackTestAPI did before the engine: a pandas lookup per open order
+        def per_order(open_orders, period):
+            fills = []
+            for order_id, (symbol, side, limit) in open_orders.items():
+                try:
+                    bar = frames[symbol].loc[period]
+                except KeyError:
+                    continue
+                price = bar["Low"] if side == BUY else bar["High"]
+                if limit is None or (price < limit if side == BUY else price > limit):
+                    fills.append((order_id, float(price)))
+            return fills
+
+        engine = MatchingEngine(buy_metric="Low", sell_metric="High", capacity=4)
+        engine.load_prices(frames)
+        open_orders = dict()
+        pending = list(orders.items())
+        for period in index:
+            # a few orders placed each tick, and whatever fills is taken off the book
+            for order_id, order in pending[:3]:
+                open_orders[order_id] = order
+                engine.add_order(order_id, *order)
+            pending = pending[3:]
+
+            expected = per_order(open_orders, period)
+            self.assertEqual(engine.match(period), expected)
+            for order_id, _ in expected:
+                del open_orders[order_id]
+                engine.remove_order(order_id)
+
+        self.assertEqual(engine.ticks, len(index))
+
+
+class TestOrderBook(unittest.TestCase):
+    def test_ledger(self):
+        from order_book import PositionLedger
+
+        ledger = PositionLedger()
+        self.assertFalse(ledger.sell("AAA", 1))
+        ledger.buy("AAA", 10, 2.0)
+        ledger.buy("AAA", 5, 4.0)
+        ledger.buy("BBB", 1, 100.0)
+        self.assertEqual(ledger.held("AAA"), (15, 40.0))
+
+        # oldest lot goes first, then part of the next one
+        self.assertTrue(ledger.sell("AAA", 12))
+        self.assertEqual(ledger.held("AAA"), (3, 12.0))
+        with self.assertRaises(ValueError):
+            ledger.sell("AAA", 4)
+        self.assertEqual(ledger.positions(), {"AAA": 3, "BBB": 1})
+
+        ledger.sell("AAA", 3)
+        self.assertNotIn("AAA", ledger)
+        self.assertEqual(ledger.held("AAA"), (0, 0))
+        self.assertEqual(ledger.positions(), {"BBB": 1})
+
+    def test_book(self):
+        from order_book import OrderBook
+
+        def order(order_id, symbol):
+            return type(
+                "Order",
+                (),
+                {"order_id": order_id, "symbol": symbol, "status_summary": "open"},
+            )()
+
+        book = OrderBook()
+        orders = [order("1", "AAA"), order("2", "BBB"), order("3", "AAA")]
+        for o in orders:
+            book.add(o)
+
+        orders[0].status_summary = "filled"
+        book.close("1")
+        book.close("1")
+        orders[1].status_summary = "cancelled"
+        book.close("2")
+
+        self.assertEqual(len(book), 3)
+        self.assertIsNone(book.get_open("1"))
+        self.assertIs(book.get("1"), orders[0])
+        # open first, then closed in the order they closed
+        self.assertEqual([o.order_id for o in book.list()], ["3", "1", "2"])
+        self.assertEqual([o.order_id for o in book.list(["AAA"])], ["3", "1"])
+        self.assertEqual([o.order_id for o in book.by_status("filled")], ["1"])
+        self.assertEqual([o.order_id for o in book.by_status("open")], ["3"])
+
+    def test_back_test_positions(self):
+        from monkey_back import BackTestAPI
+
+        index = pd.date_range("2023-01-02", periods=3, freq="D", tz="UTC")
+        clock = type("Clock", (), {"now": index[0], "_interval_name": "1d"})()
+        api = BackTestAPI(clock, back_testing_balance=1000)
+        api.load_prices(
+            {
+                "AAA": pd.DataFrame(
+                    {"Low": [9.0, 19.0, 29.0], "High": [11.0, 21.0, 31.0]}, index=index
+                )
+            }
+        )
+
+        self.assertEqual(api.buy_order_market("AAA", 10).status_summary, "filled")
+        self.assertEqual(api.get_position("AAA").quantity, 10)
+        self.assertEqual(api.get_account().assets["USD"], 890)
+
+        # a limit sell above the market waits, and cancelling it leaves the holding
+        limit = api.sell_order_limit("AAA", 5, 50.0)
+        self.assertEqual(limit.status_summary, "open")
+        self.assertEqual(api.cancel_order(limit.order_id).status_summary, "cancelled")
+
+        clock.now = index[1]
+        self.assertEqual(api.sell_order_market("AAA", 4).filled_unit_price, 19.0)
+        self.assertEqual(api.get_position("AAA").quantity, 6)
+        self.assertEqual(api._get_held_units("AAA"), (6, 66.0))
+        # can't sell more than is held
+        self.assertEqual(api.sell_order_market("AAA", 7).status_summary, "cancelled")
+
+        clock.now = index[2]
+        self.assertEqual(api.sell_order_limit("AAA", 6, 25.0).filled_unit_price, 29.0)
+        self.assertEqual(api.list_positions(), [])
+        self.assertEqual(api.get_account().assets["USD"], 890 + 76 + 174)
+
+
+class TestTickCalendar(unittest.TestCase):
+    def test_clock_skips_missing_bars(self):
+        index = pd.bdate_range("2023-01-02", periods=10, tz="Australia/Sydney")
+        calendar = TickCalendar.from_indexes([index[:6], index[4:].delete(1)])
+        self.assertEqual(len(calendar), 10)
+        self.assertEqual(
+            len(TickCalendar.from_indexes([index[:6], index[4:]], "intersection")), 2
+        )
+
+        # starting on a saturday, the first tick is monday
+        clock = BacktestClock(index[4] + pd.Timedelta(days=1), calendar=calendar)
+        clock.tick()
+        self.assertEqual(clock.now, index[5])
+
+        clock.now = index[-1]
+        with self.assertRaises(KeyError):
+            clock.tick()